@@ -9,24 +9,10 @@
 #
 # Finally fix image reader
 
-from slack_receipt_downloader import channel_history, format_excel_output
-# from receipt_processing import receipt_ocr_pipline
-from receipt_ocr import ocr_pipeline
-import os
-from dotenv import load_dotenv
+import sys
+import cli
 
-
-load_dotenv()  # Load env variables from .env
-CHANNEL_ID = os.environ["CHANNEL_ID"]
-
-def run_downloader():
-    channel_history(CHANNEL_ID)
-    format_excel_output()
-
-def run_ocr():
-    # receipt_ocr_pipline()
-    ocr_pipeline()
-
-print("- - - - - SLACK API RECEIPT DOWNLOADER - - - - -")
-run_downloader()
-run_ocr()
\ No newline at end of file
+# python app.py [--workers N] [--async-ingest] [--stream] [--in-memory] is `python cli.py run`.
+# Guarded so the OCR worker processes can import this file without re-running the pipeline
+if __name__ == "__main__":
+    sys.exit(cli.main(["run", *sys.argv[1:]]))
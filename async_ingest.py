@@ -0,0 +1,169 @@
+import os, time, asyncio, pathlib, tempfile
+import aiohttp
+from typing import Optional
+from slack_sdk.errors import SlackApiError
+from slack_sdk.web.async_client import AsyncWebClient
+from ledger import LEDGER_FLUSH_SIZE, LedgerWriter
+from receipt_store import RECEIPT_DB
+from receipt_ids import ReceiptIds
+from dedup import DedupIndex, FileCheck, allocation_key, duplicate_row, page_reposts
+from user_cache import UserDirectory
+from ingest_checkpoint import IngestCheckpoint, journal_key
+import telemetry
+from slack_receipt_downloader import (SLACK_API_URL, DOWNLOAD_WORKERS, CHUNK_SIZE, bot_token, slack_client,
+                                      page_files, make_row, change_file_name, renamed_file)
+import slack_receipt_downloader
+
+log = telemetry.get_logger("async_ingest")
+
+# Streams one file to a temp file and renames it into place, same as download_files
+async def download_file_async(http: aiohttp.ClientSession, file_url: str, save_path: pathlib.Path) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=save_path.parent, prefix=".", suffix=".part")
+    start = time.perf_counter()
+    try:
+        size = 0
+        with os.fdopen(fd, "wb") as f:
+            async with http.get(file_url, headers={"Authorization": f"Bearer {bot_token()}"}) as req:
+                req.raise_for_status()
+                async for chunk in req.content.iter_chunked(CHUNK_SIZE):
+                    f.write(chunk)
+                    size += len(chunk)
+        os.replace(tmp_path, save_path)
+        telemetry.downloaded(size)
+        telemetry.observe("stage_seconds", time.perf_counter() - start, stage="download_file")
+    except BaseException as e:
+        # covers cancellation too, no .part files left behind
+        pathlib.Path(tmp_path).unlink(missing_ok=True)
+        if isinstance(e, Exception):
+            telemetry.download_failed(e)
+        raise
+
+async def fetch_page_async(slack: AsyncWebClient, chan_id: str, oldest, cursor=None, limit: int = 200):
+    try:
+        response = await slack.conversations_history(channel=chan_id, oldest=oldest, cursor=cursor, limit=limit)
+    except SlackApiError as e:
+        telemetry.slack_call("conversations.history", e)
+        raise
+    telemetry.slack_call("conversations.history")
+    messages = response.get('messages',[])
+    next_cursor = response.get("response_metadata", {}).get("next_cursor")
+    return messages, next_cursor or None
+
+async def channel_history_async(chan_id: str, workers: int = DOWNLOAD_WORKERS, flush_size: int = LEDGER_FLUSH_SIZE,
+                                download_dir: Optional[pathlib.Path] = None, ts_json=None, db_path=RECEIPT_DB):
+    """Async version of channel_history: the next history page is fetched while the current page's
+    files download, with at most `workers` downloads in flight. Rows, receipt numbers and the
+    checkpoint/journal are the same as the sync path."""
+    download_dir = download_dir or slack_receipt_downloader.download_dir()
+    ckpt = IngestCheckpoint(ts_json or slack_receipt_downloader.ts_json())
+    ckpt.start_run()
+
+    slack = AsyncWebClient(token=bot_token(), base_url=SLACK_API_URL)
+    user_dir = UserDirectory(slack_client())
+    ledger = LedgerWriter(db_path, flush_size)
+    make_invoice = ReceiptIds(db_path, "R", download_dir)
+    dedup = DedupIndex(db_path)
+    limit = asyncio.Semaphore(workers)
+    pending_ids = []
+    prefetch: Optional[asyncio.Task] = None
+
+    def rows_written():
+        ckpt.mark_files(pending_ids)
+        pending_ids.clear()
+
+    async def bounded_download(http, url, path):
+        async with limit:
+            await download_file_async(http, url, path)
+
+    connector = aiohttp.TCPConnector(limit=workers)
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=30)
+
+    try:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as http:
+            while True:
+                if ckpt.page is None:
+                    try:
+                        if prefetch is not None:
+                            messages, next_cursor = await prefetch
+                            prefetch = None
+                        else:
+                            messages, next_cursor = await fetch_page_async(slack, chan_id, ckpt.oldest, ckpt.cursor)
+                    except SlackApiError as e:
+                        log.error("conversations.history failed, the next run resumes here", error=e.response.get("error"))
+                        return
+                    ckpt.save_page(messages, next_cursor)
+
+                next_cursor = ckpt.next_cursor
+                # overlap: ask for the next page while this one downloads
+                if next_cursor:
+                    prefetch = asyncio.create_task(fetch_page_async(slack, chan_id, ckpt.oldest, next_cursor))
+
+                todo = [(m, f) for m, f in page_files(ckpt.page)
+                        if not ckpt.is_done(journal_key(f, m.get("ts"))) and not dedup.ingested(f, m.get("ts"))]
+                checks = [dedup.before_download(f, m.get("ts")) for m, f in todo]
+                on_page = page_reposts(todo)
+                originals = {}
+                resumed = {i: path for i, ((m, f), check) in enumerate(zip(todo, checks))
+                           if not check.duplicate_of and i not in on_page
+                           and (path := renamed_file(make_invoice, ledger.store, f, download_dir))}
+                jobs = [(f.get("url_private_download"), download_dir / f"{f.get('id')}_{f['name']}") for m, f in todo]
+                # reposts of a file we already have are never downloaded, nor a second copy on this page
+                missing = [job for i, (job, check) in enumerate(zip(jobs, checks))
+                           if not check.duplicate_of and i not in on_page and i not in resumed and not job[1].exists()]
+
+                results = await asyncio.gather(*(bounded_download(http, url, path) for url, path in missing),
+                                               return_exceptions=True)
+                errors = {path: e for (_, path), e in zip(missing, results) if isinstance(e, BaseException)}
+
+                # Receipt numbers and ledger rows in message order, same as channel_history
+                for i, ((m, f), (url, downloaded_path), check) in enumerate(zip(todo, jobs, checks)):
+                    error = errors.get(downloaded_path)
+                    if error is not None:
+                        log.error("download failed", file=f['name'], error=str(error))
+                        raise error
+                    if not check.duplicate_of and i in on_page:
+                        check = FileCheck(originals[on_page[i]], exact=True, by_file_id=True)
+                    if i in resumed:
+                        downloaded_path = resumed[i]
+                    if not check.duplicate_of:
+                        check = await asyncio.to_thread(dedup.after_download, downloaded_path, f, m.get("ts"))
+
+                    user_name = await asyncio.to_thread(user_dir.get, f["user"])
+                    if i in resumed:
+                        invoice_num = make_invoice(f.get("id"))
+                    elif check.duplicate_of and check.exact:
+                        invoice_num = make_invoice(allocation_key(f, m.get("ts"), check))
+                        downloaded_path.unlink(missing_ok=True)
+                    else:
+                        invoice_num, new_path = change_file_name(downloaded_path, download_dir, make_invoice, f.get("id"))
+                    dedup.record(invoice_num, f, m.get("ts"), check)
+                    originals[i] = check.duplicate_of if check.duplicate_of and check.exact else invoice_num
+
+                    pending_ids.append(journal_key(f, m.get("ts")))
+                    if ledger.add(duplicate_row(make_row(m, user_name, invoice_num), check)):
+                        rows_written()
+
+                ledger.flush()
+                rows_written()
+                ckpt.page_done()
+
+                if not next_cursor:
+                    break
+
+        ckpt.finish()
+
+    finally:
+        # cancelled or failed: stop the prefetch and keep whatever rows are finished
+        if prefetch is not None and not prefetch.done():
+            prefetch.cancel()
+            await asyncio.gather(prefetch, return_exceptions=True)
+        ledger.close()
+        make_invoice.close()
+        dedup.close()
+        rows_written()
+        user_dir.save()
+        log.info("user cache", **user_dir.stats())
+
+def run_async_ingest(chan_id: str, workers: int = DOWNLOAD_WORKERS, flush_size: int = LEDGER_FLUSH_SIZE):
+    with telemetry.span("channel_history_async"):
+        asyncio.run(channel_history_async(chan_id, workers, flush_size))
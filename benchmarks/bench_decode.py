@@ -0,0 +1,140 @@
+# Decode time per format: the same synthetic receipts saved as JPEG, PNG, HEIC, a PDF with a text layer
+# and a scanned (image only) PDF, opened through decoder.ReceiptSource. With --ocr the whole ReceiptOCR
+# runs too, which shows what skipping tesseract on text layer PDFs is worth. The imread row is the old
+# full colour cv2.imread of the JPEGs, next to the grey (and for big photos reduced scale) decode.
+#
+#   python -m benchmarks.bench_decode --receipts 50
+#   python -m benchmarks.bench_decode --receipts 20 --ocr
+#   python -m benchmarks.bench_decode --scale 5      big photos, where the reduced JPEG decode kicks in
+#   python -m benchmarks.bench_decode --scale 5 --ocr   also OCR the JPEGs decoded at 1/1 and 1/2,
+#                                                       needed before DECODE_MIN_LONG_SIDE gets a default
+import sys, time, random, argparse, tempfile
+import cv2
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import decoder
+from decoder import ReceiptSource, jpeg_size
+from benchmarks.synthetic_receipts import make_truth, receipt_lines, render
+
+def write_pdf_text(path: Path, lines: list[str]) -> None:
+    import fitz
+    doc = fitz.open()
+    page = doc.new_page(width=300, height=40 + 14 * len(lines))
+    for i, text in enumerate(lines):
+        page.insert_text((20, 30 + 14 * i), text, fontname="cour", fontsize=10)
+    doc.save(path)
+    doc.close()
+
+def write_pdf_scan(path: Path, jpeg: Path) -> None:
+    import fitz
+    doc = fitz.open()
+    img = cv2.imread(str(jpeg))
+    # page sized so the photo comes out at about 200 dpi
+    page = doc.new_page(width=img.shape[1] * 72 / 200, height=img.shape[0] * 72 / 200)
+    page.insert_image(page.rect, filename=str(jpeg))
+    doc.save(path)
+    doc.close()
+
+def write_heic(path: Path, img) -> None:
+    from pillow_heif import from_bytes
+    rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    from_bytes(mode="RGB", size=(rgb.shape[1], rgb.shape[0]), data=rgb.tobytes()).save(path, quality=90)
+
+# One file per format per receipt, formats whose library isn't installed are left out
+def make_corpus(out_dir: Path, n: int, seed: int, scale: float = 2.0) -> dict[str, list[tuple[Path, dict]]]:
+    rng = random.Random(seed)
+    corpus: dict[str, list[tuple[Path, dict]]] = {}
+    missing = set()
+
+    for i in range(n):
+        truth = make_truth(rng)
+        img = render(truth, rng, scale=scale)
+        jpeg, png = out_dir / f"r{i:04d}.jpg", out_dir / f"r{i:04d}.png"
+        cv2.imwrite(str(jpeg), img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        cv2.imwrite(str(png), img)
+        corpus.setdefault("jpeg", []).append((jpeg, truth))
+        corpus.setdefault("png", []).append((png, truth))
+
+        for fmt, path, write in (("heic", out_dir / f"r{i:04d}.heic", lambda p: write_heic(p, img)),
+                                 ("pdf-text", out_dir / f"r{i:04d}_text.pdf", lambda p: write_pdf_text(p, receipt_lines(truth))),
+                                 ("pdf-scan", out_dir / f"r{i:04d}_scan.pdf", lambda p: write_pdf_scan(p, jpeg))):
+            if fmt in missing:
+                continue
+            try:
+                write(path)
+            except ImportError as e:
+                print(f"skipping {fmt}: {e}")
+                missing.add(fmt)
+                continue
+            corpus.setdefault(fmt, []).append((path, truth))
+    return corpus
+
+# Decodes every page, returns the bytes of pixels that came out
+def decode_all(path: Path, grey: bool = True) -> int:
+    with ReceiptSource(path, grey=grey) as source:
+        return 0 if source.text_layer else sum(page.nbytes for page in source.pages())
+
+def imread_all(path: Path) -> int:
+    return cv2.imread(str(path)).nbytes
+
+# ReceiptOCR of each JPEG with the decoder forced to the given scale, (ms per receipt, share of totals right)
+def ocr_at_scale(files, scale: int) -> tuple[float, float]:
+    from receipt_ocr import ReceiptOCR
+    old = decoder.DECODE_MIN_LONG_SIDE
+    ok, elapsed = 0, 0.0
+    try:
+        for path, truth in files:
+            # just above long side / (2 x scale) so jpeg_scale stops at exactly this scale
+            decoder.DECODE_MIN_LONG_SIDE = 0 if scale == 1 else max(jpeg_size(path.read_bytes())) // (2 * scale) + 1
+            start = time.perf_counter()
+            rec = ReceiptOCR(receipt_path=path)
+            elapsed += time.perf_counter() - start
+            ok += rec.cost_text == truth["total"]
+    finally:
+        decoder.DECODE_MIN_LONG_SIDE = old
+    return elapsed / len(files) * 1000, ok / len(files)
+
+def time_decode(fn, files) -> tuple[float, float]:
+    start = time.perf_counter()
+    pixels = sum(fn(path) for path, _ in files)
+    return (time.perf_counter() - start) / len(files) * 1000, pixels / len(files) / 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Receipt decode benchmark")
+    parser.add_argument("--receipts", type=int, default=30)
+    parser.add_argument("--ocr", action="store_true", help="also time full ReceiptOCR per format")
+    parser.add_argument("--scale", type=float, default=2.0, help="render scale, 5 gives 4000px phone photo sized JPEGs")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench_decode_") as tmp:
+        corpus = make_corpus(Path(tmp), args.receipts, args.seed, args.scale)
+        if args.ocr:
+            from receipt_ocr import ReceiptOCR
+
+        print(f"{'format':<10}{'files':>6}{'decode ms':>12}{'pixel MB':>10}" + (f"{'ocr ms':>12}{'total ok':>10}" if args.ocr else ""))
+        ms, mb = time_decode(imread_all, corpus["jpeg"])
+        print(f"{'imread':<10}{len(corpus['jpeg']):>6}{ms:>12.2f}{mb:>10.2f}")
+
+        for fmt, files in corpus.items():
+            ms, mb = time_decode(decode_all, files)
+            line = f"{fmt:<10}{len(files):>6}{ms:>12.2f}{mb:>10.2f}"
+
+            if args.ocr:
+                start = time.perf_counter()
+                recs = [(ReceiptOCR(receipt_path=path), truth) for path, truth in files]
+                ms = (time.perf_counter() - start) / len(files) * 1000
+                ok = sum(rec.cost_text == truth["total"] for rec, truth in recs) / len(files)
+                line += f"{ms:>12.1f}{ok:>10.0%}"
+            print(line)
+
+        if args.ocr:
+            # same JPEGs, full decode against the 1/2 reduced one
+            for scale in (1, 2):
+                ms, ok = ocr_at_scale(corpus["jpeg"], scale)
+                print(f"{f'jpeg 1/{scale}':<10}{len(corpus['jpeg']):>6}{'':>12}{'':>10}{ms:>12.1f}{ok:>10.0%}")
+
+if __name__ == "__main__":
+    main()
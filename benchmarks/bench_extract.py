@@ -0,0 +1,102 @@
+# Field extraction throughput: the old multi-pass _extract_text against field_extractor.extract_fields.
+# The corpus is receipt text from synthetic_receipts (known answers), or real OCR output saved as .txt.
+#
+#   python -m benchmarks.bench_extract --receipts 2000 --repeat 20
+#   python -m benchmarks.bench_extract --corpus ocr_text_dir
+import re, sys, time, random, argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from field_extractor import extract_fields
+from benchmarks.synthetic_receipts import make_truth, receipt_lines
+
+LEGACY_DATE_PATTERNS = (
+    re.compile(r"\d{2}-[A-Z]{3}-\d{4}", re.I),
+    re.compile(r"\d{2}-\d{2}-\d{4}"),
+    re.compile(r"\d{2}-\d{2}-\d{2}"),
+    re.compile(r"\d{2}/\d{2}/\d{4}"),
+    re.compile(r"\d{2}/\d{2}/\d{2}"),
+)
+
+# ReceiptOCR._extract_text as it was, minus the prints
+def legacy_extract(text: str) -> dict:
+    found = {"supplier": None, "date": None, "total": None}
+    lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
+    if lines:
+        found["supplier"] = lines[0]
+
+    for line in lines:
+        if "total" in line.lower():
+            match = re.search(r"\$?\s?\d[\d,]*\.?\d{0,2}", line)
+            if match:
+                found["total"] = match.group(0).replace(" ", "")
+                break
+
+    for line in lines:
+        for pattern in LEGACY_DATE_PATTERNS:
+            match = pattern.search(line)
+            if match:
+                found["date"] = match.group(0)
+                break
+        if found["date"]:
+            break
+    return found
+
+def synthetic_corpus(n: int, seed: int) -> tuple[list[str], list[dict]]:
+    rng = random.Random(seed)
+    truths = [make_truth(rng) for _ in range(n)]
+    return ["\n".join(receipt_lines(t)) for t in truths], truths
+
+def throughput(fn, corpus: list[str], repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in corpus:
+            fn(text)
+    return len(corpus) * repeat / (time.perf_counter() - start)
+
+def legacy_accuracy(corpus: list[str], truths: list[dict]) -> dict:
+    hits = {"supplier": 0, "date": 0, "total": 0}
+    for text, truth in zip(corpus, truths):
+        found = legacy_extract(text)
+        hits["supplier"] += found["supplier"] == truth["supplier"].upper()
+        hits["date"] += found["date"] == truth["date"]
+        hits["total"] += (found["total"] or "").lstrip("$") == truth["total"]
+    return {k: round(v / max(len(corpus), 1), 3) for k, v in hits.items()}
+
+def accuracy(corpus: list[str], truths: list[dict]) -> dict:
+    hits = {"supplier": 0, "date": 0, "total": 0, "subtotal": 0, "tax": 0}
+    for text, truth in zip(corpus, truths):
+        found = extract_fields(text)
+        hits["supplier"] += found.supplier == truth["supplier"].upper()
+        hits["date"] += found.date == truth["date_iso"]
+        hits["total"] += found.total == truth["total"]
+        hits["subtotal"] += found.subtotal == truth["subtotal"]
+        hits["tax"] += found.tax == truth["tax"]
+    return {k: round(v / max(len(corpus), 1), 3) for k, v in hits.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description="Field extraction micro-benchmark")
+    parser.add_argument("--receipts", type=int, default=1000, help="synthetic receipt texts")
+    parser.add_argument("--corpus", help="folder of .txt OCR output to use instead")
+    parser.add_argument("--repeat", type=int, default=10, help="passes over the corpus")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    truths = None
+    if args.corpus:
+        corpus = [p.read_text(errors="replace") for p in sorted(Path(args.corpus).glob("*.txt"))]
+    else:
+        corpus, truths = synthetic_corpus(args.receipts, args.seed)
+
+    legacy = throughput(legacy_extract, corpus, args.repeat)
+    single = throughput(extract_fields, corpus, args.repeat)
+    print(f"{len(corpus)} receipts x {args.repeat}")
+    print(f"  legacy _extract_text  {legacy:12,.0f} receipts/s  (supplier, date, total)")
+    print(f"  extract_fields        {single:12,.0f} receipts/s  (+ subtotal, tax, currency, ISO date, confidence)")
+    if truths is not None:
+        print(f"  legacy accuracy:         {legacy_accuracy(corpus, truths)}")
+        print(f"  extract_fields accuracy: {accuracy(corpus, truths)}")
+
+if __name__ == "__main__":
+    main()
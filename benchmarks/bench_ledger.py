@@ -0,0 +1,87 @@
+# Compares the old per row ledger write (append + restyle whole sheet) against LedgerWriter
+# (rows into the receipt store) plus one export_excel at the end.
+# Prints the average ms per row for each window of rows as the ledger grows.
+#
+#   python -m benchmarks.bench_ledger --rows 600 --window 100
+import os, sys, time, argparse, tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# slack_receipt_downloader reads these when imported, the benchmark never talks to slack
+_tmp = tempfile.mkdtemp(prefix="bench_ledger_")
+for key, value in {
+    "SLACK_BOT_TOKEN": "xoxb-bench",
+    "CHANNEL_ID": "CBENCH",
+    "DOWNLOAD_LOC": os.path.join(_tmp, "downloads"),
+    "TS_JSON": os.path.join(_tmp, "last_ts.json"),
+}.items():
+    os.environ.setdefault(key, value)
+
+from ledger import LedgerWriter, export_excel
+
+def make_row(i: int) -> dict:
+    return {
+        "Download_Date": "2025-09-03",
+        "Purchase_Name": "REPLACE",
+        "Purchase_Date": "Bot_Holder",
+        "Description": "REPLACE",
+        "Supplier": "Bot_Holder",
+        "Cost": "Bot_Holder",
+        "Message": f"receipt {i}",
+        "Purchaser": "Bench User",
+        "Receipt_Number": f"R{i:03d}",
+        "Reimbursed": "False",
+        "Error_Flag": "Null",
+    }
+
+def bench_legacy(excel_path: str, n_rows: int) -> list[float]:
+    import slack_receipt_downloader as srd
+
+    os.environ["EXCEL_PATH"] = excel_path
+    timings = []
+    for i in range(n_rows):
+        start = time.perf_counter()
+        srd.upload_collection_excel_local(make_row(i))
+        srd.format_excel_output()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def bench_writer(db_path: str, excel_path: str, n_rows: int, flush_size: int) -> list[float]:
+    timings = []
+    with LedgerWriter(db_path, flush_size) as ledger:
+        for i in range(n_rows):
+            start = time.perf_counter()
+            ledger.add(make_row(i))
+            timings.append(time.perf_counter() - start)
+
+        # the last partial batch and the workbook export are part of the cost of the final rows
+        start = time.perf_counter()
+        ledger.flush()
+        export_excel(excel_path, db_path)
+        timings[-1] += time.perf_counter() - start
+    return timings
+
+def report(name: str, timings: list[float], window: int):
+    print(f"\n{name}: {sum(timings):.2f}s total for {len(timings)} rows")
+    for start in range(0, len(timings), window):
+        chunk = timings[start:start + window]
+        print(f"  rows {start + 1:>5}-{start + len(chunk):<5} {1000 * sum(chunk) / len(chunk):8.2f} ms/row")
+
+def main():
+    parser = argparse.ArgumentParser(description="Ledger write benchmark")
+    parser.add_argument("--rows", type=int, default=600)
+    parser.add_argument("--window", type=int, default=100)
+    parser.add_argument("--flush-size", type=int, default=100)
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+
+    report(f"LedgerWriter (flush_size={args.flush_size})",
+           bench_writer(os.path.join(_tmp, "writer.sqlite"), os.path.join(_tmp, "writer.xlsx"), args.rows, args.flush_size), args.window)
+
+    if not args.skip_legacy:
+        report("upload_collection_excel_local + format_excel_output",
+               bench_legacy(os.path.join(_tmp, "legacy.xlsx"), args.rows), args.window)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# Local stand-in for the bits of the Slack Web API the downloader uses, so benchmarks run offline.
+# Serves conversations.history (newest first, cursor paging, oldest filter), users.list, users.info,
+# files.info and the files themselves.
+import json, threading
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+class FakeSlack:
+    def __init__(self, files_dir: Path, file_names: list[str], n_users: int = 50,
+                 start_ts: float = 1756000000.0, host: str = "127.0.0.1", port: int = 0):
+        self.files_dir = Path(files_dir)
+        self.users = [{"id": f"U{i:05d}", "profile": {"real_name": f"Bench User {i}"}} for i in range(n_users)]
+        self.calls: dict[str, int] = {}
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.base = f"http://{host}:{self.server.server_address[1]}"
+
+        # one file per message, oldest first
+        self.messages = []
+        for i, name in enumerate(file_names):
+            ts = f"{start_ts + i * 60:.6f}"
+            user = self.users[i % n_users]["id"]
+            self.messages.append({
+                "ts": ts,
+                "user": user,
+                "text": f"receipt {i}",
+                "files": [{
+                    "id": f"F{i:07d}",
+                    "name": name,
+                    "user": user,
+                    "size": (self.files_dir / name).stat().st_size,
+                    "url_private_download": f"{self.base}/files/{name}",
+                }],
+            })
+
+    @property
+    def api_url(self) -> str:
+        return f"{self.base}/api/"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _history(self, params: dict) -> dict:
+        oldest = float(params.get("oldest") or 0)
+        limit = int(params.get("limit") or 100)
+        offset = int(params.get("cursor") or 0)
+
+        newest_first = [m for m in reversed(self.messages) if float(m["ts"]) > oldest]
+        page = newest_first[offset:offset + limit]
+        next_cursor = str(offset + limit) if offset + limit < len(newest_first) else ""
+        return {"ok": True, "messages": page, "has_more": bool(next_cursor),
+                "response_metadata": {"next_cursor": next_cursor}}
+
+    def _users_list(self, params: dict) -> dict:
+        limit = int(params.get("limit") or 200)
+        offset = int(params.get("cursor") or 0)
+        next_cursor = str(offset + limit) if offset + limit < len(self.users) else ""
+        return {"ok": True, "members": self.users[offset:offset + limit],
+                "response_metadata": {"next_cursor": next_cursor}}
+
+    def _users_info(self, params: dict) -> dict:
+        for user in self.users:
+            if user["id"] == params.get("user"):
+                return {"ok": True, "user": user}
+        return {"ok": False, "error": "user_not_found"}
+
+    def _files_info(self, params: dict) -> dict:
+        for m in self.messages:
+            for f in m["files"]:
+                if f["id"] == params.get("file"):
+                    return {"ok": True, "file": f}
+        return {"ok": False, "error": "file_not_found"}
+
+    # Events API envelopes for every message, for event_listener.py --replay
+    def write_events(self, path, channel: str = "CBENCH") -> None:
+        with open(path, "w") as f:
+            for m in self.messages:
+                event = {"type": "message", "subtype": "file_share", "channel": channel, **m}
+                f.write(json.dumps({"type": "event_callback", "event": event}) + "\n")
+
+    def _handler(self):
+        fake = self
+        methods = {
+            "conversations.history": self._history,
+            "users.list": self._users_list,
+            "users.info": self._users_info,
+            "files.info": self._files_info,
+        }
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _params(self) -> dict:
+                url = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    body = self.rfile.read(length).decode()
+                    if self.headers.get("Content-Type", "").startswith("application/json"):
+                        params.update(json.loads(body))
+                    else:
+                        params.update({k: v[0] for k, v in parse_qs(body).items()})
+                return params
+
+            def _send(self, status: int, body: bytes, content_type: str):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _dispatch(self):
+                path = urlparse(self.path).path
+                if path.startswith("/files/"):
+                    fake.calls["files"] = fake.calls.get("files", 0) + 1
+                    target = fake.files_dir / Path(path).name
+                    if not target.exists():
+                        return self._send(404, b"not found", "text/plain")
+                    return self._send(200, target.read_bytes(), "application/octet-stream")
+
+                method = path.rsplit("/", 1)[-1]
+                if method not in methods:
+                    return self._send(200, json.dumps({"ok": False, "error": "unknown_method"}).encode(), "application/json")
+
+                fake.calls[method] = fake.calls.get(method, 0) + 1
+                self._send(200, json.dumps(methods[method](self._params())).encode(), "application/json")
+
+            do_GET = _dispatch
+            do_POST = _dispatch
+
+        return Handler
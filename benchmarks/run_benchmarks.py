@@ -0,0 +1,203 @@
+# End to end benchmark: synthetic receipts -> fake Slack -> download -> ledger -> OCR -> extraction -> merge -> export.
+# Each stage is timed on its own and written to a JSON report. Pass --baseline with an older report
+# and the run exits 1 when any stage got slower per item than --max-regression allows.
+#
+#   python -m benchmarks.run_benchmarks --receipts 2000 --ocr-sample 50 --report bench_report.json
+#   python -m benchmarks.run_benchmarks --baseline bench_report.json --max-regression 0.25
+import os, sys, json, time, random, argparse, tempfile, platform
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.synthetic_receipts import generate
+from benchmarks.fake_slack import FakeSlack
+
+class StageTimer:
+    def __init__(self):
+        self.stages: dict[str, dict] = {}
+
+    def time(self, name: str, items: int, fn, *args, **kwargs):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        self.stages[name] = {
+            "items": items,
+            "seconds": round(seconds, 4),
+            "ms_per_item": round(1000 * seconds / max(items, 1), 4),
+        }
+        print(f"{name:<28}{items:>7} items {seconds:9.3f}s {self.stages[name]['ms_per_item']:10.3f} ms/item")
+        return result
+
+# Points every module at a scratch directory and the fake Slack, has to happen before they're imported
+def configure_env(work: Path, api_url: str) -> None:
+    os.environ.update({
+        "SLACK_BOT_TOKEN": "xoxb-bench",
+        "CHANNEL_ID": "CBENCH",
+        "SLACK_API_URL": api_url,
+        "DOWNLOAD_LOC": str(work / "downloads"),
+        "TS_JSON": str(work / "last_ts.json"),
+        "EXCEL_PATH": str(work / "ledger.xlsx"),
+        "RECEIPT_DB": str(work / "receipts.sqlite"),
+        "STATE_DB": str(work / "state.sqlite"),
+        "OCR_CACHE_DB": str(work / "ocr_cache.sqlite"),
+        "USER_CACHE_JSON": str(work / "users.json"),
+    })
+
+def fresh_extractor(receipt_ocr):
+    rec = receipt_ocr.ReceiptOCR.__new__(receipt_ocr.ReceiptOCR)
+    rec.purchase_date = rec.supplier = rec.cost_text = rec.subtotal = rec.tax = rec.currency = None
+    rec.field_conf, rec.timings = {}, {}
+    return rec
+
+def field_accuracy(found: dict, manifest: dict) -> dict:
+    hits = {"supplier": 0, "date": 0, "total": 0}
+    for name, fields in found.items():
+        truth = manifest[name]
+        hits["supplier"] += bool(fields.get("Supplier")) and truth["supplier"].upper() in str(fields["Supplier"]).upper()
+        hits["date"] += fields.get("Purchase_Date") == truth["date_iso"]
+        hits["total"] += str(fields.get("Cost") or "").lstrip("$") == truth["total"]
+    n = max(len(found), 1)
+    return {k: round(v / n, 3) for k, v in hits.items()}
+
+def check_regressions(report: dict, baseline: dict, max_regression: float) -> list[str]:
+    failures = []
+    for name, stage in report["stages"].items():
+        if name not in baseline or not baseline[name]["ms_per_item"]:
+            continue
+        ratio = stage["ms_per_item"] / baseline[name]["ms_per_item"]
+        if ratio > 1 + max_regression:
+            failures.append(f"{name}: {baseline[name]['ms_per_item']} -> {stage['ms_per_item']} ms/item ({ratio:.2f}x)")
+    return failures
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Receipt pipeline benchmark")
+    parser.add_argument("--receipts", type=int, default=500, help="synthetic receipts posted to the fake channel")
+    parser.add_argument("--ocr-sample", type=int, default=25, help="receipts run through tesseract")
+    parser.add_argument("--legacy-ledger-rows", type=int, default=100, help="rows written the old one-by-one way")
+    parser.add_argument("--extract-repeat", type=int, default=200, help="passes over the OCR text corpus")
+    parser.add_argument("--workers", type=int, default=4, help="download workers")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", help="keep generated files here instead of a temp dir")
+    parser.add_argument("--report", default="bench_report.json")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.25, help="allowed slowdown per stage, 0.25 = 25%%")
+    args = parser.parse_args()
+
+    # read up front, --report may point at the same file
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["stages"]
+
+    work = Path(args.work_dir or tempfile.mkdtemp(prefix="receipt_bench_"))
+    timer = StageTimer()
+
+    manifest = timer.time("generate_receipts", args.receipts, generate, work / "source", args.receipts, args.seed)
+    truth = {Path(m["file"]).stem: m for m in manifest}
+
+    with FakeSlack(work / "source", [m["file"] for m in manifest]) as slack:
+        configure_env(work, slack.api_url)
+        import slack_receipt_downloader as srd
+        from ledger import LedgerWriter, export_excel
+
+        all_files = timer.time("history_paging", args.receipts, srd.fetch_history, "CBENCH", 0)
+
+        jobs = [(f["url_private_download"], srd.DOWNLOAD_DIR / f["name"]) for _, f in all_files]
+        results = timer.time("downloads", len(jobs), srd.download_batch, jobs, args.workers)
+        failed = [e for e in results if e is not None]
+        if failed:
+            print(f"[ERROR] {len(failed)} downloads failed, first: {failed[0]}")
+
+        # whole async ingest (paging overlapped with downloads, ledger rows, checkpoints) into its own folder
+        import asyncio
+        from async_ingest import channel_history_async
+        async_dir = work / "async_downloads"
+        async_dir.mkdir(exist_ok=True)
+        timer.time("ingest_async", args.receipts, asyncio.run, channel_history_async(
+            "CBENCH", args.workers, download_dir=async_dir, ts_json=work / "async_ts.json",
+            db_path=work / "async_receipts.sqlite"))
+
+    rows = [{"Download_Date": "2025-09-03", "Purchase_Name": "REPLACE", "Purchase_Date": "Bot_Holder",
+             "Description": "REPLACE", "Supplier": "Bot_Holder", "Cost": "Bot_Holder",
+             "Message": m.get("text"), "Purchaser": "Bench User", "Receipt_Number": Path(f["name"]).stem,
+             "Reimbursed": "False", "Error_Flag": "Null"} for m, f in all_files]
+
+    def legacy_ledger(n):
+        os.environ["EXCEL_PATH"] = str(work / "legacy_ledger.xlsx")
+        for row in rows[:n]:
+            srd.upload_collection_excel_local(row)
+            srd.format_excel_output()
+        os.environ["EXCEL_PATH"] = str(work / "ledger.xlsx")
+
+    def batched_ledger():
+        with LedgerWriter() as ledger:
+            for row in rows:
+                ledger.add(row)
+
+    n_legacy = min(args.legacy_ledger_rows, len(rows))
+    timer.time("ledger_upload_collection", n_legacy, legacy_ledger, n_legacy)
+    timer.time("ledger_writer", len(rows), batched_ledger)
+
+    import receipt_ocr
+
+    sample = random.Random(args.seed).sample(sorted(srd.DOWNLOAD_DIR.iterdir()), min(args.ocr_sample, len(rows)))
+
+    def ocr_sample():
+        return {p.stem: receipt_ocr.process_receipt(p) for p in sample}
+
+    recs = timer.time("receipt_ocr", len(sample), ocr_sample)
+    ocr_fields = {name: {"Purchase_Date": r.purchase_date, "Supplier": r.supplier, "Cost": r.cost_text or None}
+                  for name, r in recs.items()}
+    corpus = [r.text for r in recs.values() if r.text]
+
+    # two pass region OCR on the same sample, the full page pass only runs where it falls back
+    from roi_ocr import process_two_pass
+    roi_recs = timer.time("receipt_ocr_roi", len(sample), lambda: {p.stem: process_two_pass(p) for p in sample})
+    roi_fields = {name: {"Purchase_Date": r.purchase_date, "Supplier": r.supplier, "Cost": r.cost_text or None}
+                  for name, r in roi_recs.items()}
+    roi_fallbacks = sum(r.fallback for r in roi_recs.values())
+
+    def extract_corpus():
+        for _ in range(args.extract_repeat):
+            for text in corpus:
+                fresh_extractor(receipt_ocr)._extract_text(text)
+
+    timer.time("extract_text", len(corpus) * args.extract_repeat, extract_corpus)
+
+    timer.time("combine_data_sources", len(ocr_fields), receipt_ocr.combine_data_sources, ocr_fields)
+    timer.time("export_excel", len(rows), export_excel, work / "ledger.xlsx")
+
+    report = {
+        "meta": {
+            "receipts": args.receipts,
+            "ocr_sample": len(sample),
+            "workers": args.workers,
+            "seed": args.seed,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "slack_calls": slack.calls,
+            "work_dir": str(work),
+        },
+        "stages": timer.stages,
+        "accuracy": field_accuracy(ocr_fields, truth),
+        "roi": {
+            "accuracy": field_accuracy(roi_fields, truth),
+            "full_page_fallbacks": roi_fallbacks,
+            "fallback_rate": round(roi_fallbacks / max(len(sample), 1), 3),
+        },
+    }
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\naccuracy: {report['accuracy']}\nroi: {report['roi']}\nreport written to {args.report}")
+
+    if baseline is not None:
+        failures = check_regressions(report, baseline, args.max_regression)
+        if failures:
+            print("\nREGRESSIONS:\n  " + "\n  ".join(failures))
+            return 1
+        print(f"no stage regressed more than {args.max_regression:.0%} against {args.baseline}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
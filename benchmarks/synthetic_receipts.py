@@ -0,0 +1,103 @@
+# Renders fake receipt photos with known supplier / date / total so OCR accuracy and speed can be measured.
+#
+#   python -m benchmarks.synthetic_receipts --count 100 --out bench_receipts
+import json, random, argparse
+import cv2
+import numpy as np
+from pathlib import Path
+from datetime import date, timedelta
+
+SUPPLIERS = ["Home Depot", "Canadian Tire", "Staples", "Walmart", "Costco", "Best Buy",
+             "Dollarama", "Shoppers Drug Mart", "Princess Auto", "Lee Valley"]
+ITEMS = ["Zip ties", "Wood glue", "Paint roller", "Extension cord", "Printer paper", "Batteries",
+         "Duct tape", "Sandpaper", "Drill bits", "Markers", "Poster board", "Screws 100pk"]
+MONTHS = ["JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC"]
+
+# Same shapes DATE_PATTERNS knows about
+def format_date(d: date, style: int) -> str:
+    return [
+        f"{d.day:02d}-{MONTHS[d.month - 1]}-{d.year}",
+        f"{d.month:02d}-{d.day:02d}-{d.year}",
+        f"{d.month:02d}/{d.day:02d}/{d.year}",
+        f"{d.month:02d}/{d.day:02d}/{d.year % 100:02d}",
+    ][style]
+
+def make_truth(rng: random.Random) -> dict:
+    items = [(rng.choice(ITEMS), round(rng.uniform(1, 80), 2)) for _ in range(rng.randint(2, 8))]
+    subtotal = round(sum(price for _, price in items), 2)
+    tax = round(subtotal * 0.13, 2)
+    purchase = date(2025, 1, 1) + timedelta(days=rng.randint(0, 364))
+    return {
+        "supplier": rng.choice(SUPPLIERS),
+        "date": format_date(purchase, rng.randint(0, 3)),
+        "date_iso": purchase.isoformat(),
+        "items": items,
+        "subtotal": f"{subtotal:.2f}",
+        "tax": f"{tax:.2f}",
+        "total": f"{subtotal + tax:.2f}",
+    }
+
+def receipt_lines(truth: dict) -> list[str]:
+    lines = [truth["supplier"].upper(), "123 MAIN ST", f"DATE {truth['date']}", ""]
+    lines += [f"{name:<18}{price:>8.2f}" for name, price in truth["items"]]
+    lines += ["", f"{'SUBTOTAL':<18}{truth['subtotal']:>8}", f"{'HST 13%':<18}{truth['tax']:>8}",
+              f"{'TOTAL':<18}${truth['total']:>7}", "", "THANK YOU"]
+    return lines
+
+def render(truth: dict, rng: random.Random, scale: float = 1.0, noise: float = 0.0, rotation: float = 0.0) -> np.ndarray:
+    lines = receipt_lines(truth)
+    line_h, width = 34, 520
+    paper = np.full((line_h * (len(lines) + 2), width), 245, np.uint8)
+    for i, text in enumerate(lines):
+        cv2.putText(paper, text, (20, line_h * (i + 1) + 10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, 20, 2, cv2.LINE_AA)
+
+    # paper on a darker table, like a phone photo
+    h, w = paper.shape
+    canvas = np.full((int(h * 1.4), int(w * 1.6)), 70, np.uint8)
+    y, x = (canvas.shape[0] - h) // 2, (canvas.shape[1] - w) // 2
+    canvas[y:y + h, x:x + w] = paper
+
+    if rotation:
+        ch, cw = canvas.shape
+        matrix = cv2.getRotationMatrix2D((cw / 2, ch / 2), rotation, 1.0)
+        canvas = cv2.warpAffine(canvas, matrix, (cw, ch), borderValue=70)
+
+    if scale != 1.0:
+        canvas = cv2.resize(canvas, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+
+    if noise:
+        grain = np.random.default_rng(rng.randint(0, 2**32 - 1)).normal(0, noise, canvas.shape)
+        canvas = np.clip(canvas + grain, 0, 255).astype(np.uint8)
+
+    return cv2.cvtColor(canvas, cv2.COLOR_GRAY2BGR)
+
+def generate(out_dir: Path, count: int, seed: int = 0, scales=(1.0, 2.0, 4.0),
+             max_noise: float = 12.0, max_rotation: float = 5.0) -> list[dict]:
+    """Writes count JPEGs to out_dir plus manifest.json, returns the manifest entries."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    manifest = []
+
+    for i in range(count):
+        truth = make_truth(rng)
+        scale = rng.choice(scales)
+        noise = rng.uniform(0, max_noise)
+        rotation = rng.uniform(-max_rotation, max_rotation)
+        name = f"synthetic_{i:05d}.jpg"
+
+        img = render(truth, rng, scale, noise, rotation)
+        cv2.imwrite(str(out_dir / name), img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        manifest.append({"file": name, "scale": scale, "noise": round(noise, 2),
+                         "rotation": round(rotation, 2), **truth})
+
+    with open(out_dir / "manifest.json", "w") as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Synthetic receipt generator")
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--out", default="bench_receipts")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    generate(Path(args.out), args.count, args.seed)
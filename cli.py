@@ -0,0 +1,167 @@
+# Command line entry point
+#
+#   python cli.py ingest                new receipts from the channel -> download folder + ledger rows
+#   python cli.py ocr --workers 4       OCR what hasn't been read yet and fill in the ledger
+#   python cli.py merge                 fill the ledger in again from the OCR cache, no OCR
+#   python cli.py export                write EXCEL_PATH from the receipt store
+#   python cli.py run                   ingest, ocr and export in one go (what app.py does)
+#   python cli.py listen                event driven intake, see event_listener.py
+#
+# --dry-run says what a command would do without downloading, OCR'ing or writing the ledger.
+# --profile runs it under cProfile (top functions to stderr, or the stats to a file).
+#
+# Nothing heavy is imported here. .env is loaded first, then each command imports what it needs,
+# so `ingest` never loads cv2 / numpy / pandas / tesseract / openpyxl and a poll with nothing new
+# (every minute from cron) is over in well under a second.
+import os, sys, time, argparse
+from pathlib import Path
+from typing import Optional
+
+def cmd_ingest(args, log) -> None:
+    from slack_receipt_downloader import DOWNLOAD_WORKERS, channel_id, channel_history, pending_files
+
+    if args.dry_run:
+        files = pending_files(channel_id())
+        for m, f in files:
+            log.info("would download", file=f.get("name"), file_id=f.get("id"), ts=m.get("ts"), size=f.get("size"))
+        log.info("dry run, nothing downloaded", files=len(files))
+        return
+
+    workers = args.workers or DOWNLOAD_WORKERS
+    if args.async_ingest:
+        from async_ingest import run_async_ingest
+        run_async_ingest(channel_id(), workers)
+    else:
+        channel_history(channel_id(), workers)
+
+def cmd_ocr(args, log) -> None:
+    download_dir = Path(os.environ["DOWNLOAD_LOC"])
+
+    if args.dry_run:
+        from state_store import StateStore
+        # read only, the old STATE_JSON isn't migrated either
+        with StateStore(read_only=True) as store:
+            files = store.new_files(download_dir) if download_dir.is_dir() else []
+        for receipt in files:
+            log.info("would OCR", receipt=receipt.name)
+        log.info("dry run, nothing OCR'd", receipts=len(files))
+        return
+
+    from ocr_engine import OCR_WORKERS
+    from receipt_ocr import ocr_pipeline
+    ocr_pipeline(args.workers or OCR_WORKERS)
+
+def cmd_merge(args, log) -> None:
+    from state_store import StateStore
+    from receipt_ocr import STATE_JSON, merge_cached
+
+    with StateStore(legacy_json=STATE_JSON, read_only=args.dry_run) as store:
+        results = merge_cached(Path(os.environ["DOWNLOAD_LOC"]), store, dry_run=args.dry_run)
+    log.info("dry run, ledger not touched" if args.dry_run else "merged cached OCR results", receipts=len(results))
+
+def cmd_export(args, log) -> None:
+    excel_path = os.environ["EXCEL_PATH"]
+
+    if args.dry_run:
+        from receipt_store import ReceiptStore
+        with ReceiptStore(read_only=True) as store:
+            log.info("dry run, workbook not written", receipts=store.count(), path=excel_path)
+        return
+
+    from ledger import export_excel
+    log.info("exported workbook", receipts=export_excel(excel_path), path=excel_path)
+
+def cmd_run(args, log) -> None:
+    if args.stream and not args.dry_run:
+        from slack_receipt_downloader import channel_id
+        from ocr_engine import OCR_WORKERS
+        from pipeline import PIPELINE_IN_MEMORY, streaming_pipeline
+        kwargs = {"download_workers": args.download_workers} if args.download_workers else {}
+        streaming_pipeline(channel_id(), ocr_workers=args.workers or OCR_WORKERS,
+                           in_memory=args.in_memory or PIPELINE_IN_MEMORY, **kwargs)
+    else:
+        cmd_ingest(argparse.Namespace(**{**vars(args), "workers": args.download_workers}), log)
+
+    # in stream mode this only finds files left over from earlier runs
+    cmd_ocr(args, log)
+    # the workbook is only written once, at the end of the run
+    cmd_export(args, log)
+
+def cmd_listen(args, log) -> None:
+    import event_listener
+    event_listener.main(args.listen_args)
+
+def build_parser() -> argparse.ArgumentParser:
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--workers", type=int, help="OCR worker processes (parallel downloads for ingest)")
+    common.add_argument("--dry-run", action="store_true", help="report what would be done, change nothing")
+    common.add_argument("--profile", nargs="?", const="", metavar="FILE",
+                        help="run under cProfile, top functions to stderr or the stats to FILE")
+
+    parser = argparse.ArgumentParser(prog="cli.py", description="Slack receipt downloader + OCR")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("ingest", parents=[common], help="download new receipts and add their ledger rows")
+    p.add_argument("--async-ingest", action="store_true", help="use the asyncio downloader")
+    p.set_defaults(func=cmd_ingest)
+
+    p = sub.add_parser("ocr", parents=[common], help="OCR downloaded receipts and fill in the ledger")
+    p.set_defaults(func=cmd_ocr)
+
+    p = sub.add_parser("merge", parents=[common], help="fill in the ledger from cached OCR results")
+    p.set_defaults(func=cmd_merge)
+
+    p = sub.add_parser("export", parents=[common], help="write the Excel workbook from the receipt store")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("run", parents=[common], help="ingest, ocr and export")
+    p.add_argument("--download-workers", type=int, help="parallel downloads")
+    p.add_argument("--async-ingest", action="store_true", help="use the asyncio downloader")
+    p.add_argument("--stream", action="store_true", help="OCR each file as soon as it is downloaded")
+    p.add_argument("--in-memory", action="store_true", help="with --stream, OCR the downloaded bytes without reading them back from disk")
+    p.set_defaults(func=cmd_run)
+
+    # its options belong to event_listener.main, `listen --help` lists them
+    p = sub.add_parser("listen", help="event driven intake (Socket Mode or the Events API)", add_help=False)
+    p.set_defaults(func=cmd_listen, dry_run=False, profile=None)
+    return parser
+
+def main(argv: Optional[list[str]] = None) -> int:
+    started = time.perf_counter()
+    parser = build_parser()
+    args, rest = parser.parse_known_args(argv)
+    if args.command == "listen":
+        args.listen_args = rest
+    elif rest:
+        parser.error(f"unrecognized arguments: {' '.join(rest)}")
+
+    # before any project module is imported, their settings are read from the environment on import
+    from dotenv import load_dotenv
+    load_dotenv()
+    import telemetry
+
+    log = telemetry.get_logger("cli")
+    log.debug("starting", command=args.command, startup_s=round(time.perf_counter() - started, 3))
+
+    try:
+        with telemetry.span(f"cli_{args.command}", dry_run=args.dry_run):
+            if args.profile is None:
+                args.func(args, log)
+            else:
+                import cProfile, pstats
+                profiler = cProfile.Profile()
+                try:
+                    profiler.runcall(args.func, args, log)
+                finally:
+                    if args.profile:
+                        profiler.dump_stats(args.profile)
+                        log.info("profile written", path=args.profile)
+                    else:
+                        pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(25)
+    finally:
+        if not args.dry_run:
+            telemetry.write_reports()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+import io, os, time
+import cv2
+import numpy as np
+from pathlib import Path
+from typing import Iterator, Optional
+from collections import defaultdict
+
+DECODE_VERSION = "2"  # bump when a decoder below changes what it hands to OCR
+DECODE_DPI = int(os.environ.get("DECODE_DPI", 300))  # PDF pages without a text layer are rasterized at this
+PDF_MAX_PAGES = int(os.environ.get("PDF_MAX_PAGES", 3))  # receipts are short, pages after this are never read
+PDF_MIN_TEXT = int(os.environ.get("PDF_MIN_TEXT", 20))  # characters of text layer before OCR is skipped
+# px, big JPEGs decode at 1/2, 1/4 or 1/8 down to this. Off (0) until bench_decode --ocr shows
+# the reduced decode reads totals as well as the full one, 2000 is the value to try
+DECODE_MIN_LONG_SIDE = int(os.environ.get("DECODE_MIN_LONG_SIDE", 0))
+
+# JPEG decode scale -> imread flag, libjpeg does these scales in the DCT so they are cheaper than a full decode
+REDUCED_GREY = {1: cv2.IMREAD_GRAYSCALE, 2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+                4: cv2.IMREAD_REDUCED_GRAYSCALE_4, 8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+REDUCED_COLOR = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+                 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+# ISO-BMFF brands of HEIF/HEIC files (iPhone photos)
+HEIF_BRANDS = {b"heic", b"heix", b"hevc", b"hevx", b"heim", b"heis", b"mif1", b"msf1"}
+
+# Goes into the OCR cache key next to the preprocessing version
+def decode_version() -> str:
+    return f"{DECODE_VERSION}:{DECODE_DPI}:{PDF_MAX_PAGES}:{PDF_MIN_TEXT}:{DECODE_MIN_LONG_SIDE}"
+
+# What a file is from its first bytes, Slack file names and mimetypes don't always say
+def sniff_format(head: bytes) -> str:
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if b"%PDF-" in head[:1024]:
+        return "pdf"
+    if head[4:8] == b"ftyp" and head[8:12] in HEIF_BRANDS:
+        return "heic"
+    return "image"  # anything else cv2.imread may still know (webp, tiff, bmp)
+
+# (width, height) from the JPEG frame header, walks the marker segments without decoding anything
+def jpeg_size(data) -> Optional[tuple[int, int]]:
+    i, n = 2, len(data)
+    while i + 9 < n:
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if 0xD0 <= marker <= 0xD9 or marker == 0x01:  # markers without a length
+            i += 2
+            continue
+        # SOF0-SOF15 carry the size, C4 / C8 / CC are other tables that share the range
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            return int.from_bytes(data[i + 7:i + 9], "big"), int.from_bytes(data[i + 5:i + 7], "big")
+        i += 2 + int.from_bytes(data[i + 2:i + 4], "big")
+    return None
+
+# Largest JPEG decode scale that still leaves min_side px on the long side (default DECODE_MIN_LONG_SIDE)
+def jpeg_scale(data, min_side: Optional[int] = None) -> int:
+    min_side = DECODE_MIN_LONG_SIDE if min_side is None else min_side
+    size = jpeg_size(data) if min_side > 0 else None
+    if size is None:
+        return 1
+    scale = 1
+    while scale < 8 and max(size) // (scale * 2) >= min_side:
+        scale *= 2
+    return scale
+
+class ReceiptSource:
+    """A posted receipt opened for OCR, whatever format it came in.
+
+    PDFs with a text layer (emailed invoices) come with .text filled in and need no OCR at all.
+    Everything else hands out page images from pages(), one at a time, so a scanned PDF is only
+    rasterized as far as the caller reads. .seconds is the decode time so far.
+
+    The bytes come from data when the caller already has them in memory (a download that hasn't
+    hit the disk yet), otherwise the file is read once. With grey the pages come out single
+    channel straight from the decoder, big JPEGs at a reduced scale, see DECODE_MIN_LONG_SIDE
+    (min_side=0 always decodes at full size).
+    """
+
+    def __init__(self, path: Path, data: Optional[bytes] = None, grey: bool = False, min_side: Optional[int] = None):
+        self.path = Path(path)
+        self.grey = grey
+        self.min_side = min_side
+        self.text: Optional[str] = None
+        self.page_count = 1
+        self.scale = 1  # JPEG decode scale that was used
+        self.seconds = 0.0
+        self._pdf = None
+
+        start = time.perf_counter()
+        self._data = data if data is not None else self.path.read_bytes()
+        self.format = sniff_format(bytes(self._data[:1024]))
+        if self.format == "pdf":
+            self._open_pdf()
+        self.seconds += time.perf_counter() - start
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def text_layer(self) -> bool:
+        return self.text is not None
+
+    def _open_pdf(self) -> None:
+        try:
+            import fitz  # PyMuPDF
+        except ImportError:
+            raise RuntimeError(f"{self.path.name} is a PDF, reading it needs PyMuPDF (pip install pymupdf, then run ocr again)")
+
+        self._pdf = fitz.open(stream=self._data, filetype="pdf")
+        self.page_count = min(len(self._pdf), PDF_MAX_PAGES)
+        text = "\n".join(self._pdf[i].get_text("text") for i in range(self.page_count))
+        # a scan saved as PDF has no (or next to no) text layer
+        if sum(not c.isspace() for c in text) >= PDF_MIN_TEXT:
+            self.text = text
+            self.close()
+
+    def _render_pdf(self, n: int) -> np.ndarray:
+        import fitz
+        pix = self._pdf[n].get_pixmap(dpi=DECODE_DPI, colorspace=fitz.csGRAY if self.grey else fitz.csRGB, alpha=False)
+        pixels = np.frombuffer(pix.samples, np.uint8).reshape(pix.height, pix.width, pix.n)
+        return pixels[:, :, 0].copy() if self.grey else cv2.cvtColor(pixels, cv2.COLOR_RGB2BGR)
+
+    def _read_heic(self) -> np.ndarray:
+        try:
+            from pillow_heif import open_heif
+        except ImportError:
+            raise RuntimeError(f"{self.path.name} is a HEIC photo, reading it needs pillow-heif (pip install pillow-heif, then run ocr again)")
+
+        rgb = np.asarray(open_heif(io.BytesIO(self._data), convert_hdr_to_8bit=True))
+        if self.grey:
+            return cv2.cvtColor(rgb, cv2.COLOR_RGBA2GRAY if rgb.shape[2] == 4 else cv2.COLOR_RGB2GRAY)
+        return cv2.cvtColor(rgb, cv2.COLOR_RGBA2BGR if rgb.shape[2] == 4 else cv2.COLOR_RGB2BGR)
+
+    # JPEG, PNG and the rest, decoded from a view of the bytes (no copy)
+    def _decode_image(self) -> np.ndarray:
+        if self.format == "jpeg":
+            self.scale = jpeg_scale(self._data, self.min_side)
+        flags = (REDUCED_GREY if self.grey else REDUCED_COLOR)[self.scale]
+        image = cv2.imdecode(np.frombuffer(self._data, np.uint8), flags)
+        if image is None:
+            raise ValueError(f"Can't decode {self.path.name}, not a readable image")
+        return image
+
+    def _page(self, n: int) -> np.ndarray:
+        if self.format == "pdf":
+            return self._render_pdf(n)
+        if self.format == "heic":
+            return self._read_heic()
+        return self._decode_image()
+
+    def pages(self) -> Iterator[np.ndarray]:
+        for n in range(self.page_count):
+            start = time.perf_counter()
+            image = self._page(n)
+            if self._pdf is None:
+                self._data = None  # single image formats are done with the encoded bytes
+            self.seconds += time.perf_counter() - start
+            yield image
+
+    def close(self) -> None:
+        if self._pdf is not None:
+            self._pdf.close()
+            self._pdf = None
+        self._data = None
+
+class DecodeStats:
+    """Decode time per format over a batch, fed with the OCR payloads."""
+
+    def __init__(self):
+        self.times: dict[str, list[float]] = defaultdict(list)
+
+    def record(self, payload: dict) -> None:
+        fmt = payload.get("format")
+        if fmt:
+            self.times[fmt].append(payload.get("timings", {}).get("decode", 0.0))
+
+    def summary(self) -> dict:
+        return {fmt: {"files": len(t), "mean_s": round(sum(t) / len(t), 4), "total_s": round(sum(t), 3)}
+                for fmt, t in sorted(self.times.items())}
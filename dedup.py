@@ -0,0 +1,182 @@
+import os, time, sqlite3, hashlib
+from pathlib import Path
+from typing import Optional
+from dataclasses import dataclass
+from receipt_store import RECEIPT_DB
+from state_store import connect_read_only, file_sha256
+
+DEDUP_PHASH_DISTANCE = int(os.environ.get("DEDUP_PHASH_DISTANCE", 4))  # bits out of 64, 0 turns the check off
+
+# Two hashes within PHASH_BANDS - 1 bits of each other agree exactly on at least one band (pigeonhole),
+# so the bands are kept in indexed columns and only rows sharing one get the bit count
+PHASH_BANDS = 5
+PHASH_BAND_BITS = -(-64 // PHASH_BANDS)
+PHASH_BAND_COLUMNS = [f"phash_b{i}" for i in range(PHASH_BANDS)]
+
+def phash_bands(phash: int) -> list[int]:
+    mask = (1 << PHASH_BAND_BITS) - 1
+    return [(phash >> (i * PHASH_BAND_BITS)) & mask for i in range(PHASH_BANDS)]
+
+@dataclass
+class FileCheck:
+    duplicate_of: Optional[str] = None  # receipt number of the first copy
+    exact: bool = False                 # same Slack file or same bytes, otherwise only looks the same
+    by_file_id: bool = False
+    sha256: Optional[str] = None
+    phash: Optional[int] = None
+
+# 64 bit difference hash of a small grey copy, close hashes mean the same picture re-saved or resized
+def perceptual_hash(path: Path, data: Optional[bytes] = None) -> Optional[int]:
+    try:
+        import cv2
+        if data is not None:
+            import numpy as np
+            img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+        else:
+            img = cv2.imread(str(path), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+        if img is None:
+            return None
+        small = cv2.resize(img, (9, 8), interpolation=cv2.INTER_AREA)
+    except ImportError:
+        return None
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return sum(1 << i for i, bit in enumerate(bits) if bit)
+
+class DedupIndex:
+    """Every ingested Slack file with its size, content hash and perceptual hash, to catch receipts
+    posted twice.
+
+    Before download only the Slack file id can be matched (file objects carry no content
+    checksum), a repost of the same file costs nothing. After download the sha256 finds byte
+    identical copies uploaded again, and the perceptual hash finds the same photo re-saved,
+    which is only flagged since it could be a different receipt that looks alike.
+    read_only (dry runs) only looks, see state_store.connect_read_only.
+    """
+
+    def __init__(self, path=RECEIPT_DB, phash_distance: int = DEDUP_PHASH_DISTANCE, read_only: bool = False):
+        self.phash_distance = phash_distance
+        self.conn = connect_read_only(path, "receipt_files") if read_only else None
+        if self.conn is not None:
+            self.banded = set(PHASH_BAND_COLUMNS) <= self._columns()
+            return
+        self.conn = sqlite3.connect(":memory:" if read_only else path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS receipt_files (
+                receipt_number TEXT PRIMARY KEY,
+                file_id TEXT,
+                ts TEXT,
+                size INTEGER,
+                sha256 TEXT,
+                phash TEXT,
+                duplicate_of TEXT,
+                created_at REAL NOT NULL
+            )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS receipt_files_file_id ON receipt_files (file_id)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS receipt_files_sha256 ON receipt_files (sha256)")
+
+        # indexes made before the phash bands get them filled in from the stored hashes
+        have = self._columns()
+        for col in PHASH_BAND_COLUMNS:
+            if col not in have:
+                self.conn.execute(f"ALTER TABLE receipt_files ADD COLUMN {col} INTEGER")
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS receipt_files_{col} ON receipt_files ({col})")
+        if not set(PHASH_BAND_COLUMNS) <= have:
+            rows = self.conn.execute("SELECT receipt_number, phash FROM receipt_files WHERE phash IS NOT NULL").fetchall()
+            assign = ", ".join(f"{col} = ?" for col in PHASH_BAND_COLUMNS)
+            self.conn.executemany(f"UPDATE receipt_files SET {assign} WHERE receipt_number = ?",
+                                  [(*phash_bands(int(phash, 16)), number) for number, phash in rows])
+        self.banded = True
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _columns(self) -> set[str]:
+        return {row[1] for row in self.conn.execute("PRAGMA table_info(receipt_files)")}
+
+    # The same file id in another message is a repost (a message being redone after a crash isn't)
+    def before_download(self, f: dict, ts) -> FileCheck:
+        row = self.conn.execute(
+            "SELECT COALESCE(duplicate_of, receipt_number) FROM receipt_files WHERE file_id = ? AND ts != ? LIMIT 1",
+            (f.get("id"), str(ts))).fetchone()
+        return FileCheck(row[0], exact=True, by_file_id=True) if row else FileCheck()
+
+    # Receipt number when this file from this message is already in, ledger row and all. The event
+    # listener takes receipts in between polls without moving last_ts, so the poll skips these
+    def ingested(self, f: dict, ts) -> Optional[str]:
+        if not self.conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'receipts'").fetchone():
+            return None
+        row = self.conn.execute(
+            "SELECT rf.receipt_number FROM receipt_files rf JOIN receipts r ON r.Receipt_Number = rf.receipt_number "
+            "WHERE rf.file_id = ? AND rf.ts = ? LIMIT 1", (f.get("id"), str(ts))).fetchone()
+        return row[0] if row else None
+
+    # data: the downloaded bytes when they haven't been written to path yet
+    def after_download(self, path: Path, f: dict, ts, data: Optional[bytes] = None) -> FileCheck:
+        sha256 = hashlib.sha256(data).hexdigest() if data is not None else file_sha256(path)
+        check = FileCheck(sha256=sha256, phash=perceptual_hash(path, data))
+        not_self = (f.get("id"), str(ts))
+
+        row = self.conn.execute(
+            "SELECT COALESCE(duplicate_of, receipt_number) FROM receipt_files "
+            "WHERE sha256 = ? AND NOT (file_id = ? AND ts = ?) LIMIT 1", (check.sha256, *not_self)).fetchone()
+        if row:
+            check.duplicate_of, check.exact = row[0], True
+            return check
+
+        if check.phash is not None and self.phash_distance:
+            for original, phash in self._phash_candidates(check.phash, not_self):
+                if (int(phash, 16) ^ check.phash).bit_count() <= self.phash_distance:
+                    check.duplicate_of = original
+                    break
+        return check
+
+    # Rows that share a band with phash. Past PHASH_BANDS - 1 bits sharing a band isn't guaranteed
+    # any more, and every row is compared
+    def _phash_candidates(self, phash: int, not_self: tuple):
+        sql = ("SELECT COALESCE(duplicate_of, receipt_number), phash FROM receipt_files "
+               "WHERE phash IS NOT NULL AND NOT (file_id = ? AND ts = ?)")
+        if not self.banded or self.phash_distance >= PHASH_BANDS:
+            return self.conn.execute(sql, not_self)
+        match = " OR ".join(f"{col} = ?" for col in PHASH_BAND_COLUMNS)
+        return self.conn.execute(f"{sql} AND ({match})", (*not_self, *phash_bands(phash)))
+
+    def record(self, receipt_number: str, f: dict, ts, check: FileCheck) -> None:
+        bands = [None] * PHASH_BANDS if check.phash is None else phash_bands(check.phash)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO receipt_files (receipt_number, file_id, ts, size, sha256, phash, duplicate_of, created_at, "
+            f"{', '.join(PHASH_BAND_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?{', ?' * PHASH_BANDS})",
+            (receipt_number, f.get("id"), str(ts), f.get("size"), check.sha256,
+             None if check.phash is None else f"{check.phash:016x}",
+             check.duplicate_of if check.exact else None, time.time(), *bands))
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+# The same file posted twice on one history page. Nothing from the page is recorded yet, so
+# before_download can't catch it: maps the index in todo of every later copy to the first one
+def page_reposts(todo: list[tuple[dict, dict]]) -> dict[int, int]:
+    first, later = {}, {}
+    for i, (m, f) in enumerate(todo):
+        j = first.setdefault(f.get("id"), i)
+        if j != i:
+            later[i] = j
+    return later
+
+# Key for ReceiptIds: a repost of the same Slack file still needs a number of its own
+def allocation_key(f: dict, ts, check: FileCheck) -> str:
+    return f"{f.get('id')}:{ts}" if check.by_file_id else f.get("id")
+
+# Ledger row for a duplicate, points at the first copy. Exact copies aren't OCR'd so their fields are left empty
+def duplicate_row(row: dict, check: FileCheck) -> dict:
+    if check.duplicate_of is None:
+        return row
+    if not check.exact:
+        return {**row, "Error_Flag": f"Possible duplicate of {check.duplicate_of}"}
+    return {**row, "Purchase_Date": "Null", "Supplier": "Null", "Cost": "Null",
+            "Error_Flag": f"Duplicate of {check.duplicate_of}"}
@@ -0,0 +1,225 @@
+# Long running intake: reacts to message / file_shared events instead of polling conversations.history.
+#
+#   python cli.py listen                      Socket Mode (needs SLACK_APP_TOKEN, xapp-...)
+#   python cli.py listen --http 3000          Events API endpoint (needs SLACK_SIGNING_SECRET)
+#   python cli.py listen --replay events.jsonl  feed recorded events through the same path, offline
+#
+# A poll (channel_history) runs first as a catch-up pass for anything posted while the listener was down.
+# Events never move last_ts: a failed download or a message missed while the socket was down would
+# end up behind it. The poll owns it and skips files the listener already took in (DedupIndex.ingested).
+import os, json, time, argparse, threading
+from pathlib import Path
+from typing import Optional
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from slack_sdk.errors import SlackApiError
+from ledger import LedgerWriter, export_excel
+from dedup import DedupIndex, allocation_key, duplicate_row
+from user_cache import UserDirectory
+from state_store import StateStore
+from receipt_ocr import STATE_JSON, ocr_files
+from slack_receipt_downloader import (channel_id, download_dir, slack_client, make_session, download_files,
+                                      change_file_name, tracking_generator, make_row, channel_history)
+import telemetry
+
+log = telemetry.get_logger("event_listener")
+
+SLACK_APP_TOKEN = os.environ.get("SLACK_APP_TOKEN")  # app level token for Socket Mode
+SLACK_SIGNING_SECRET = os.environ.get("SLACK_SIGNING_SECRET")  # for the HTTP Events endpoint
+
+class ReceiptIntake:
+    """Runs one receipt from an event through download -> rename -> ledger row -> OCR."""
+
+    def __init__(self, chan_id: Optional[str] = None):
+        self.chan_id = chan_id or channel_id()
+        self.download_dir = download_dir()
+        self.user_dir = UserDirectory(slack_client())
+        self.make_invoice = tracking_generator("R", self.download_dir)
+        self.dedup = DedupIndex()
+        self.http = make_session(1)
+        self.seen: set[str] = set()  # a single upload fires both file_shared and message
+        self.lock = threading.Lock()
+        self.handled = 0
+
+    def handle_event(self, event: dict) -> None:
+        etype = event.get("type")
+
+        if etype == "message" and event.get("files") and event.get("channel", self.chan_id) == self.chan_id:
+            for f in event["files"]:
+                self.ingest(event, f)
+
+        elif etype == "file_shared" and event.get("channel_id", self.chan_id) == self.chan_id:
+            if event.get("file_id") in self.seen:
+                return
+            try:
+                f = slack_client().files_info(file=event["file_id"])["file"]
+                telemetry.slack_call("files.info")
+            except SlackApiError as e:
+                telemetry.slack_call("files.info", e)
+                log.error("files.info failed", file_id=event["file_id"], error=e.response.get("error"))
+                return
+            m = self.shared_message(f)
+            if m is None:
+                log.error("no message found for shared file, left for the next catch-up poll", file_id=event["file_id"])
+                return
+            self.ingest(m, f)
+
+    # The channel message a file was posted in (its real ts and text), file_shared only carries the file id
+    def shared_message(self, f: dict) -> Optional[dict]:
+        shares = f.get("shares") or {}
+        posts = (shares.get("public") or {}).get(self.chan_id) or (shares.get("private") or {}).get(self.chan_id)
+        if not posts:
+            return None
+        ts = min(posts, key=lambda share: float(share["ts"]))["ts"]
+        try:
+            response = slack_client().conversations_history(channel=self.chan_id, latest=ts, inclusive=True, limit=1)
+            telemetry.slack_call("conversations.history")
+        except SlackApiError as e:
+            telemetry.slack_call("conversations.history", e)
+            log.error("conversations.history failed", error=e.response.get("error"))
+            return None
+        messages = [m for m in response.get("messages", []) if m.get("ts") == ts]
+        return messages[0] if messages else {"ts": ts, "text": "", "user": f.get("user")}
+
+    def ingest(self, m: dict, f: dict) -> Optional[Path]:
+        with self.lock, telemetry.span("ingest_event"):
+            if f.get("id") in self.seen:
+                return None
+            self.seen.add(f.get("id"))
+
+            staged_path = self.download_dir / f"{f.get('id')}_{f['name']}"
+            check = self.dedup.before_download(f, m.get("ts"))
+            if check.duplicate_of is None:
+                try:
+                    download_files(f.get("url_private_download"), staged_path, self.http)
+                except Exception as e:
+                    # the next catch-up poll gets it
+                    log.error("download failed, left for the next catch-up poll", file=f['name'], error=str(e))
+                    self.seen.discard(f.get("id"))
+                    return None
+                check = self.dedup.after_download(staged_path, f, m.get("ts"))
+
+            if check.duplicate_of and check.exact:
+                invoice_num, new_path = self.make_invoice(allocation_key(f, m.get("ts"), check)), None
+                staged_path.unlink(missing_ok=True)
+            else:
+                invoice_num, new_path = change_file_name(staged_path, self.download_dir, self.make_invoice, f.get("id"))
+            self.dedup.record(invoice_num, f, m.get("ts"), check)
+
+            with LedgerWriter(flush_size=1) as ledger:
+                row = make_row(m, self.user_dir.get(f.get("user") or m.get("user")), invoice_num)
+                ledger.add(duplicate_row(row, check))
+
+            self.user_dir.save()
+            self.handled += 1
+
+            if new_path is None:
+                log.info("duplicate receipt", receipt=invoice_num, file=f['name'], duplicate_of=check.duplicate_of)
+                telemetry.write_reports()
+                return None
+
+            with StateStore(legacy_json=STATE_JSON) as store:
+                fields = ocr_files([new_path], store, workers=1)
+            log.info("receipt ingested", receipt=invoice_num, file=f['name'], **(fields.get(new_path.stem) or {}))
+            # a long running process, keep the metrics file current for the scraper
+            telemetry.write_reports()
+            return new_path
+
+    # Events API envelope or a bare event
+    def handle_payload(self, payload: dict) -> None:
+        self.handle_event(payload.get("event", payload))
+
+def run_socket_mode(intake: ReceiptIntake) -> None:
+    from slack_sdk.socket_mode import SocketModeClient
+    from slack_sdk.socket_mode.request import SocketModeRequest
+    from slack_sdk.socket_mode.response import SocketModeResponse
+
+    if not SLACK_APP_TOKEN:
+        raise RuntimeError("SLACK_APP_TOKEN is needed for Socket Mode")
+
+    socket = SocketModeClient(app_token=SLACK_APP_TOKEN, web_client=slack_client())
+
+    def on_request(sock: SocketModeClient, req: SocketModeRequest):
+        if req.type != "events_api":
+            return
+        # ack first so Slack doesn't retry while the download runs
+        sock.send_socket_mode_response(SocketModeResponse(envelope_id=req.envelope_id))
+        intake.handle_payload(req.payload)
+
+    socket.socket_mode_request_listeners.append(on_request)
+    socket.connect()
+    log.info("listening for receipts over Socket Mode")
+    threading.Event().wait()
+
+def run_http(intake: ReceiptIntake, port: int) -> None:
+    from slack_sdk.signature import SignatureVerifier
+
+    if not SLACK_SIGNING_SECRET:
+        raise RuntimeError("SLACK_SIGNING_SECRET is needed for the Events API endpoint")
+    verifier = SignatureVerifier(SLACK_SIGNING_SECRET)
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if not verifier.is_valid_request(body, {k.lower(): v for k, v in self.headers.items()}):
+                self.send_response(401)
+                self.end_headers()
+                return
+
+            payload = json.loads(body)
+            reply = b""
+            if payload.get("type") == "url_verification":
+                reply = payload.get("challenge", "").encode()
+
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(reply)))
+            self.end_headers()
+            self.wfile.write(reply)
+
+            # answered already, Slack wants a reply within 3s
+            if payload.get("type") == "event_callback" and not self.headers.get("X-Slack-Retry-Num"):
+                threading.Thread(target=intake.handle_payload, args=(payload,), daemon=True).start()
+
+    log.info("listening for receipts", url=f"http://0.0.0.0:{port}/")
+    ThreadingHTTPServer(("0.0.0.0", port), Handler).serve_forever()
+
+# Feeds a JSON lines file of recorded events (envelopes or bare events) through the intake
+def replay_events(intake: ReceiptIntake, path, delay: float = 0.0) -> int:
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                intake.handle_payload(json.loads(line))
+                if delay:
+                    time.sleep(delay)
+    return intake.handled
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="cli.py listen", description="Event driven receipt intake")
+    parser.add_argument("--http", type=int, metavar="PORT", help="serve the Events API instead of Socket Mode")
+    parser.add_argument("--replay", metavar="EVENTS_JSONL", help="replay recorded events and exit")
+    parser.add_argument("--no-catch-up", action="store_true", help="skip the conversations.history poll at start")
+    args = parser.parse_args(argv)
+
+    if not args.no_catch_up:
+        channel_history(channel_id())
+
+    intake = ReceiptIntake()
+    try:
+        if args.replay:
+            log.info("replay finished", receipts=replay_events(intake, args.replay))
+        elif args.http:
+            run_http(intake, args.http)
+        else:
+            run_socket_mode(intake)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # rows go to the receipt store as they come in, `python ledger.py` exports while running
+        export_excel(os.environ["EXCEL_PATH"])
+        telemetry.write_reports()
+
+if __name__ == "__main__":
+    import sys, cli
+    cli.main(["listen", *sys.argv[1:]])
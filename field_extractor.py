@@ -0,0 +1,127 @@
+import os, re
+from bisect import bisect_right
+from datetime import date
+from typing import Optional, Sequence
+from dataclasses import dataclass, field
+
+DATE_ORDER = os.environ.get("DATE_ORDER", "MDY")  # how 03/04/2025 is read, MDY or DMY
+DEFAULT_DOLLAR_CURRENCY = os.environ.get("DEFAULT_DOLLAR_CURRENCY", "")  # what a bare $ means (CAD, USD), empty leaves Currency blank
+
+MONTHS = {m: i for i, m in enumerate(
+    ["JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC"], start=1)}
+
+# Every shape DATE_PATTERNS had, as one alternation: 12-MAR-2025, 03-12-2025, 03-12-25, 03/12/2025, 03/12/25
+DATE_RE = re.compile(r"""
+    (?P<day>\d{2})-(?P<mon>[A-Z]{3})-(?P<year>\d{4})
+  | (?P<a>\d{2})(?P<sep>[-/])(?P<b>\d{2})(?P=sep)(?P<y>\d{4}|\d{2})(?!\d)
+""", re.I | re.X)
+
+# An amount with an optional currency in front, "$ 1,234.50" or "12.50" or "CAD 7"
+AMOUNT_RE = re.compile(r"(?=[$€£UCEG\d])(?P<cur>[$€£]|\b(?:USD|CAD|EUR|GBP)\b)?\s*(?P<amt>\d{1,3}(?:,\d{3})+(?:\.\d{2})?|\d+(?:\.\d{2})?)(?![\d%])")
+
+# What a line is about. The lookahead lets the scan skip every position that can't start a keyword
+KEYWORD_RE = re.compile(r"\b(?=[stghpvab])(?:(?P<subtotal>sub[\s-]?total)|(?P<tax>tax|hst|gst|pst|vat)"
+                        r"|(?P<total>(?:grand\s+)?total|amount\s+due|balance\s+due))\b", re.I)
+LINE_START_RE = re.compile(r"^[ \t]*\S", re.M)
+
+CURRENCY_CODES = {"$": DEFAULT_DOLLAR_CURRENCY or None, "€": "EUR", "£": "GBP"}
+KEYWORD_RANK = {"subtotal": 0, "tax": 1, "total": 2}
+
+@dataclass(slots=False)
+class ExtractedFields:
+    supplier: Optional[str] = None
+    date: Optional[str] = None       # ISO yyyy-mm-dd, or the text as read when it isn't a real date
+    total: Optional[str] = None      # amounts as plain "1234.50"
+    subtotal: Optional[str] = None
+    tax: Optional[str] = None
+    currency: Optional[str] = None
+    confidence: dict[str, float] = field(default_factory=dict)  # field -> 0-100
+
+# 2025-03-12 for a DATE_RE match, None when the numbers aren't a real date
+def iso_date(match: re.Match, order: str = DATE_ORDER) -> Optional[str]:
+    try:
+        if match.group("mon"):
+            month = MONTHS.get(match.group("mon").upper())
+            if month is None:
+                return None
+            return date(int(match.group("year")), month, int(match.group("day"))).isoformat()
+
+        a, b, year = int(match.group("a")), int(match.group("b")), match.group("y")
+        month, day = (a, b) if order == "MDY" else (b, a)
+        if month > 12 and day <= 12:
+            month, day = day, month
+        year = int(year) + 2000 if len(year) == 2 else int(year)
+        return date(year, month, day).isoformat()
+    except ValueError:
+        return None
+
+def extract_fields(text: str, line_conf: Optional[Sequence[float]] = None) -> ExtractedFields:
+    """Supplier, date, total, subtotal, tax and currency from OCR text.
+
+    The text is scanned as a whole, once per pattern, instead of line by line: the keyword scan
+    finds the few lines that matter and only those get looked at for amounts. Each value's
+    confidence is the OCR confidence of its line (100 when not known) scaled by how well it
+    matched, a date that doesn't parse or a total that doesn't add up with subtotal + tax
+    scores lower."""
+    out = ExtractedFields()
+    quality: dict[str, float] = {}
+    conf_of: dict[str, float] = {}
+
+    # line_conf counts non-empty lines, only worth mapping offsets to lines when it was given
+    starts = [m.start() for m in LINE_START_RE.finditer(text)] if line_conf else None
+
+    def conf_at(pos: int) -> float:
+        if not starts:
+            return 100.0
+        n = bisect_right(starts, pos) - 1
+        return line_conf[n] if 0 <= n < len(line_conf) and line_conf[n] >= 0 else 100.0
+
+    first = LINE_START_RE.search(text)
+    if first:
+        end = text.find("\n", first.start())
+        out.supplier = text[first.start():end if end >= 0 else len(text)].strip()
+        conf_of["supplier"] = conf_at(first.start())
+        quality["supplier"] = 1.0 if any(c.isalpha() for c in out.supplier) else 0.3
+
+    match = DATE_RE.search(text)
+    if match:
+        iso = iso_date(match)
+        out.date, conf_of["date"], quality["date"] = iso or match.group(0), conf_at(match.start()), 1.0 if iso else 0.4
+
+    # keyword lines, a line naming more than one ("total tax") counts as the most specific
+    lines: dict[int, str] = {}
+    for match in KEYWORD_RE.finditer(text):
+        start = text.rfind("\n", 0, match.start()) + 1
+        kind = lines.get(start)
+        if kind is None or KEYWORD_RANK[match.lastgroup] < KEYWORD_RANK[kind]:
+            lines[start] = match.lastgroup
+
+    for start, kind in lines.items():
+        if getattr(out, kind) is not None:
+            continue
+        end = text.find("\n", start)
+        line = text[start:end if end >= 0 else len(text)]
+
+        # amounts sit at the right hand end, "TOTAL (3 items) 12.50"
+        amount = None
+        for amount in AMOUNT_RE.finditer(line):
+            pass
+        if amount is None:
+            continue
+
+        conf = conf_at(start)
+        setattr(out, kind, amount.group("amt").replace(",", ""))
+        conf_of[kind], quality[kind] = conf, 1.0 if "." in amount.group("amt") else 0.6
+        # a $ alone doesn't say which dollar, a CAD on a later line still can
+        cur = amount.group("cur")
+        code = CURRENCY_CODES.get(cur, cur.upper()) if cur else None
+        if out.currency is None and code:
+            out.currency, conf_of["currency"], quality["currency"] = code, conf, 1.0
+
+    # total backed up by the lines above it
+    if out.total and out.subtotal and out.tax:
+        adds_up = abs(float(out.subtotal) + float(out.tax) - float(out.total)) < 0.015
+        quality["total"] *= 1.0 if adds_up else 0.7
+
+    out.confidence = {name: round(conf_of[name] * quality[name], 1) for name in conf_of}
+    return out
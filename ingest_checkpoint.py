@@ -0,0 +1,108 @@
+import os, json
+from pathlib import Path
+from typing import Optional
+import telemetry
+
+log = telemetry.get_logger("ingest_checkpoint")
+
+# One file in one message, a repost of the same Slack file is an entry of its own
+def journal_key(f: dict, ts) -> str:
+    return f"{f.get('id')}:{ts}"
+
+class IngestCheckpoint:
+    """Progress of a channel_history run so a crashed run picks up where it stopped.
+
+    The TS_JSON file keeps last_ts (where the next run starts) and, while a run is in progress,
+    the oldest bound, the pagination cursor, the newest ts seen and the page being worked on, so
+    a restart needs no repeat API call. Files whose ledger rows are written go to an append-only
+    journal next to it (see journal_key), so they are neither downloaded nor added twice.
+    """
+
+    def __init__(self, path, journal_path=None):
+        self.path = Path(path)
+        self.journal_path = Path(journal_path or f"{path}.journal")
+
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            state = {}
+
+        self.last_ts = state.get("last_ts", 0)
+        self.run: Optional[dict] = state.get("run")
+        self.done: set[str] = set()
+
+        if self.run is not None and self.journal_path.exists():
+            with open(self.journal_path) as f:
+                # a torn last line from a crash just means that file gets redone
+                self.done = {line.strip() for line in f if line.endswith("\n") and line.strip()}
+
+    def save(self) -> None:
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump({"last_ts": self.last_ts, "run": self.run}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    # Starts a run from last_ts, or carries on with the one that was interrupted
+    def start_run(self) -> bool:
+        if self.run is not None:
+            log.info("resuming interrupted ingest", cursor=self.run['cursor'], files_done=len(self.done))
+            return True
+
+        self.run = {"oldest": self.last_ts, "cursor": None, "high_ts": self.last_ts, "page": None, "next_cursor": None}
+        self.journal_path.unlink(missing_ok=True)
+        self.save()
+        return False
+
+    @property
+    def oldest(self):
+        return self.run["oldest"]
+
+    @property
+    def cursor(self) -> Optional[str]:
+        return self.run["cursor"]
+
+    @property
+    def page(self) -> Optional[list]:
+        return self.run["page"]
+
+    @property
+    def next_cursor(self) -> Optional[str]:
+        return self.run["next_cursor"]
+
+    def save_page(self, messages: list, next_cursor: Optional[str]) -> None:
+        self.run["page"] = messages
+        self.run["next_cursor"] = next_cursor or None
+        self.save()
+
+    def is_done(self, key: str) -> bool:
+        return key in self.done
+
+    def mark_files(self, keys: list[str]) -> None:
+        if not keys:
+            return
+        with open(self.journal_path, "a") as f:
+            f.write("".join(f"{key}\n" for key in keys))
+            f.flush()
+            os.fsync(f.fileno())
+        self.done.update(keys)
+
+    def page_done(self) -> None:
+        for m in self.run["page"] or []:
+            if float(m.get("ts", 0)) > float(self.run["high_ts"]):
+                self.run["high_ts"] = m["ts"]
+
+        self.run["cursor"] = self.run["next_cursor"]
+        self.run["page"] = None
+        self.run["next_cursor"] = None
+        self.save()
+
+    # Whole channel read, the next run starts after the newest message we saw
+    def finish(self) -> None:
+        self.last_ts = self.run["high_ts"]
+        self.run = None
+        self.save()
+        self.journal_path.unlink(missing_ok=True)
+        self.done.clear()
@@ -0,0 +1,147 @@
+import os, tempfile
+from pathlib import Path
+from receipt_store import RECEIPT_DB, COLUMNS, PLACEHOLDERS, ReceiptStore
+import telemetry
+
+log = telemetry.get_logger("ledger")
+
+LEDGER_FLUSH_SIZE = int(os.environ.get("LEDGER_FLUSH_SIZE", 50))  # rows held in memory before a write
+
+RED_FILL = 'FFC7CE'  # Bot_Holder cell background
+RED_FONT = '9C0006'  # REPLACE text colour
+
+EXCEL_MAX_ROW = 1048576
+
+# Placeholder highlighting as conditional formatting over every data row, so Excel colours the
+# cells itself and nothing walks the sheet. Safe to call again, the rules only go in once.
+# openpyxl is imported here and in the export, ingest never needs it
+def install_highlights(ws) -> bool:
+    from openpyxl.styles import PatternFill, Font
+    from openpyxl.utils import get_column_letter
+    from openpyxl.formatting.rule import CellIsRule
+
+    for cf in ws.conditional_formatting:
+        if any(rule.formula == ['"Bot_Holder"'] for rule in cf.rules):
+            return False
+
+    cells = f"A2:{get_column_letter(len(COLUMNS))}{EXCEL_MAX_ROW}"
+    ws.conditional_formatting.add(cells, CellIsRule(operator="equal", formula=['"Bot_Holder"'],
+                                                    fill=PatternFill(start_color=RED_FILL, end_color=RED_FILL, fill_type='solid')))
+    ws.conditional_formatting.add(cells, CellIsRule(operator="equal", formula=['"REPLACE"'], font=Font(color=RED_FONT)))
+    return True
+
+# A ledger row as sheet values, "Null" is written as an empty cell
+def sheet_values(row: dict) -> list:
+    return [None if row.get(col) == "Null" else row.get(col) for col in COLUMNS]
+
+class LedgerWriter:
+    """Collects ledger rows in memory and adds them to the receipt store in one transaction per flush."""
+
+    def __init__(self, db_path=RECEIPT_DB, flush_size: int = LEDGER_FLUSH_SIZE):
+        self.store = ReceiptStore(db_path)
+        self.flush_size = flush_size
+        self.rows: list[dict] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # Returns True when the add caused a flush to the store
+    def add(self, row: dict) -> bool:
+        self.rows.append(row)
+        if len(self.rows) >= self.flush_size:
+            self.flush()
+            return True
+        return False
+
+    def flush(self) -> int:
+        if not self.rows:
+            return 0
+
+        with telemetry.span("ledger_flush"):
+            self.store.add_rows(self.rows)
+        written = len(self.rows)
+        telemetry.inc("ledger_rows_total", written)
+        self.rows.clear()
+        return written
+
+    def close(self) -> None:
+        self.flush()
+        self.store.close()
+
+# Cells someone changed by hand in the last export. A placeholder or the blank that "Null" is
+# exported as isn't an edit, anything else that differs from the store is
+def workbook_edits(excel_path, store: ReceiptStore, sheet: str = "Sheet1") -> dict[str, dict]:
+    from openpyxl import load_workbook
+
+    wb = load_workbook(excel_path, read_only=True)
+    try:
+        rows = wb[sheet].iter_rows(values_only=True)
+        header = list(next(rows, []))
+        sheet_rows = [dict(zip(header, values)) for values in rows]
+    finally:
+        wb.close()
+
+    stored = {row["Receipt_Number"]: row for row in store.rows()}
+    edits = {}
+    for row in sheet_rows:
+        current = stored.get(str(row.get("Receipt_Number")))
+        if current is None:
+            continue
+        changed = {}
+        for col in COLUMNS:
+            value = row.get(col)
+            if value is None or value in PLACEHOLDERS or (current[col] == "Null" and not str(value).strip()):
+                continue
+            if not isinstance(value, (str, int, float)):
+                value = str(value)
+            if str(value) != str(current[col]):
+                changed[col] = value
+        if changed:
+            edits[str(row["Receipt_Number"])] = changed
+    return edits
+
+@telemetry.traced("export_excel")
+def export_excel(excel_path, db_path=RECEIPT_DB, sheet: str = "Sheet1") -> int:
+    """Writes the formatted workbook from the receipt store, the only place XLSX gets written.
+
+    Hand edits in the existing workbook are taken into the store first so an export never loses
+    them. The new file replaces the old one in one rename. Returns the number of rows."""
+    import openpyxl
+    from openpyxl.styles import Font
+
+    excel_path = Path(excel_path)
+    with ReceiptStore(db_path) as store:
+        if excel_path.exists():
+            edits = workbook_edits(excel_path, store, sheet)
+            if edits:
+                log.info("kept hand edits from the workbook", receipts=len(edits))
+                store.update_fields(edits)
+        rows = store.rows()
+
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = sheet
+    ws.append(COLUMNS)
+    for cell in ws[1]:
+        cell.font = Font(bold=True)
+    for row in rows:
+        ws.append(sheet_values(row))
+    install_highlights(ws)
+
+    fd, tmp = tempfile.mkstemp(dir=excel_path.parent, prefix=".", suffix=".xlsx")
+    os.close(fd)
+    try:
+        wb.save(tmp)
+        os.replace(tmp, excel_path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    return len(rows)
+
+# python ledger.py writes EXCEL_PATH from the receipt store, same as `python cli.py export`
+if __name__ == "__main__":
+    import cli
+    cli.main(["export"])
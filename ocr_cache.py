@@ -0,0 +1,129 @@
+import os, json, time, sqlite3, hashlib
+from pathlib import Path
+from typing import Optional
+import telemetry
+from state_store import connect_read_only
+
+OCR_CACHE_DB = os.environ.get("OCR_CACHE_DB", ".ocr_cache.sqlite")
+OCR_CACHE_MAX_MB = float(os.environ.get("OCR_CACHE_MAX_MB", 256))  # least recently used entries go past this
+
+_tesseract_version: Optional[str] = None
+
+# Part of the cache key, a tesseract upgrade can change the output for the same pixels
+def tesseract_version() -> str:
+    global _tesseract_version
+    if _tesseract_version is None:
+        try:
+            import pytesseract
+            _tesseract_version = str(pytesseract.get_tesseract_version())
+        except Exception:
+            _tesseract_version = "unknown"
+    return _tesseract_version
+
+class OCRCache:
+    """OCR results keyed by a hash of the image bytes + OCR config + preprocessing version + tesseract version.
+
+    read_only (dry runs) looks entries up without bumping last_used, see state_store.connect_read_only.
+    """
+
+    def __init__(self, path=OCR_CACHE_DB, max_bytes: int = int(OCR_CACHE_MAX_MB * 1024 * 1024), read_only: bool = False):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.read_only = read_only
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.conn = connect_read_only(self.path, "ocr_cache") if read_only else None
+        if self.conn is None:
+            self.conn = sqlite3.connect(":memory:" if read_only else self.path)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS ocr_cache (
+                    key TEXT PRIMARY KEY,
+                    text TEXT,
+                    words TEXT,
+                    fields TEXT,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )""")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS ocr_cache_last_used ON ocr_cache (last_used)")
+            self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM ocr_cache").fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # data is the file's bytes when they are already in memory (not on disk yet)
+    def key(self, receipt: Path, tag: str = "", data: Optional[bytes] = None) -> str:
+        h = hashlib.sha256()
+        if data is not None:
+            h.update(data)
+        else:
+            with open(receipt, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    h.update(chunk)
+        h.update(b"\0" + tag.encode() + b"\0" + tesseract_version().encode())
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        row = self.conn.execute("SELECT text, words, fields FROM ocr_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            telemetry.cache_lookup("ocr", False)
+            return None
+
+        self.hits += 1
+        telemetry.cache_lookup("ocr", True)
+        if not self.read_only:
+            self.conn.execute("UPDATE ocr_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+        text, words, fields = row
+        return {"text": text, "words": words, "fields": json.loads(fields)}
+
+    # words is the word frame as JSON (DataFrame.to_json(orient="split"))
+    def put(self, key: str, text: Optional[str], words: Optional[str], fields: dict) -> None:
+        fields_json = json.dumps(fields)
+        size = len(text or "") + len(words or "") + len(fields_json)
+        now = time.time()
+
+        old = self.conn.execute("SELECT size FROM ocr_cache WHERE key = ?", (key,)).fetchone()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO ocr_cache (key, text, words, fields, size, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, text, words, fields_json, size, now, now))
+        self.total_bytes += size - (old[0] if old else 0)
+
+        self._evict()
+        self.conn.commit()
+
+    def _evict(self) -> None:
+        if self.total_bytes <= self.max_bytes:
+            return
+
+        doomed = []
+        for key, size in self.conn.execute("SELECT key, size FROM ocr_cache ORDER BY last_used"):
+            if self.total_bytes <= self.max_bytes:
+                break
+            doomed.append((key,))
+            self.total_bytes -= size
+
+        self.conn.executemany("DELETE FROM ocr_cache WHERE key = ?", doomed)
+        self.evictions += len(doomed)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "bytes": self.total_bytes,
+        }
+
+    def close(self) -> None:
+        self.conn.close()
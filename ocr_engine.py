@@ -0,0 +1,164 @@
+import os
+from pathlib import Path
+from typing import Callable, Optional
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED, ALL_COMPLETED
+from ocr_cache import OCRCache
+import telemetry
+
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", os.cpu_count() or 1))
+
+# Each worker already has a core to itself, so stop tesseract/opencv from spinning up their own threads
+def _init_worker(run_id: Optional[str] = None) -> None:
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    if run_id:
+        telemetry.REGISTRY.run_id = run_id  # worker log lines carry the parent's run id
+    try:
+        import cv2
+        cv2.setNumThreads(1)
+    except ImportError:
+        pass
+
+# Turns a ReceiptOCR into the results_def entry
+def receipt_fields(rec) -> dict[str, Optional[str]]:
+    return {
+        "Purchase_Date": rec.purchase_date,
+        "Supplier": rec.supplier,
+        "Cost": rec.cost_text or None,
+        "Subtotal": getattr(rec, "subtotal", None),
+        "Tax": getattr(rec, "tax", None),
+        "Currency": getattr(rec, "currency", None),
+    }
+
+# Everything the cache keeps for a receipt, the word frame travels as JSON
+def receipt_result(rec) -> dict:
+    data = getattr(rec, "data", None)
+    payload = {
+        "fields": receipt_fields(rec),
+        "text": rec.text,
+        "words": data.to_json(orient="split") if data is not None else None,
+    }
+    if getattr(rec, "timings", None):
+        payload["timings"] = rec.timings
+    if getattr(rec, "format", None):
+        payload["format"] = rec.format
+    # for the confidence metrics, worker processes can't record them themselves
+    if getattr(rec, "field_conf", None):
+        payload["field_conf"] = rec.field_conf
+    if getattr(rec, "confidence", None):
+        payload["mean_conf"] = rec.confidence["mean"]
+    # adaptive runs (ocr_strategy) also report which configs ran
+    if hasattr(rec, "attempts"):
+        payload["strategy"] = {"attempts": rec.attempts, "escalated": rec.escalated, "chosen": rec.chosen}
+    return payload
+
+def _run_one(process: Callable, receipt: Path, kwargs: dict) -> dict:
+    return receipt_result(process(receipt, **kwargs))
+
+class OCRStream:
+    """Feeds receipts to the OCR pool one at a time as they turn up.
+
+    Cache hits are answered straight away. At most 2 x workers receipts are queued on the pool;
+    submit() blocks until one finishes, which holds back whoever is producing receipts. Results are
+    handled in the calling thread, so the cache and on_result don't need to be thread safe.
+    """
+
+    def __init__(self, process: Callable, workers: int = OCR_WORKERS, cache: Optional[OCRCache] = None,
+                 cache_tag: str = "", on_result: Optional[Callable[[Path, dict], None]] = None, **kwargs):
+        self.process = process
+        self.workers = max(1, workers)
+        self.cache = cache
+        self.cache_tag = cache_tag
+        self.on_result = on_result
+        self.kwargs = kwargs
+        self.results: dict[str, dict[str, Optional[str]]] = {}
+        self.errors: dict[Path, Exception] = {}
+        self._keys: dict[Path, str] = {}
+        self._in_flight: dict = {}
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _finish(self, receipt: Path, payload: dict) -> None:
+        telemetry.ocr_result(payload)
+        self.results[receipt.stem] = payload["fields"]
+        # no text means nothing was read, don't remember that
+        if self.cache is not None and payload["text"] is not None:
+            self.cache.put(self._keys[receipt], payload["text"], payload["words"], payload["fields"])
+        if self.on_result is not None:
+            self.on_result(receipt, payload)
+
+    def _collect(self, return_when=FIRST_COMPLETED) -> None:
+        done, _ = wait(self._in_flight, return_when=return_when)
+        for fut in done:
+            receipt = self._in_flight.pop(fut)
+            try:
+                self._finish(receipt, fut.result())
+            except Exception as e:
+                self.errors[receipt] = e
+                telemetry.inc("ocr_receipts_total", format="unknown", result="failed")
+
+    # buffer: the receipt's bytes, handed to process instead of reading the file (which may not be written yet)
+    def submit(self, receipt: Path, buffer: Optional[bytes] = None) -> None:
+        if self.cache is not None:
+            try:
+                self._keys[receipt] = self.cache.key(receipt, self.cache_tag, buffer)
+            except OSError as e:
+                self.errors[receipt] = e
+                return
+
+            hit = self.cache.get(self._keys[receipt])
+            if hit is not None:
+                self.results[receipt.stem] = hit["fields"]
+                telemetry.inc("ocr_receipts_total", format="unknown", result="cached")
+                return
+
+        kwargs = self.kwargs if buffer is None else {**self.kwargs, "buffer": buffer}
+        if self.workers == 1:
+            _init_worker()
+            try:
+                self._finish(receipt, _run_one(self.process, receipt, kwargs))
+            except Exception as e:
+                self.errors[receipt] = e
+                telemetry.inc("ocr_receipts_total", format="unknown", result="failed")
+            return
+
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                             initargs=(telemetry.REGISTRY.run_id,))
+
+        while len(self._in_flight) >= 2 * self.workers:
+            self._collect()
+        self._in_flight[self._pool.submit(_run_one, self.process, receipt, kwargs)] = receipt
+
+    # Waits for everything still running
+    def close(self) -> None:
+        if self._in_flight:
+            self._collect(ALL_COMPLETED)
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+def run_ocr_batch(receipts: list[Path], process: Callable, workers: int = OCR_WORKERS,
+                  cache: Optional[OCRCache] = None, cache_tag: str = "",
+                  on_result: Optional[Callable[[Path, dict], None]] = None, **kwargs):
+    """Runs process(receipt, **kwargs) for every receipt on a process pool.
+
+    Returns (results, errors): results maps receipt stem -> fields in the same order as receipts,
+    errors maps receipt path -> exception for receipts that failed (they are left out of results).
+    process must be a module level function so it can be pickled to the workers.
+    With a cache, receipts whose bytes were already OCR'd under the same cache_tag (config +
+    preprocessing version) skip tesseract entirely. on_result(receipt, payload) is called in this
+    process for every receipt that was actually OCR'd.
+    """
+    workers = max(1, min(workers, len(receipts)))
+    with OCRStream(process, workers, cache, cache_tag, on_result, **kwargs) as stream:
+        for receipt in receipts:
+            stream.submit(receipt)
+
+    # back in the order the receipts came in
+    results = {r.stem: stream.results[r.stem] for r in receipts if r.stem in stream.results}
+    return results, stream.errors
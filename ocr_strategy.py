@@ -0,0 +1,92 @@
+import os
+from pathlib import Path
+from collections import Counter
+from typing import Callable, Optional, Sequence
+from dataclasses import dataclass, field
+
+OCR_CONF_THRESHOLD = float(os.environ.get("OCR_CONF_THRESHOLD", 60))  # mean word confidence that triggers escalation
+REQUIRED_FIELDS = ("purchase_date", "cost_text")
+FIELDS = ("purchase_date", "supplier", "cost_text", "subtotal", "tax", "currency")
+
+@dataclass(slots=False)
+class StrategyResult:
+    receipt_path: Path
+    purchase_date: Optional[str] = None
+    supplier: Optional[str] = None
+    cost_text: Optional[str] = None
+    subtotal: Optional[str] = None
+    tax: Optional[str] = None
+    currency: Optional[str] = None
+    text: Optional[str] = field(repr=False, default=None)
+    data: Optional[object] = field(repr=False, default=None)
+    attempts: list[str] = field(default_factory=list)   # configs in the order they ran
+    escalated: list[str] = field(default_factory=list)  # configs whose result wasn't good enough
+    chosen: dict[str, str] = field(default_factory=dict)  # field -> config the value came from
+    timings: dict[str, float] = field(default_factory=dict)  # stage -> seconds, summed over attempts
+    format: Optional[str] = None  # as decoded, see ReceiptOCR.format
+
+def needs_escalation(rec, threshold: float = OCR_CONF_THRESHOLD, required: Sequence[str] = REQUIRED_FIELDS) -> bool:
+    if any(getattr(rec, name) is None for name in required):
+        return True
+    return rec.mean_conf < threshold
+
+def run_adaptive(receipt: Path, process: Callable, configs: Sequence[str],
+                 threshold: float = OCR_CONF_THRESHOLD, required: Sequence[str] = REQUIRED_FIELDS) -> StrategyResult:
+    """Runs configs in order (cheapest first), stopping at the first result that has the required
+    fields with good enough confidence. Each field then takes the most confident value seen."""
+    result = StrategyResult(receipt_path=receipt)
+    attempts = []
+
+    for config in configs:
+        rec = process(receipt, config)
+        attempts.append((config, rec))
+        result.attempts.append(config)
+        result.format = getattr(rec, "format", None)
+        for stage, seconds in getattr(rec, "timings", {}).items():
+            result.timings[stage] = result.timings.get(stage, 0.0) + seconds
+
+        if not needs_escalation(rec, threshold, required):
+            break
+        result.escalated.append(config)
+
+    for name in FIELDS:
+        found = [(rec.field_conf.get(name, -1), config, getattr(rec, name))
+                 for config, rec in attempts if getattr(rec, name) is not None]
+        if found:
+            # ties go to the earlier (cheaper) config
+            conf, config, value = max(found, key=lambda x: x[0])
+            setattr(result, name, value)
+            result.chosen[name] = config
+
+    best_config, best = max(attempts, key=lambda a: a[1].mean_conf)
+    result.text, result.data = best.text, best.data
+    return result
+
+class StrategyStats:
+    """Per config counters: how often it ran, how often it had to escalate, how many fields it won."""
+
+    def __init__(self):
+        self.receipts = 0
+        self.runs = Counter()
+        self.escalations = Counter()
+        self.fields_won = Counter()
+
+    def record(self, attempts: Sequence[str], escalated: Sequence[str], chosen: dict[str, str]) -> None:
+        self.receipts += 1
+        self.runs.update(attempts)
+        self.escalations.update(escalated)
+        self.fields_won.update(chosen.values())
+
+    def summary(self) -> dict:
+        return {
+            "receipts": self.receipts,
+            "configs": {
+                config: {
+                    "runs": self.runs[config],
+                    "escalations": self.escalations[config],
+                    "escalation_rate": self.escalations[config] / self.runs[config],
+                    "fields_won": self.fields_won[config],
+                }
+                for config in self.runs
+            },
+        }
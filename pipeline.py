@@ -0,0 +1,97 @@
+import os, time, queue, threading
+from pathlib import Path
+from typing import Optional
+from ocr_cache import OCRCache
+from ocr_engine import OCR_WORKERS, OCRStream
+from state_store import StateStore
+from decoder import DecodeStats
+from slack_receipt_downloader import DOWNLOAD_WORKERS, channel_history
+from receipt_ocr import STATE_JSON, ocr_process, upload_file_tracking, combine_data_sources
+import telemetry
+
+log = telemetry.get_logger("pipeline")
+
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", 8))  # downloaded files waiting for OCR
+PIPELINE_IN_MEMORY = os.environ.get("PIPELINE_IN_MEMORY", "0") == "1"  # hand OCR the downloaded bytes, write the file in the background
+
+_DONE = object()
+
+def streaming_pipeline(chan_id: str, download_workers: int = DOWNLOAD_WORKERS, ocr_workers: int = OCR_WORKERS,
+                       queue_size: int = PIPELINE_QUEUE_SIZE, in_memory: bool = PIPELINE_IN_MEMORY) -> dict[str, dict[str, Optional[str]]]:
+    """Downloads and OCR at the same time: channel_history puts each renamed file on a bounded queue
+    and an OCR thread feeds it to the worker pool straight away. When OCR falls behind the queue
+    fills up and channel_history (and so the downloads) wait for it.
+
+    in_memory skips the disk round trip: files are downloaded into memory, the bytes go on the
+    queue with the path they will be saved under, and the file is written in the background."""
+    files: queue.Queue = queue.Queue(maxsize=queue_size)
+    started = time.perf_counter()
+    first_result: list[float] = []
+    failure: list[BaseException] = []
+    results_def: dict[str, dict[str, Optional[str]]] = {}
+    decode_stats = DecodeStats()
+
+    def record(receipt: Path, payload: dict) -> None:
+        if not first_result:
+            first_result.append(time.perf_counter() - started)
+        decode_stats.record(payload)
+
+    # cache + state store are sqlite connections, so they live on the OCR thread
+    def ocr_consumer():
+        submitted = []
+        finished = False
+        process, cache_tag = ocr_process()
+        try:
+            with OCRCache() as cache, StateStore(legacy_json=STATE_JSON) as store, \
+                    OCRStream(process, ocr_workers, cache, cache_tag, record) as stream:
+                while (item := files.get()) is not _DONE:
+                    receipt, buffer = item
+                    submitted.append(receipt)
+                    stream.submit(receipt, buffer)
+                    del item, buffer  # don't keep the bytes alive while waiting for the next file
+                finished = True
+                stream.close()
+
+                # fields into the ledger before anything is marked done, a failed download that
+                # stops channel_history still ends up here and the OCR'd receipts aren't lost
+                if stream.results:
+                    combine_data_sources(stream.results)
+                for receipt in submitted:
+                    if receipt in stream.errors:
+                        log.error("OCR failed", receipt=receipt.name, error=str(stream.errors[receipt]))
+                        upload_file_tracking(receipt, store, "failed", str(stream.errors[receipt]))
+                    else:
+                        upload_file_tracking(receipt, store)
+                results_def.update(stream.results)
+                log.info("OCR cache", **cache.stats())
+        except BaseException as e:
+            failure.append(e)
+            # keep draining so the downloader never blocks on a dead consumer
+            while not finished and files.get() is not _DONE:
+                pass
+
+    consumer = threading.Thread(target=telemetry.with_context(ocr_consumer), name="ocr-consumer")
+    consumer.start()
+    try:
+        if in_memory:
+            channel_history(chan_id, download_workers, on_buffer=lambda path, data: files.put((path, data)))
+        else:
+            channel_history(chan_id, download_workers, on_file=lambda path: files.put((path, None)))
+    finally:
+        files.put(_DONE)
+        consumer.join()
+
+    if failure:
+        raise failure[0]
+
+    wall = time.perf_counter() - started
+    ttfr = f"{first_result[0]:.2f}s" if first_result else "n/a"
+    telemetry.observe("stage_seconds", wall, stage="streaming_pipeline")
+    log.info("streaming pipeline finished", receipts=len(results_def), first_result=ttfr, wall_s=round(wall, 2))
+    if decode_stats.times:
+        log.info("decode time per format", **decode_stats.summary())
+
+    for k, v in results_def.items():
+        log.debug("receipt fields", receipt=k, **v)
+
+    return results_def
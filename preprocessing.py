@@ -0,0 +1,135 @@
+import os, time
+import cv2
+import numpy as np
+from typing import Callable, Optional, Sequence, Union
+
+PIPELINE_VERSION = "1"  # bump when any stage below changes what it outputs
+PREPROCESS_STAGES = os.environ.get("PREPROCESS_STAGES", "grey,normalize,crop,deskew,binarize")
+TARGET_TEXT_HEIGHT = int(os.environ.get("TARGET_TEXT_HEIGHT", 30))  # px, tesseract is most accurate around 20-40
+MAX_LONG_SIDE = int(os.environ.get("MAX_LONG_SIDE", 2400))  # px cap when the text height can't be measured
+MAX_DESKEW = 15.0  # degrees, anything bigger is more likely a bad angle estimate than a tilted photo
+
+def to_grey(img: np.ndarray) -> np.ndarray:
+    if img.ndim == 2:
+        return img
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+def _grey_copy(img: np.ndarray) -> np.ndarray:
+    return img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+# Median height of character sized blobs, measured on a small copy so it's cheap on 12MP photos
+def estimate_text_height(img: np.ndarray, probe_side: int = 1200) -> Optional[float]:
+    grey = _grey_copy(img)
+    scale = min(1.0, probe_side / max(grey.shape[:2]))
+    small = cv2.resize(grey, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else grey
+
+    _, th = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    n, _, stats, _ = cv2.connectedComponentsWithStats(th, connectivity=8)
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    widths = stats[1:, cv2.CC_STAT_WIDTH]
+
+    # drop specks and big blobs (logos, the receipt edge), keep roughly glyph shaped ones
+    keep = (heights >= 4) & (heights <= small.shape[0] * 0.1) & (widths <= heights * 3)
+    if keep.sum() < 20:
+        return None
+    return float(np.median(heights[keep])) / scale
+
+# Scale so text lines come out about TARGET_TEXT_HEIGHT px tall
+def normalize(img: np.ndarray) -> np.ndarray:
+    height = estimate_text_height(img)
+    long_side = max(img.shape[:2])
+
+    if height:
+        scale = TARGET_TEXT_HEIGHT / height
+    else:
+        scale = min(1.0, MAX_LONG_SIDE / long_side)
+
+    scale = min(max(scale, 0.2), 2.0)
+    if abs(scale - 1.0) < 0.05:
+        return img
+
+    interp = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+    return cv2.resize(img, None, fx=scale, fy=scale, interpolation=interp)
+
+# Crop to the receipt: biggest bright region, only when it's clearly smaller than the photo
+def crop(img: np.ndarray, margin: int = 10) -> np.ndarray:
+    grey = _grey_copy(img)
+    blur = cv2.GaussianBlur(grey, (7, 7), 0)
+    _, th = cv2.threshold(blur, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    th = cv2.morphologyEx(th, cv2.MORPH_CLOSE, np.ones((15, 15), np.uint8))
+
+    contours, _ = cv2.findContours(th, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return img
+
+    x, y, w, h = cv2.boundingRect(max(contours, key=cv2.contourArea))
+    area = (w * h) / (grey.shape[0] * grey.shape[1])
+    if area < 0.2 or area > 0.95:
+        return img
+
+    y0, y1 = max(0, y - margin), min(grey.shape[0], y + h + margin)
+    x0, x1 = max(0, x - margin), min(grey.shape[1], x + w + margin)
+    return img[y0:y1, x0:x1]
+
+def deskew(img: np.ndarray) -> np.ndarray:
+    grey = _grey_copy(img)
+    _, th = cv2.threshold(grey, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    coords = cv2.findNonZero(th)
+    if coords is None or len(coords) < 100:
+        return img
+
+    angle = cv2.minAreaRect(coords)[-1]
+    # minAreaRect reports [-90, 0) on older OpenCV and [0, 90) on newer, fold both to (-45, 45]
+    if angle < -45:
+        angle += 90
+    elif angle > 45:
+        angle -= 90
+
+    if abs(angle) < 0.5 or abs(angle) > MAX_DESKEW:
+        return img
+
+    h, w = grey.shape[:2]
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    return cv2.warpAffine(img, matrix, (w, h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+def binarize(img: np.ndarray) -> np.ndarray:
+    grey = _grey_copy(img)
+    # Need to do more research on and find better methods of thresh holds
+    den = cv2.medianBlur(grey, 3)
+    _, th = cv2.threshold(den, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return th
+
+STAGES: dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    "grey": to_grey,
+    "normalize": normalize,
+    "crop": crop,
+    "deskew": deskew,
+    "binarize": binarize,
+}
+
+class Preprocessor:
+    """Runs the selected stages in order and keeps the time each one took on the last image."""
+
+    def __init__(self, stages: Union[str, Sequence[str]] = PREPROCESS_STAGES):
+        if isinstance(stages, str):
+            stages = [s.strip() for s in stages.split(",") if s.strip()]
+
+        unknown = [s for s in stages if s not in STAGES]
+        if unknown:
+            raise ValueError(f"Unknown preprocessing stage(s) {unknown}, pick from {list(STAGES)}")
+
+        self.stages = list(stages)
+        self.timings: dict[str, float] = {}
+
+    # Goes into the OCR cache key, different chains give different pixels
+    @property
+    def version(self) -> str:
+        return f"{PIPELINE_VERSION}:{','.join(self.stages)}:{TARGET_TEXT_HEIGHT}:{MAX_LONG_SIDE}"
+
+    def __call__(self, img: np.ndarray) -> np.ndarray:
+        self.timings = {}
+        for name in self.stages:
+            start = time.perf_counter()
+            img = STAGES[name](img)
+            self.timings[name] = time.perf_counter() - start
+        return img
@@ -0,0 +1,95 @@
+import os, re, time, sqlite3, threading
+from pathlib import Path
+from typing import Optional
+from receipt_store import RECEIPT_DB
+
+class ReceiptIds:
+    """Receipt numbers (R001, R002, ...) from a counter kept in the receipt store database.
+
+    Each number is one short IMMEDIATE transaction, so processes and threads sharing the database
+    never get the same number and nothing has to probe the download folder. The Slack file id a
+    number went to is recorded, asking again for the same file gives back the same number.
+    """
+
+    def __init__(self, path=RECEIPT_DB, prefix: str = "R", seed_dir: Optional[Path] = None):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+
+        # transactions are opened by hand, BEGIN IMMEDIATE takes the write lock up front
+        self.conn = sqlite3.connect(path, isolation_level=None, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS receipt_seq (prefix TEXT PRIMARY KEY, next INTEGER NOT NULL)")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS receipt_ids (
+                file_id TEXT PRIMARY KEY,
+                receipt_number TEXT NOT NULL UNIQUE,
+                allocated_at REAL NOT NULL
+            )""")
+        self._seed(seed_dir)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _number(self, name: str) -> int:
+        match = re.fullmatch(rf"{re.escape(self.prefix)}(\d+)", name or "")
+        return int(match.group(1)) if match else 0
+
+    # First use: carry on after the highest number already in the ledger or the download folder
+    def _seed(self, seed_dir: Optional[Path]) -> None:
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self.conn.execute("SELECT 1 FROM receipt_seq WHERE prefix = ?", (self.prefix,)).fetchone():
+                    self.conn.execute("COMMIT")
+                    return
+
+                high = 0
+                if self.conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'receipts'").fetchone():
+                    for (name,) in self.conn.execute("SELECT Receipt_Number FROM receipts"):
+                        high = max(high, self._number(str(name)))
+                if seed_dir is not None and os.path.isdir(seed_dir):
+                    with os.scandir(seed_dir) as entries:
+                        for e in entries:
+                            high = max(high, self._number(Path(e.name).stem))
+
+                self.conn.execute("INSERT INTO receipt_seq (prefix, next) VALUES (?, ?)", (self.prefix, high + 1))
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def lookup(self, file_id: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute("SELECT receipt_number FROM receipt_ids WHERE file_id = ?", (file_id,)).fetchone()
+        return row[0] if row else None
+
+    def allocate(self, file_id: Optional[str] = None) -> str:
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                if file_id:
+                    row = self.conn.execute("SELECT receipt_number FROM receipt_ids WHERE file_id = ?", (file_id,)).fetchone()
+                    if row:
+                        self.conn.execute("COMMIT")
+                        return row[0]
+
+                (n,) = self.conn.execute("SELECT next FROM receipt_seq WHERE prefix = ?", (self.prefix,)).fetchone()
+                self.conn.execute("UPDATE receipt_seq SET next = ? WHERE prefix = ?", (n + 1, self.prefix))
+                receipt_number = f"{self.prefix}{n:03d}"
+                if file_id:
+                    self.conn.execute("INSERT INTO receipt_ids (file_id, receipt_number, allocated_at) VALUES (?, ?, ?)",
+                                      (file_id, receipt_number, time.time()))
+                self.conn.execute("COMMIT")
+                return receipt_number
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    __call__ = allocate
+
+    def close(self) -> None:
+        self.conn.close()
@@ -1,227 +1,255 @@
-﻿import re, os, json
+﻿import os, time
 import cv2
 import numpy as np
-import openpyxl
 import pandas as pd
 import pytesseract
 from pathlib import Path
-from typing import Optional
-from dotenv import load_dotenv
-from dataclasses import dataclass, field
+from typing import Callable, Optional
+from collections import Counter
+from functools import cached_property
+from dataclasses import InitVar, dataclass, field
+from ocr_engine import OCR_WORKERS, run_ocr_batch
+from ocr_cache import OCRCache
+from state_store import StateStore
+from receipt_store import ReceiptStore
+from preprocessing import Preprocessor
+from field_extractor import DEFAULT_DOLLAR_CURRENCY, extract_fields
+from decoder import DecodeStats, ReceiptSource, decode_version
+import telemetry
+
+log = telemetry.get_logger("receipt_ocr")
 
-load_dotenv()
-excel_path = os.environ["EXCEL_PATH"]
 STATE_JSON = os.environ.get("STATE_JSON")
 
-PLACEHOLDERS = ['REPLACE', 'Bot_Holder']
-
-DATE_PATTERNS: tuple[re.Pattern,...] = (
-    re.compile(r"\d{2}-[A-Z]{3}-\d{4}", re.I),
-    re.compile(r"\d{2}-\d{2}-\d{4}"),
-    re.compile(r"\d{2}-\d{2}-\d{2}"),
-    re.compile(r"\d{2}/\d{2}/\d{4}"),
-    re.compile(r"\d{2}/\d{2}/\d{2}"),
-)
-
-def gather_picture_files(dir_path: Path) -> list:
-    receipt_list = []
-    new_files = []
-    files_read = None
-
-    # Looking for JSON file
-    try:
-        with open(STATE_JSON) as f:
-            files_read = json.load(f)["files_read"]
-    except FileNotFoundError:
-        print(f"[ERROR] File {STATE_JSON} not found.")
-    except KeyError as e:
-        print(f"[ERROR] KEY {e} not found.")
-
-    # Checking values returned
-    if files_read:
-        # Searching for files not in files_read
-        for file in dir_path.iterdir():
-            if str(file) not in files_read:
-                new_files.append(file)
-
-        return new_files
-
-    # no values in JSON
-    else:
-        for file in dir_path.iterdir():
-            receipt_list.append(file)
-        return receipt_list
+PREPROCESSOR = Preprocessor()  # stages picked with PREPROCESS_STAGES, empty means OCR the photo as is
+DECODE_GREY = PREPROCESSOR.stages[:1] == ["grey"]  # the chain starts by dropping colour, so the decoder can skip it
+PREPROCESS_VERSION = f"4|{PREPROCESSOR.version}|{decode_version()}|{int(DECODE_GREY)}|{DEFAULT_DOLLAR_CURRENCY}"  # old OCR cache entries stop matching when decoding, image prep or extraction changes
+
+OCR_MODE = os.environ.get("OCR_MODE", "full")  # "roi": quick low-res pass, then focused OCR of the lines that matter
+
+# extract_fields name -> ReceiptOCR attribute
+FIELD_NAMES = {"date": "purchase_date", "total": "cost_text"}
+
+# Files in the download folder that haven't been through OCR yet (indexed lookup in the state store)
+def gather_picture_files(dir_path: Path, store: StateStore) -> list:
+    return store.new_files(dir_path)
+
+# image_to_data as a DataFrame, kept as strings so "007" or "12.50" come through unchanged
+def image_to_words(image: np.ndarray, config: Optional[str] = None) -> pd.DataFrame:
+    raw = pytesseract.image_to_data(image, config=config or "", output_type=pytesseract.Output.DICT)
+    data = pd.DataFrame(raw)
+    data["text"] = data["text"].astype(str)
+    data["conf"] = pd.to_numeric(data["conf"], errors="coerce").fillna(-1)
+    return data
+
+# Puts the words back together line by line, same layout image_to_string would give
+def words_to_text(data: pd.DataFrame) -> str:
+    words = data[(data["conf"] >= 0) & (data["text"].str.strip() != "")]
+    lines = words.groupby(["page_num", "block_num", "par_num", "line_num"], sort=True)["text"].agg(" ".join)
+    return "\n".join(lines)
+
+# Mean word confidence of each line words_to_text produces, in the same order
+def line_confidences(data: pd.DataFrame) -> list[float]:
+    words = data[(data["conf"] >= 0) & (data["text"].str.strip() != "")]
+    return words.groupby(["page_num", "block_num", "par_num", "line_num"], sort=True)["conf"].mean().tolist()
 
 @dataclass(slots=False)
 class ReceiptOCR:
     receipt_path: Path
     config: Optional[str] = field(default=None)
+    buffer: InitVar[Optional[bytes]] = None  # the file's bytes when they are already in memory, see ReceiptSource
 
     purchase_date: Optional[str] = field(init=False, default=None)
     supplier: Optional[str] = field(init=False, default=None)
-    cost_text: Optional[float] = field(init=False, default=None)
+    cost_text: Optional[str] = field(init=False, default=None)
+    subtotal: Optional[str] = field(init=False, default=None)
+    tax: Optional[str] = field(init=False, default=None)
+    currency: Optional[str] = field(init=False, default=None)
     text: Optional[str] = field(init=False, repr=False, default=None)
-    data: Optional[str] = field(init=False, repr=False, default=None)
-
-    def __post_init__(self) -> None:
-        try:
-            image = cv2.imread(str(self.receipt_path))
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-
-            if self.config:
-                self.text = pytesseract.image_to_string(image, config=self.config)
-                self.data = pytesseract.image_to_string(image, config=self.config)
-
-            # This is the default config case
-            else:
-                self.text = pytesseract.image_to_string(image)
-                self.data = pytesseract.image_to_string(image, config=self.config)
-
+    data: Optional[pd.DataFrame] = field(init=False, repr=False, default=None)
+    field_conf: dict = field(init=False, repr=False, default_factory=dict)  # field -> 0-100, see extract_fields
+    timings: dict = field(init=False, repr=False, default_factory=dict)  # seconds per preprocessing stage + tesseract
+    format: Optional[str] = field(init=False, default=None)  # jpeg, png, heic, pdf, or pdf-text when the text layer was read
+    pages: int = field(init=False, repr=False, default=0)  # pages OCR'd
+
+    reduced_decode = True  # big JPEGs may come out of the decoder at 1/2, 1/4 ..., see DECODE_MIN_LONG_SIDE
+
+    # A file that can't be decoded or OCR'd raises, OCRStream records it and the state store
+    # keeps it as failed so the next run tries it again
+    def __post_init__(self, buffer: Optional[bytes]) -> None:
+        with ReceiptSource(self.receipt_path, buffer, DECODE_GREY, None if self.reduced_decode else 0) as source:
+            self._read(source)
+
+    def _read(self, source: ReceiptSource) -> None:
+        self.format = source.format
+        if source.text_layer:
+            # the PDF already knows its text, nothing to OCR
+            self.format = "pdf-text"
+            self.timings["decode"] = source.seconds
+            self.text = source.text
             self._extract_text(self.text)
-
-        except Exception as e:
-            print(f"[ERROR] {e}")
-
-    def _text_analysis (self, data: pd.DataFrame):
-        mask = self.data
-        n_rows = mask.sum()
-        mask_70 = (self.data["conf"] >=70)
-        stats = data.loc[mask,'conf'].agg(['count','mean','std'])
-        bins = pd.cut(mask['conf'], [-1, 0, 50, 70, 85, 100], labels=['<0', '0–50', '50–70', '70–85', '85–100'])
-        dist_70 = bins.value_counts().loc['85–100']
-        perc = dist_70.sum()/n_rows
-
-        print(mask_70)
-        print(stats)
-        print(perc)
-
-    def _extract_text(self, text: str) -> None:
-        print("entered")
-
-        lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
-
-        if lines:
-            self.supplier = lines[0]
-
-        for line in lines:
-            if "total" in line.lower():
-                amount_pattern = r"\$?\s?\d[\d,]*\.?\d{0,2}"
-                match = re.search(amount_pattern, line)
-                print(match)
-
-                if match:
-                    self.cost_text = match.group(0).replace(" ", "")
-                    break
-
-        for line in lines:
-            for pattern in DATE_PATTERNS:
-                match = pattern.search(line)
-                if match:
-                    self.purchase_date = match.group(0)
-                    break
-
-            if self.purchase_date:
+            return
+
+        # scanned PDFs are OCR'd a page at a time until the date and total have turned up,
+        # fields are extracted once per page from all the text so far
+        texts, frames, confs = [], [], []
+        for image in source.pages():
+            confs += self._ocr(self._prepare(image))
+            self.pages += 1
+            texts.append(self.text)
+            frames.append(self.data.assign(page_num=self.pages))
+            if self.pages > 1:
+                self.text = "\n".join(texts)
+                self.data = pd.concat(frames, ignore_index=True)
+            self._extract_text(self.text, confs)
+            if self.purchase_date and self.cost_text:
                 break
+        self.timings["decode"] = source.seconds
+
+    # stage times add up over the pages of a scanned PDF
+    def _add_time(self, stage: str, seconds: float) -> None:
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def _prepare(self, image: np.ndarray) -> np.ndarray:
+        if PREPROCESSOR.stages:
+            image = PREPROCESSOR(image)
+            for stage, seconds in PREPROCESSOR.timings.items():
+                self._add_time(stage, seconds)
+        else:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        return image
+
+    # One tesseract call gives the words with their confidence, the text is rebuilt from them.
+    # Sets data and text for this page, returns the confidence of each of its lines
+    def _ocr(self, image: np.ndarray) -> list[float]:
+        start = time.perf_counter()
+        self.data = image_to_words(image, self.config)
+        self._add_time("tesseract", time.perf_counter() - start)
+        self.text = words_to_text(self.data)
+        return line_confidences(self.data)
+
+    # Word confidence stats, only worked out when something asks for them
+    @cached_property
+    def confidence(self) -> dict[str, float]:
+        return self._text_analysis(self.data)
+
+    def _text_analysis (self, data: pd.DataFrame) -> dict[str, float]:
+        if data is None or data.empty:
+            return {"count": 0, "mean": float("nan"), "std": float("nan"), "pct_70": 0.0, "pct_85": 0.0}
+
+        # -1 is tesseract's marker for layout rows (blocks/lines), not words
+        conf = data.loc[data["conf"] >= 0, "conf"]
+        n_rows = len(conf)
+        stats = conf.agg(['count','mean','std'])
+        bins = pd.cut(conf, [-1, 50, 70, 85, 100], labels=['0–50', '50–70', '70–85', '85–100'])
+        dist = bins.value_counts()
+
+        return {
+            "count": int(stats["count"]),
+            "mean": float(stats["mean"]) if n_rows else float("nan"),
+            "std": float(stats["std"]) if n_rows > 1 else float("nan"),
+            "pct_70": float((conf >= 70).sum() / n_rows) if n_rows else 0.0,
+            "pct_85": float(dist.loc['85–100'] / n_rows) if n_rows else 0.0,
+        }
 
-        self._text_analysis()
-
-def process_receipt (receipt: Path) ->ReceiptOCR:
-    return ReceiptOCR(receipt_path=receipt)
-
-def upload_file_tracking(receipt: Path):
-    try:
-        with open(STATE_JSON) as f:
-            files_read = json.load(f)['files_read']
-    except FileNotFoundError:
-        files_read = []
-
-    files_read.append(str(receipt))
-
-    with open(STATE_JSON, 'w') as f:
-        json.dump({'files_read': files_read}, f,indent=2)
-
-def extracted_text_to_excel(text: pd.DataFrame):
-    # will move this to the main app.py
-    # excel_path = os.environ["EXCEL_PATH"]
-
-    wb = openpyxl.load_workbook(excel_path)
-    count = len(wb.sheetnames)
-    sheet_name = f"Sheet{count+1}"
-
-    if not os.path.exists(excel_path):
-        print(f"File not found: {excel_path}")
-
-    with pd.ExcelWriter(excel_path, mode='a' ,engine='openpyxl', if_sheet_exists='replace') as writer:
-        text.to_excel(writer, sheet_name=sheet_name, index=False)
-
-    wb = openpyxl.load_workbook(excel_path)
-    ws = wb[sheet_name]
-    red_fill = openpyxl.styles.PatternFill(start_color='FFC7CE', end_color='FFC7CE', fill_type='solid')
-    red_font = openpyxl.styles.Font(color='9C0006')
-
-    for row in ws.iter_rows(min_row=2):
-        for cell in row:
-            if cell.value == "Bot_Holder":
-                cell.fill = red_fill
-
-            elif cell.value == "Null":
-                cell.value = " "
-
-            if cell.value == "REPLACE":
-                cell.font = red_font
-    wb.save(excel_path)
-
-def combine_data_sources(ocr_data: dict):
-    # reading excel
-    excel = pd.read_excel(excel_path, sheet_name='Sheet1')
-    df = pd.DataFrame.from_dict(ocr_data, orient='index')
-
-    df_reset = df.reset_index().rename(columns={'index':'Receipt_Number'})
-    col_names = df_reset.columns.drop('Receipt_Number')
-
-    # Merging the data and adding suffix to separate
-    merged_data = df_reset.merge(excel,on='Receipt_Number', suffixes=('_old', ''))
-    for col in col_names:
-        merged_data[f"{col}_old"] = merged_data[f"{col}_old"].replace(PLACEHOLDERS, np.nan)
-
-    for col in col_names:
-        merged_data[col] = merged_data[f'{col}_old'].fillna(merged_data[col])
-
-    to_drop = merged_data.columns[merged_data.columns.str.endswith('_old')]
-    merged_data.drop(to_drop, axis=1, inplace=True)
-
-    merged_data = merged_data[["Download_Date", "Purchase_Name","Purchase_Date","Description",
-        "Supplier", "Receipt_Number", "Cost", "Message", "Purchaser", "Reimbursed", "Error_Flag"]]
-
-    extracted_text_to_excel(merged_data)
+    def _extract_text(self, text: str, line_conf: Optional[list[float]] = None) -> None:
+        start = time.perf_counter()
+        found = extract_fields(text, line_conf)
+        self._add_time("extract", time.perf_counter() - start)
+        self.supplier, self.purchase_date, self.cost_text = found.supplier, found.date, found.total
+        self.subtotal, self.tax, self.currency = found.subtotal, found.tax, found.currency
+        self.field_conf = {FIELD_NAMES.get(name, name): conf for name, conf in found.confidence.items()}
+
+def process_receipt (receipt: Path, buffer: Optional[bytes] = None) ->ReceiptOCR:
+    return ReceiptOCR(receipt_path=receipt, buffer=buffer)
+
+# The OCR function for OCR_MODE and the cache tag that goes with it
+def ocr_process() -> tuple[Callable[[Path], "ReceiptOCR"], str]:
+    if OCR_MODE == "roi":
+        from roi_ocr import ROI_VERSION, process_two_pass
+        return process_two_pass, f"roi|{ROI_VERSION}|{PREPROCESS_VERSION}"
+    return process_receipt, f"default|{PREPROCESS_VERSION}"
+
+def upload_file_tracking(receipt: Path, store: StateStore, status: str = "done", error: Optional[str] = None):
+    store.mark(receipt, status, error)
+
+# Fills the OCR fields into the matching ledger rows, only where the ledger still has a placeholder
+def combine_data_sources(ocr_data: dict) -> int:
+    with telemetry.span("combine_data_sources"), ReceiptStore() as receipts:
+        changed = receipts.fill_fields(ocr_data)
+    log.info("ledger cells filled in from OCR", cells=changed, receipts=len(ocr_data))
+    return changed
 
 # Start of pipeline
-def ocr_pipeline():
+def ocr_pipeline(workers: int = OCR_WORKERS):
     download_dir = Path(os.environ['DOWNLOAD_LOC'])
 
-    # Getting all receipts that exist within the Directory
-    receipt_list = gather_picture_files(download_dir)
+    with StateStore(legacy_json=STATE_JSON) as store:
+        # Getting all receipts that exist within the Directory
+        receipt_list = gather_picture_files(download_dir, store)
+        results_def = ocr_files(receipt_list, store, workers)
+
+    for k, v in results_def.items():
+        log.debug("OCR result", receipt=k, **v)
+
+    return results_def
 
+# Fills the ledger from the cached OCR of receipts that were already processed, nothing is OCR'd.
+# For ledger rows that came back after OCR ran (a rebuilt store, an import). dry_run only looks
+def merge_cached(dir_path: Path, store: StateStore, dry_run: bool = False) -> dict[str, dict[str, Optional[str]]]:
+    _, cache_tag = ocr_process()
+    results_def: dict[str, dict[str, Optional[str]]] = {}
+    with telemetry.span("merge_cached"), OCRCache(read_only=dry_run) as cache, os.scandir(dir_path) as entries:
+        for e in entries:
+            receipt = Path(dir_path) / e.name
+            if e.name.startswith(".") or not e.is_file() or store.status(receipt) != "done":
+                continue
+            hit = cache.get(cache.key(receipt, cache_tag))
+            if hit is not None:
+                results_def[receipt.stem] = hit["fields"]
+
+    if results_def and not dry_run:
+        combine_data_sources(results_def)
+    return results_def
+
+# OCR for a known list of receipts (the folder scan, or files handed over by the event listener)
+def ocr_files(receipt_list: list[Path], store: StateStore, workers: int = OCR_WORKERS) -> dict[str, dict[str, Optional[str]]]:
     # OCR output configuration
     results_def: dict[str, dict[str, Optional[str]]] = {}
+    stage_time = Counter()
+    decode_stats = DecodeStats()
+    recorded = 0  # receipts actually OCR'd, cache hits don't come through record()
+
+    def record(receipt: Path, payload: dict) -> None:
+        nonlocal recorded
+        recorded += 1
+        stage_time.update(payload.get("timings", {}))
+        decode_stats.record(payload)
+
+    # Setting up OCR for each receipt, spread over the worker processes, already seen images come from the cache
+    with telemetry.span("ocr_batch", receipts=len(receipt_list)), OCRCache() as cache:
+        process, cache_tag = ocr_process()
+        results, errors = run_ocr_batch(receipt_list, process, workers, cache=cache,
+                                        cache_tag=cache_tag, on_result=record)
+        log.info("OCR cache", **cache.stats())
 
-    # Setting up OCR for each receipt
     for receipt in receipt_list:
-        rec = process_receipt(receipt)
-        print(receipt)
-        print(rec)
-
-        # update JSON files read
-        upload_file_tracking(receipt)
-
-        results_def[receipt.stem] = {
-            "Purchase_Date": rec.purchase_date,
-            "Supplier": rec.supplier,
-            "Cost": rec.cost_text or None,
-        }
-
-    # quick debug print
-    for k, v in results_def.items():
-        print(k, "→", v)
+        if receipt in errors:
+            log.error("OCR failed", receipt=str(receipt), error=str(errors[receipt]))
+            upload_file_tracking(receipt, store, "failed", str(errors[receipt]))
+            continue
+
+        # update the processed file index
+        upload_file_tracking(receipt, store)
+        results_def[receipt.stem] = results[receipt.stem]
+
+    if recorded:
+        log.info("stage time per receipt (s)", **{k: round(v / recorded, 3) for k, v in stage_time.items()})
+    if decode_stats.times:
+        log.info("decode time per format", **decode_stats.summary())
+
+    if results_def:
+        combine_data_sources(results_def)
+    return results_def
 
 # ocr_pipeline()
\ No newline at end of file
@@ -1,205 +1,175 @@
-import re
-import cv2
-import os, pathlib, json
-import openpyxl
+import time
+import os, pathlib
 import pandas as pd
 import numpy as np
-import pytesseract
 from pathlib import Path
 from dotenv import load_dotenv
-from openpyxl import load_workbook
 from dataclasses import dataclass, field
 from typing import Optional, Iterable
+from collections import Counter
+from ocr_engine import OCR_WORKERS, run_ocr_batch
+from ocr_cache import OCRCache
+from state_store import StateStore
+from receipt_ocr import FIELD_NAMES, image_to_words, words_to_text, line_confidences, combine_data_sources
+from field_extractor import DEFAULT_DOLLAR_CURRENCY, extract_fields
+from preprocessing import Preprocessor
+from decoder import DecodeStats, ReceiptSource, decode_version
+from ocr_strategy import OCR_CONF_THRESHOLD, StrategyResult, StrategyStats, run_adaptive
+import telemetry
+
+log = telemetry.get_logger("receipt_processing")
 
-load_dotenv()
 CONFIG1 = r"--oem 3 --psm 6"
 CONFIG2 = r"--oem 1 --psm 6"
 
-DATE_PATTERNS: tuple[re.Pattern,...] = (
-    re.compile(r"\d{2}-[A-Z]{3}-\d{4}", re.I),
-    re.compile(r"\d{2}-\d{2}-\d{4}"),
-    re.compile(r"\d{2}-\d{2}-\d{2}"),
-    re.compile(r"\d{2}/\d{2}/\d{4}"),
-    re.compile(r"\d{2}/\d{2}/\d{2}"),
+# Tried in order, later ones only run when the earlier result is missing fields or low confidence
+OCR_LADDER = (
+    CONFIG1,
+    CONFIG2,
+    r"--oem 3 --psm 4",   # single column of variable sized text
+    r"--oem 3 --psm 11",  # sparse text, no layout
 )
 
-PLACEHOLDERS = ['REPLACE', 'Bot_Holder']
+PREPROCESSOR = Preprocessor()  # stages picked with PREPROCESS_STAGES
+DECODE_GREY = PREPROCESSOR.stages[:1] == ["grey"]  # decode straight to grey when colour is dropped first anyway
+PREPROCESS_VERSION = f"grey-4|{PREPROCESSOR.version}|{decode_version()}|{int(DECODE_GREY)}|{DEFAULT_DOLLAR_CURRENCY}"  # old OCR cache entries stop matching when the chain changes
 TRACKING_JSON = os.environ.get("TRACKING_JSON")
 
 # This gets all the files that are in the directory
-#       - Need to create json date to read last file read
 #       - Check image file types as well
 
-def gather_picture_files(dir: pathlib.Path):
-    receipt_list = []
-    new_files = []
-    files_read = None
-
-    try:
-        with open('app_state.json') as f:
-            files_read = json.load(f)["files_read"]
-    except (KeyError, FileNotFoundError) as e:
-        print(f"[ERROR] {type(e).__name__}: {e}")
-        files_read = []
-
-    if files_read:
-        for file in dir.iterdir():
-            if str(file) not in files_read:
-                new_files.append(file)
-
-        return new_files
-    else:
-        for file in dir.iterdir():
-            receipt_list.append(file)
-        return receipt_list
+def gather_picture_files(dir: pathlib.Path, store: StateStore):
+    return store.new_files(dir)
+
+class PreparedReceipt:
+    """A receipt decoded and preprocessed once for every config in OCR_LADDER.
+
+    Pages are decoded as far as a config reads them and kept, so the next config only re-runs
+    tesseract. .timings is the decode + preprocessing time, spent once however many configs ran.
+    """
+
+    def __init__(self, receipt: Path):
+        self.source = ReceiptSource(receipt, grey=DECODE_GREY)
+        self.images: list[np.ndarray] = []
+        self._stage_times: dict[str, float] = {}
+        self._pages = None if self.source.text_layer else self.source.pages()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def timings(self) -> dict[str, float]:
+        return {"decode": self.source.seconds, **self._stage_times}
+
+    def pages(self) -> Iterable[np.ndarray]:
+        n = 0
+        while True:
+            if n == len(self.images):
+                img = next(self._pages, None)
+                if img is None:
+                    return
+                self.images.append(PREPROCESSOR(img))
+                # summed over the pages, like tesseract
+                for stage, seconds in PREPROCESSOR.timings.items():
+                    self._stage_times[stage] = self._stage_times.get(stage, 0.0) + seconds
+            yield self.images[n]
+            n += 1
+
+    # process(receipt, config) for run_adaptive
+    def process(self, receipt: Path, config: str) -> "ReceiptOCR":
+        return ReceiptOCR(receipt_path=receipt, config=config, prepared=self)
+
+    def close(self) -> None:
+        self.source.close()
+        self._pages = None
+        self.images = []
 
 @dataclass(slots=False)
 class ReceiptOCR:
     receipt_path: Path
     config: str = CONFIG1
+    prepared: Optional[PreparedReceipt] = field(default=None, repr=False, compare=False)  # shared between configs, see process_adaptive
     
     purchase_date: Optional[str] = field(init=False, default=None)
     supplier: Optional[str] = field(init=False, default=None)
-    cost_text : Optional[float] = field(init=False, default=None)
+    cost_text : Optional[str] = field(init=False, default=None)
+    subtotal: Optional[str] = field(init=False, default=None)
+    tax: Optional[str] = field(init=False, default=None)
+    currency: Optional[str] = field(init=False, default=None)
     text: Optional[str] = field(init=False,repr= False, default=None)
+    data: Optional[pd.DataFrame] = field(init=False, repr=False, default=None)
+    field_conf: dict = field(init=False, repr=False, default_factory=dict)  # field -> confidence of the line it came from
+    timings: dict = field(init=False, repr=False, default_factory=dict)  # seconds per preprocessing stage + tesseract
+    format: Optional[str] = field(init=False, default=None)  # see receipt_ocr.ReceiptOCR.format
 
     def __post_init__(self) -> None:
-        try:
-            img = cv2.imread(str(self.receipt_path))
-        except FileNotFoundError:
-            print(f"File not found: {self.receipt_path}")
-
-        processed_img = self._preprocess_grey(img)
-        self.text = pytesseract.image_to_string(processed_img, config=self.config)
-        self._extract_text(self.text)
-
-    def _preprocess_grey(self, img: np.ndarray) -> np.ndarray:
-        # return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        grey = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        # a shared receipt has its decode + preprocessing time counted once, by whoever prepared it
+        if self.prepared is not None:
+            self._read(self.prepared)
+            return
+        with PreparedReceipt(self.receipt_path) as prepared:
+            self._read(prepared)
+        self.timings.update(prepared.timings)
+
+    def _read(self, prepared: PreparedReceipt) -> None:
+        source = prepared.source
+        if source.text_layer:
+            self.format = "pdf-text"
+            self.text = source.text
+            self._extract_text(self.text)
+        else:
+            self.format = source.format
+            self._read_pages(prepared)
+
+    # OCR page by page (only scanned PDFs have more than one) until the date and total are found
+    def _read_pages(self, prepared: PreparedReceipt) -> None:
+        frames = []
+        for n, processed_img in enumerate(prepared.pages(), start=1):
+            start = time.perf_counter()
+            frames.append(image_to_words(processed_img, self.config).assign(page_num=n))
+            self.timings["tesseract"] = self.timings.get("tesseract", 0.0) + time.perf_counter() - start
+
+            self.data = pd.concat(frames, ignore_index=True) if n > 1 else frames[0]
+            self.text = words_to_text(self.data)
+            self._extract_text(self.text, line_confidences(self.data))
+            if self.purchase_date and self.cost_text:
+                break
 
-        # Need to do more research on and find better methods of thresh holds
-        den = cv2.medianBlur(grey, 3)
-        _, th = cv2.threshold(den, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        return th
+    @property
+    def mean_conf(self) -> float:
+        # a text layer is exact, no reason to try other OCR configs
+        if self.format == "pdf-text":
+            return 100.0
+        conf = self.data.loc[self.data["conf"] >= 0, "conf"] if self.data is not None else []
+        return float(conf.mean()) if len(conf) else -1.0
 
     # Extracts the text values from the images
-    def _extract_text(self, text: str) -> None:
-        # clean the text - for line in text split and strip trail and return if not empty
-        lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
-
-        if lines:
-            self.supplier = lines[0]
-
-        for line in lines:
-            if "Total" in line.lower():
-                amount_pattern = r"\$?\s?\d[\d,]*\.?\d{0,2}"
-                match = re.search(amount_pattern, line)
-                print(match)
-
-                if match:
-                    self.cost_text = match.group(0).replace(" ", "")
-                    break
-
-        for line in lines:
-            for pattern in DATE_PATTERNS:
-                match = pattern.search(line)
-                if match:
-                    self.purchase_date = match.group(0)
-                    break
-
-            if self.purchase_date:
-                break
+    def _extract_text(self, text: str, line_conf: Optional[list[float]] = None) -> None:
+        start = time.perf_counter()
+        found = extract_fields(text, line_conf)
+        self.timings["extract"] = self.timings.get("extract", 0.0) + time.perf_counter() - start
+        self.supplier, self.purchase_date, self.cost_text = found.supplier, found.date, found.total
+        self.subtotal, self.tax, self.currency = found.subtotal, found.tax, found.currency
+        self.field_conf = {FIELD_NAMES.get(name, name): conf for name, conf in found.confidence.items()}
 
 # wrapper to call dataclass easier
 def process_receipt(receipt: Path, config: str = CONFIG1) -> ReceiptOCR:
     return ReceiptOCR(receipt_path=receipt, config=config)
 
-def format_excel_output(excel_path, wb: openpyxl.workbook.Workbook, sheet):
-
-    ws = wb[sheet]
-    red_fill = openpyxl.styles.PatternFill(start_color='FFC7CE', end_color='FFC7CE', fill_type='solid')
-    red_font = openpyxl.styles.Font(color='9C0006')
-
-    for row in ws.iter_rows(min_row=2):
-        for cell in row:
-            if cell.value == "Bot_Holder" :
-                cell.fill = red_fill
-
-            elif cell.value == "Null":
-                cell.value =" "
-
-            if cell.value == "REPLACE":
-                cell.font = red_font
-    wb.save(excel_path)
-
-def extracted_text_to_excel(text: pd.DataFrame):
-    # will move this to the main app.py
-    excel_path = os.environ["EXCEL_PATH"]
+# Walks OCR_LADDER for one receipt, module level so the OCR workers can pickle it.
+# The receipt is decoded and preprocessed once, each config only re-runs tesseract on it.
+def process_adaptive(receipt: Path, threshold: float = OCR_CONF_THRESHOLD) -> StrategyResult:
+    with PreparedReceipt(receipt) as prepared:
+        result = run_adaptive(receipt, prepared.process, OCR_LADDER, threshold)
+    for stage, seconds in prepared.timings.items():
+        result.timings[stage] = result.timings.get(stage, 0.0) + seconds
+    return result
 
-    wb = openpyxl.load_workbook(excel_path)
-    count = len(wb.sheetnames)
-    sheet_name = f"Sheet{count+1}"
-
-    if not os.path.exists(excel_path):
-        print(f"File not found: {excel_path}")
-
-    with pd.ExcelWriter(excel_path, mode='a' ,engine='openpyxl', if_sheet_exists='replace') as writer:
-        text.to_excel(writer, sheet_name=sheet_name, index=False)
-
-    wb = openpyxl.load_workbook(excel_path)
-    ws = wb[sheet_name]
-    red_fill = openpyxl.styles.PatternFill(start_color='FFC7CE', end_color='FFC7CE', fill_type='solid')
-    red_font = openpyxl.styles.Font(color='9C0006')
-
-    for row in ws.iter_rows(min_row=2):
-        for cell in row:
-            if cell.value == "Bot_Holder":
-                cell.fill = red_fill
-
-            elif cell.value == "Null":
-                cell.value = " "
-
-            if cell.value == "REPLACE":
-                cell.font = red_font
-    wb.save(excel_path)
-
-
-def combine_data_sources(ocr_data: dict):
-    load_dotenv()
-    excel_path = os.environ["EXCEL_PATH"]
-
-    excel = pd.read_excel(excel_path, sheet_name='Sheet1')
-    df = pd.DataFrame.from_dict(ocr_data, orient='index')
-
-    df_reset = df.reset_index().rename(columns={'index':'Receipt_Number'})
-    col_names = df_reset.columns.drop('Receipt_Number')
-
-    merged_data = df_reset.merge(excel,on='Receipt_Number', suffixes=('_old', ''))
-    for col in col_names:
-        merged_data[f"{col}_old"] = merged_data[f"{col}_old"].replace(PLACEHOLDERS, np.nan)
-
-    for col in col_names:
-        merged_data[col] = merged_data[f'{col}_old'].fillna(merged_data[col])
-
-    to_drop = merged_data.columns[merged_data.columns.str.endswith('_old')]
-    merged_data.drop(to_drop, axis=1, inplace=True)
-
-    merged_data = merged_data[["Download_Date", "Purchase_Name","Purchase_Date","Description",
-        "Supplier", "Receipt_Number", "Cost", "Message", "Purchaser", "Reimbursed", "Error_Flag"]]
-
-    extracted_text_to_excel(merged_data)
-
-def upload_file_tracking(receipt: Path):
-    try:
-        with open('app_state.json') as f:
-            files_read = json.load(f)['files_read']
-    except FileNotFoundError:
-        files_read = []
-
-    files_read.append(str(receipt))
-
-    with open("app_state.json", 'w') as f:
-        json.dump({'files_read': files_read}, f,indent=2)
+def upload_file_tracking(receipt: Path, store: StateStore, status: str = "done", error: Optional[str] = None):
+    store.mark(receipt, status, error)
 
 # if __name__ == "__main__":
 #     load_dotenv()
@@ -240,43 +210,44 @@ def upload_file_tracking(receipt: Path):
 #     for k, v in results_con_2.items():
 #         print(k, "→", v)
 
-def receipt_ocr_pipline():
+def receipt_ocr_pipline(workers: int = OCR_WORKERS):
     load_dotenv()
     download_dir = Path(os.environ["DOWNLOAD_LOC"])
+    store = StateStore(legacy_json="app_state.json")
 
-    receipts = gather_picture_files(download_dir)
-    results_con_1: dict[str, dict[str, Optional[str]]] = {}
-    results_con_2: dict[str, dict[str, Optional[str]]] = {}
-
-    for receipt in receipts:
-        # add try here to error catch in case of issues
-        rec = process_receipt(receipt, CONFIG1)
-        rec2 = process_receipt(receipt, CONFIG2)
-
-        upload_file_tracking(receipt)
+    receipts = gather_picture_files(download_dir, store)
 
-        results_con_1[receipt.stem] = {
-            "Purchase_Date": rec.purchase_date,
-            "Supplier": rec.supplier,
-            "Cost": rec.cost_text or None,
-        }
+    stats = StrategyStats()
+    stage_time = Counter()
+    decode_stats = DecodeStats()
 
-        results_con_2[receipt.stem] = {
-            "Purchase_Date": rec2.purchase_date,
-            "Supplier": rec2.supplier,
-            "Cost": rec2.cost_text or None,
-        }
+    def record(receipt: Path, payload: dict) -> None:
+        stats.record(**payload["strategy"])
+        stage_time.update(payload.get("timings", {}))
+        decode_stats.record(payload)
 
-    # right now only processes one but will need to look at results and find best one
-    combine_data_sources(results_con_1)
+    # one bad image only drops that receipt, the rest of the batch carries on
+    with telemetry.span("ocr_batch", receipts=len(receipts)), OCRCache() as cache:
+        cache_tag = f"adaptive|{'/'.join(OCR_LADDER)}|{OCR_CONF_THRESHOLD}|{PREPROCESS_VERSION}"
+        results, errors = run_ocr_batch(receipts, process_adaptive, workers, cache=cache,
+                                        cache_tag=cache_tag, on_result=record)
+        log.info("OCR cache", **cache.stats())
 
-    # quick debug print
-    for k, v in results_con_1.items():
-        print(k, "→", v)
-
-    print("\n")
-
-    for k, v in results_con_2.items():
-        print(k, "→", v)
-
-    print('end')
+    for receipt in receipts:
+        if receipt in errors:
+            log.error("OCR failed", receipt=str(receipt), error=str(errors[receipt]))
+            upload_file_tracking(receipt, store, "failed", str(errors[receipt]))
+            continue
+        upload_file_tracking(receipt, store)
+    store.close()
+
+    combine_data_sources(results)
+
+    for k, v in results.items():
+        log.debug("OCR result", receipt=k, **v)
+
+    log.info("OCR strategy", **stats.summary())
+    if stats.receipts:
+        log.info("stage time per receipt (s)", **{k: round(v / stats.receipts, 3) for k, v in stage_time.items()})
+    if decode_stats.times:
+        log.info("decode time per format", **decode_stats.summary())
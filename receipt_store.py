@@ -0,0 +1,132 @@
+import os, time, sqlite3
+from pathlib import Path
+from typing import Optional, Iterable
+import telemetry
+from state_store import connect_read_only
+
+log = telemetry.get_logger("receipt_store")
+
+RECEIPT_DB = os.environ.get("RECEIPT_DB", ".receipts.sqlite")
+
+COLUMNS = ["Download_Date", "Purchase_Name","Purchase_Date","Description", "Supplier", "Cost", "Message", "Purchaser","Receipt_Number", "Reimbursed", "Error_Flag",
+           "Subtotal", "Tax", "Currency"]  # the last three only come from OCR, empty until it finds them
+PLACEHOLDERS = ['REPLACE', 'Bot_Holder']  # cells the bot left for OCR or a person to fill in
+
+class ReceiptStore:
+    """The ledger itself, one row per receipt with the COLUMNS schema and Receipt_Number as key.
+
+    Ingest adds rows, OCR fills in placeholder cells, and nothing here touches XLSX except the
+    one time import of an existing EXCEL_PATH workbook (Sheet1) into an empty store. The
+    formatted workbook is made from this by ledger.export_excel. read_only (dry runs) opens it
+    with nothing written or imported, see state_store.connect_read_only.
+    """
+
+    def __init__(self, path=RECEIPT_DB, legacy_excel: Optional[str] = None, read_only: bool = False):
+        self.path = Path(path)
+
+        self.conn = connect_read_only(self.path, "receipts") if read_only else None
+        if self.conn is not None:
+            return
+        self.conn = sqlite3.connect(":memory:" if read_only else self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        cols = ", ".join(f"{col} {'TEXT PRIMARY KEY' if col == 'Receipt_Number' else ''}" for col in COLUMNS)
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS receipts ({cols}, updated_at REAL NOT NULL)")
+        # stores made before a column was added get it empty, OCR fills it in on the next merge
+        have = {row[1] for row in self.conn.execute("PRAGMA table_info(receipts)")}
+        for col in COLUMNS:
+            if col not in have:
+                self.conn.execute(f"ALTER TABLE receipts ADD COLUMN {col}")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.commit()
+
+        legacy_excel = legacy_excel or os.environ.get("EXCEL_PATH")
+        if legacy_excel and not read_only:
+            self._import_excel(legacy_excel)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _meta(self, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    # Existing ledgers carry on where they were, only ever done once per store
+    def _import_excel(self, excel_path: str) -> None:
+        if self._meta("excel_imported") or not os.path.exists(excel_path):
+            return
+
+        if not self.count():
+            from openpyxl import load_workbook
+            wb = load_workbook(excel_path, read_only=True)
+            try:
+                rows = wb["Sheet1"].iter_rows(values_only=True)
+                header = list(next(rows, []))
+                found = [dict(zip(header, values)) for values in rows if any(v is not None for v in values)]
+            finally:
+                wb.close()
+            self.add_rows([row for row in found if row.get("Receipt_Number")])
+            log.info("imported ledger rows from the workbook", rows=len(found), path=str(excel_path))
+
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('excel_imported', ?)", (excel_path,))
+        self.conn.commit()
+
+    # New receipts, a Receipt_Number that is already in the ledger keeps its row
+    def add_rows(self, rows: Iterable[dict]) -> int:
+        now = time.time()
+        cur = self.conn.executemany(
+            f"INSERT OR IGNORE INTO receipts ({', '.join(COLUMNS)}, updated_at) VALUES ({', '.join('?' * (len(COLUMNS) + 1))})",
+            ([row.get(col) for col in COLUMNS] + [now] for row in rows))
+        self.conn.commit()
+        return cur.rowcount
+
+    # OCR values go in where the ledger still has a placeholder (or nothing at all), returns the number of cells changed
+    def fill_fields(self, data: dict[str, dict]) -> int:
+        now = time.time()
+        changed = 0
+        marks = ", ".join("?" * len(PLACEHOLDERS))
+        for receipt_num, fields in data.items():
+            for name, value in fields.items():
+                if name not in COLUMNS or name == "Receipt_Number" or value is None or value in PLACEHOLDERS:
+                    continue
+                cur = self.conn.execute(
+                    f"UPDATE receipts SET {name} = ?, updated_at = ? WHERE Receipt_Number = ? AND ({name} IS NULL OR {name} IN ({marks}))",
+                    (value, now, str(receipt_num), *PLACEHOLDERS))
+                changed += cur.rowcount
+        self.conn.commit()
+        return changed
+
+    # Values changed by hand in the exported workbook, these win over what is stored
+    def update_fields(self, data: dict[str, dict]) -> int:
+        now = time.time()
+        changed = 0
+        for receipt_num, fields in data.items():
+            for name, value in fields.items():
+                if name not in COLUMNS or name == "Receipt_Number":
+                    continue
+                cur = self.conn.execute(f"UPDATE receipts SET {name} = ?, updated_at = ? WHERE Receipt_Number = ?",
+                                        (value, now, str(receipt_num)))
+                changed += cur.rowcount
+        self.conn.commit()
+        return changed
+
+    def get(self, receipt_num: str) -> Optional[dict]:
+        row = self.conn.execute(f"SELECT {', '.join(COLUMNS)} FROM receipts WHERE Receipt_Number = ?",
+                                (str(receipt_num),)).fetchone()
+        return dict(zip(COLUMNS, row)) if row else None
+
+    # Every row in the order they were added
+    def rows(self) -> list[dict]:
+        cur = self.conn.execute(f"SELECT {', '.join(COLUMNS)} FROM receipts ORDER BY rowid")
+        return [dict(zip(COLUMNS, values)) for values in cur]
+
+    def count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM receipts").fetchone()[0]
+
+    def close(self) -> None:
+        self.conn.commit()
+        self.conn.close()
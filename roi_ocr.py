@@ -0,0 +1,100 @@
+import os, time
+import cv2
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Optional
+from dataclasses import dataclass, field
+from field_extractor import DATE_RE, KEYWORD_RE
+from receipt_ocr import ReceiptOCR, image_to_words
+
+ROI_VERSION = "1"  # bump when the passes below change what they read
+ROI_FAST_SCALE = float(os.environ.get("ROI_FAST_SCALE", 0.5))  # first pass runs on the image shrunk by this
+ROI_FAST_CONFIG = os.environ.get("ROI_FAST_CONFIG", r"--oem 3 --psm 6")
+ROI_LINE_CONFIG = os.environ.get("ROI_LINE_CONFIG", r"--oem 1 --psm 7")  # one text line per crop
+ROI_PAD = 0.6  # crop padding, as a fraction of the line height
+
+# One row per text line: the words joined, mean confidence and the box around them
+def line_boxes(data: pd.DataFrame) -> pd.DataFrame:
+    words = data[(data["conf"] >= 0) & (data["text"].str.strip() != "")].copy()
+    words["right"] = words["left"] + words["width"]
+    words["bottom"] = words["top"] + words["height"]
+    return (words.groupby(["block_num", "par_num", "line_num"], sort=True)
+            .agg(text=("text", " ".join), conf=("conf", "mean"), left=("left", "min"),
+                 top=("top", "min"), right=("right", "max"), bottom=("bottom", "max"))
+            .reset_index(drop=True))
+
+# The lines worth a second look: the header (supplier), the first date, and the total
+def pick_regions(lines: pd.DataFrame) -> dict[str, int]:
+    regions = {}
+    for i, text in enumerate(lines["text"]):
+        if not regions and text.strip():
+            regions["header"] = i
+        if "date" not in regions and DATE_RE.search(text):
+            regions["date"] = i
+        kinds = {m.lastgroup for m in KEYWORD_RE.finditer(text)}
+        # the last plain total wins, "TOTAL" comes after "SUBTOTAL" and any "total savings" lines above
+        if kinds == {"total"}:
+            regions["total"] = i
+    return regions
+
+@dataclass(slots=False)
+class TwoPassReceiptOCR(ReceiptOCR):
+    """ReceiptOCR that reads the whole page once at low resolution, only to find where the header,
+    date and total lines are, then OCRs just those lines at full resolution. Receipts where the
+    quick pass can't find a date or a total get the normal full page pass instead."""
+
+    regions: dict = field(init=False, repr=False, default_factory=dict)  # region -> line index in the quick pass
+    fallback: bool = field(init=False, default=False)
+
+    reduced_decode = False  # the line crops are meant to be full resolution, the quick pass does its own shrinking
+
+    def _ocr(self, image: np.ndarray) -> list[float]:
+        start = time.perf_counter()
+        small = cv2.resize(image, None, fx=ROI_FAST_SCALE, fy=ROI_FAST_SCALE, interpolation=cv2.INTER_AREA)
+        data = image_to_words(small, ROI_FAST_CONFIG)
+        fast = time.perf_counter() - start
+        self._add_time("roi_fast", fast)
+
+        lines = line_boxes(data)
+        self.regions = pick_regions(lines)
+        if "date" not in self.regions or "total" not in self.regions:
+            self.fallback = True
+            confs = super()._ocr(image)
+            self._add_time("tesseract", fast)
+            return confs
+
+        start = time.perf_counter()
+        texts, confs = list(lines["text"]), list(lines["conf"])
+        for i in set(self.regions.values()):
+            found = self._read_line(image, lines.iloc[i])
+            if found is not None:
+                texts[i], confs[i] = found
+        focus = time.perf_counter() - start
+        self._add_time("roi_focus", focus)
+        self._add_time("tesseract", fast + focus)
+
+        self.data = data
+        self.text = "\n".join(texts)
+        return confs
+
+    # Full resolution OCR of one line from the quick pass, None when it reads nothing
+    def _read_line(self, image: np.ndarray, line: pd.Series) -> Optional[tuple[str, float]]:
+        scale = 1 / ROI_FAST_SCALE
+        pad = (line["bottom"] - line["top"]) * ROI_PAD
+        top = max(int((line["top"] - pad) * scale), 0)
+        bottom = min(int((line["bottom"] + pad) * scale), image.shape[0])
+        left = max(int((line["left"] - pad) * scale), 0)
+        right = min(int((line["right"] + pad) * scale), image.shape[1])
+        if bottom <= top or right <= left:
+            return None
+
+        words = image_to_words(image[top:bottom, left:right], ROI_LINE_CONFIG)
+        words = words[(words["conf"] >= 0) & (words["text"].str.strip() != "")]
+        if words.empty:
+            return None
+        return " ".join(words["text"]), float(words["conf"].mean())
+
+# module level so the OCR workers can pickle it
+def process_two_pass(receipt: Path, buffer: Optional[bytes] = None) -> TwoPassReceiptOCR:
+    return TwoPassReceiptOCR(receipt_path=receipt, buffer=buffer)
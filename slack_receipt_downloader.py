@@ -1,82 +1,213 @@
-import os, pathlib, requests, json
-import pandas as pd 
+import os, pathlib, requests, tempfile, threading
 from datetime import datetime
-from dotenv import load_dotenv
+from typing import Callable, Iterable, Optional
+from itertools import islice
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
-import openpyxl
-import pandas
-
-load_dotenv()   # This loads the env variables 
-BOT_TOKEN = os.environ["SLACK_BOT_TOKEN"]   # API key for bot
-CHANNEL_ID = os.environ["CHANNEL_ID"] # Channel ID 
-download_loc = os.environ["DOWNLOAD_LOC"]
-TS_JSON = os.environ["TS_JSON"]
-client = WebClient(token=BOT_TOKEN)
-DOWNLOAD_DIR = pathlib.Path(download_loc)
-DOWNLOAD_DIR.mkdir(exist_ok=True)
-COLUMNS = ["Download_Date", "Purchase_Name","Purchase_Date","Description", "Supplier", "Cost", "Message", "Purchaser","Receipt_Number", "Reimbursed", "Error_Flag"]
-    
-# Call function to map users ID to name 
-def create_user_map() -> dict[str, str]: 
-    cursor = None
-    user_map = {}
-    while True: 
-        try:
-            response = client.users_list(limit=200, cursor=cursor)
-            members = response.get("members",[])
-            for m in members:
-                user_id = m.get("id")
-                profile = m.get("profile",{}) or {}
-                name  = profile.get("real_name") or profile.get("display_name")
-                user_map[user_id] = name
-
-                
-        except SlackApiError as e:
-            print("users.list error:", e.response.get("error"))
-            break
-
-        cursor = response.get("response_metadata", {}).get("next_cursor")
-
-        if not cursor:
-            break
-
-    return user_map
-
-def tracking_generator(prefix="R"):
-    counter = 0
-    def tracking_number():
-        nonlocal counter
-        counter += 1 
-        return f"{prefix}{counter:03d}"
-    return tracking_number
-
-# Need to rename the file
-def change_file_name(file_path: pathlib.Path, directory: pathlib.Path, make_invoice): 
+from ledger import COLUMNS, LEDGER_FLUSH_SIZE, LedgerWriter, install_highlights, sheet_values
+from user_cache import UserDirectory, fetch_user_map
+from ingest_checkpoint import IngestCheckpoint, journal_key
+from receipt_ids import ReceiptIds
+from dedup import DedupIndex, FileCheck, allocation_key, duplicate_row, page_reposts
+import telemetry
+
+log = telemetry.get_logger("downloader")
+
+SLACK_API_URL = os.environ.get("SLACK_API_URL", WebClient.BASE_URL)  # point at a local stub for benchmarks
+DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", 4))  # parallel downloads
+CHUNK_SIZE = 64 * 1024  # bytes written per chunk when streaming a download
+
+_client: Optional[WebClient] = None
+
+# The settings the bot can't run without are read when first needed, not on import, so importing
+# this file needs no .env (cli.py loads it before anything is imported)
+def bot_token() -> str:
+    return os.environ["SLACK_BOT_TOKEN"]   # API key for bot
+
+def channel_id() -> str:
+    return os.environ["CHANNEL_ID"]
+
+def ts_json() -> str:
+    return os.environ["TS_JSON"]
+
+def download_dir() -> pathlib.Path:
+    path = pathlib.Path(os.environ["DOWNLOAD_LOC"])
+    path.mkdir(exist_ok=True)
+    return path
+
+def slack_client() -> WebClient:
+    global _client
+    if _client is None:
+        _client = WebClient(token=bot_token(), base_url=SLACK_API_URL)
+    return _client
+
+# BOT_TOKEN, CHANNEL_ID, TS_JSON, DOWNLOAD_DIR and client used to be set on import, they still work as attributes
+_LAZY = {"BOT_TOKEN": bot_token, "CHANNEL_ID": channel_id, "TS_JSON": ts_json, "DOWNLOAD_DIR": download_dir, "client": slack_client}
+
+def __getattr__(name):
+    if name in _LAZY:
+        return _LAZY[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Call function to map users ID to name (full users.list page through, see UserDirectory for the cached lookup)
+@telemetry.traced("create_user_map")
+def create_user_map() -> Optional[dict[str, str]]: 
+    return fetch_user_map(slack_client())
+
+# Receipt numbers carry on from the last run, see ReceiptIds
+def tracking_generator(prefix="R", seed_dir: Optional[pathlib.Path] = None) -> ReceiptIds:
+    return ReceiptIds(prefix=prefix, seed_dir=seed_dir or download_dir())
+
+# Need to rename the file. make_invoice(file_id) hands out the number, the same file always gets the same one
+def change_file_name(file_path: pathlib.Path, directory: pathlib.Path, make_invoice, file_id: Optional[str] = None): 
     directory.mkdir(parents=True, exist_ok=True)
-    while True: 
-        receipt_number = make_invoice()
-        file = directory/f"{receipt_number}{file_path.suffix}"
-
-        if not file.exists():
-            break
+    receipt_number = make_invoice(file_id)
+    file = directory/f"{receipt_number}{file_path.suffix}"
 
-    file_path.rename(file)
+    os.replace(file_path, file)
     return receipt_number, file
 
-# Create funcition to download files 
-def download_files(file_url : str, save_path : str):  # url_private_download from slack files json, and path to be saved
-    req = requests.get(
-        file_url,
-        headers={"Authorization": f"Bearer {BOT_TOKEN}"},
-        timeout= 30)
-    
-    req.raise_for_status()
-    with open(save_path, "wb") as f:
-        f.write(req.content)
+# A file a crashed run already renamed to its receipt number, before its ledger row (and so its
+# journal entry) was written. The number is still in ReceiptIds and the file in the folder, so a
+# resume uses it instead of downloading it again. Only asked for files that aren't reposts
+def renamed_file(make_invoice: ReceiptIds, store, f: dict, directory: pathlib.Path) -> Optional[pathlib.Path]:
+    receipt_number = make_invoice.lookup(f.get("id"))
+    if receipt_number is None or store.get(receipt_number) is not None:
+        return None
+    path = directory / f"{receipt_number}{pathlib.Path(f['name']).suffix}"
+    return path if path.exists() else None
+
+# One keep-alive session shared by all download workers, pool sized to match
+def make_session(pool_size: int = DOWNLOAD_WORKERS) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Authorization": f"Bearer {bot_token()}"})
+    return session
 
+# Create funcition to download files 
+@telemetry.traced("download_file")
+def download_files(file_url : str, save_path : str, session: requests.Session = None):  # url_private_download from slack files json, and path to be saved
+    save_path = pathlib.Path(save_path)
+    http = session or requests
+
+    # Stream into a temp file next to the target and only rename once it is complete,
+    # so a half written receipt never shows up in the download folder
+    fd, tmp_path = tempfile.mkstemp(dir=save_path.parent, prefix=".", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f, http.get(
+            file_url,
+            headers={"Authorization": f"Bearer {bot_token()}"},
+            timeout= 30,
+            stream=True) as req:
+
+            req.raise_for_status()
+            size = 0
+            for chunk in req.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(tmp_path, save_path)
+        telemetry.downloaded(size)
+    except BaseException as e:
+        pathlib.Path(tmp_path).unlink(missing_ok=True)
+        if isinstance(e, Exception):
+            telemetry.download_failed(e)
+        raise
+
+# Streams one file into memory instead of the download folder, for handing straight to OCR
+@telemetry.traced("download_file")
+def download_buffer(file_url: str, session: requests.Session = None) -> bytearray:
+    http = session or requests
+    buffer = bytearray()
+    try:
+        with http.get(file_url, headers={"Authorization": f"Bearer {bot_token()}"}, timeout=30, stream=True) as req:
+            req.raise_for_status()
+            for chunk in req.iter_content(chunk_size=CHUNK_SIZE):
+                buffer += chunk
+    except Exception as e:
+        telemetry.download_failed(e)
+        raise
+    telemetry.downloaded(len(buffer))
+    return buffer
+
+# Same temp file + rename as download_files, for bytes that are already in memory
+def write_file(save_path: pathlib.Path, data: bytes) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=save_path.parent, prefix=".", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, save_path)
+    except BaseException:
+        pathlib.Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+class ArchiveWriter:
+    """Writes receipts that OCR already has in memory to the download folder, on a background thread.
+    wait() blocks until everything handed over so far is on disk and raises the first write error.
+    At most max_pending buffers wait for the disk, write() blocks past that so a slow disk can't
+    pile up receipts in memory."""
+
+    def __init__(self, max_pending: int = 2 * DOWNLOAD_WORKERS):
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="archive")
+        self.slots = threading.Semaphore(max_pending)
+        self.pending = []
+
+    def write(self, save_path: pathlib.Path, data: bytes) -> None:
+        self.slots.acquire()
+        fut = self.pool.submit(telemetry.with_context(write_file), save_path, data)
+        fut.add_done_callback(lambda _: self.slots.release())
+        # finished writes are dropped here, wait() only needs the ones still running (and errors)
+        self.pending = [f for f in self.pending if not f.done() or f.exception() is not None]
+        self.pending.append(fut)
+
+    def wait(self) -> None:
+        pending, self.pending = self.pending, []
+        for fut in pending:
+            fut.result()
+
+    def close(self) -> None:
+        try:
+            self.wait()
+        finally:
+            self.pool.shutdown()
+
+# Runs fetch(*job, session) on a thread pool and yields (job, result, None or the exception) in the same order as jobs.
+# Only a window of 2 x workers downloads is queued ahead of the caller, so a slow consumer slows the downloads too
+def iter_fetch(fetch: Callable, jobs: Iterable[tuple], workers: int = DOWNLOAD_WORKERS):
+    jobs = iter(jobs)
+    with make_session(workers) as session, ThreadPoolExecutor(max_workers=workers) as pool:
+        # the downloads' spans nest under the caller's
+        pending = deque((job, pool.submit(telemetry.with_context(fetch), *job, session)) for job in islice(jobs, 2 * workers))
+        while pending:
+            job, fut = pending.popleft()
+            try:
+                result, error = fut.result(), None
+            except Exception as e:
+                result, error = None, e
+
+            nxt = next(jobs, None)
+            if nxt is not None:
+                pending.append((nxt, pool.submit(telemetry.with_context(fetch), *nxt, session)))
+
+            yield job, result, error
+
+# download_files for every (url, path) job, yields (job, None or the exception) in job order
+def iter_download_batch(jobs: Iterable[tuple[str, pathlib.Path]], workers: int = DOWNLOAD_WORKERS):
+    for job, _, error in iter_fetch(download_files, jobs, workers):
+        yield job, error
+
+# Same as iter_download_batch but waits for all of them, returns None or the exception for each job
+def download_batch(jobs: list[tuple[str, pathlib.Path]], workers: int = DOWNLOAD_WORKERS) -> list:
+    return [error for _, error in iter_download_batch(jobs, workers)]
+
+@telemetry.traced("excel_append_row")
 def upload_collection_excel_local (info: dict):
-    df = pd.DataFrame(data=info, index=[0])
+    import pandas as pd
+    df = pd.DataFrame([sheet_values(info)], columns=COLUMNS)
 
     excel_path = os.environ["EXCEL_PATH"]
 
@@ -87,117 +218,234 @@ def upload_collection_excel_local (info: dict):
     with pd.ExcelWriter(excel_path, mode='a', engine='openpyxl', if_sheet_exists='overlay') as writer:
         df.to_excel(writer, sheet_name='Sheet1', startrow=writer.sheets['Sheet1'].max_row, index=False, header=False)
 
-# This can also be put in the main file as it can be reused
+# Rows are written already normalised, this only has to make sure the highlight rules are there
 def format_excel_output(): 
+    import openpyxl
     excel_path = os.environ["EXCEL_PATH"]
 
     wb = openpyxl.load_workbook(excel_path)
-    ws = wb["Sheet1"]
-
-    red_fill = openpyxl.styles.PatternFill(start_color='FFC7CE', end_color='FFC7CE', fill_type='solid') 
-    red_font = openpyxl.styles.Font(color='9C0006') 
-
-    for row in ws.iter_rows(min_row=2):
-        for cell in row:
-            if cell.value == "Bot_Holder" :
-                cell.fill = red_fill
-
-            elif cell.value == "Null": 
-                cell.value =" "
-
-            if cell.value == "REPLACE":
-                cell.font = red_font
-    wb.save(excel_path)
-
-# Pipeline to sharepoint???
-
-def channel_history(chan_id : str):
-    try: 
-        with open(TS_JSON) as f :
-            last_ts  = json.load(f)["last_ts"]
-    except FileNotFoundError:
-        last_ts = 0
-
-    user_map = create_user_map()
-    cursor = None 
+    if install_highlights(wb["Sheet1"]):
+        wb.save(excel_path)
+
+# One conversations.history call, returns the messages and the cursor for the next (older) page
+@telemetry.traced("fetch_page")
+def fetch_page(chan_id: str, oldest, cursor=None, limit: int = 200) -> tuple[list[dict], Optional[str]]:
+    try:
+        response = slack_client().conversations_history(
+            channel=chan_id,
+            oldest= oldest,
+            cursor = cursor, 
+            limit=limit,
+        )
+    except SlackApiError as e:
+        telemetry.slack_call("conversations.history", e)
+        raise
+    telemetry.slack_call("conversations.history")
+    messages = response.get('messages',[])
+    next_cursor = response.get("response_metadata", {}).get("next_cursor")
+    return messages, next_cursor or None
+
+# Breaks a page down into (message, file) pairs, oldest message first
+def page_files(messages: list[dict]) -> list[tuple[dict, dict]]:
+    return [(m, f) for m in reversed(messages) for f in (m.get("files") or [])]
+
+# Pages through conversations.history and returns every (message, file) pair since oldest
+def fetch_history(chan_id: str, oldest) -> list[tuple[dict, dict]]:
+    cursor = None
     all_files = []
-    rows = []
-
-    column  =  ["Download_Date", "Purchase_Name","Purchase_Date","Description", "Supplier", "Cost", "Message", "Purchaser","Receipt_Number", "Reimbursed", "Error_Flag"]
-    receipt_info = pd.DataFrame(columns=column)
-    # receipt_info["Reimbursed"] = receipt_info["Reimbursed"].fillna("No")
-
-    make_invoice = tracking_generator("R")
-
-    defaults = {
-        "Download_Date" : "Bot_Holder",  # for personal use
-        "Purchase_Name": "REPLACE",  # For internal and UOSU 
-        "Purchase_Date": "Bot_Holder",  # For internal and UOSU 
-        "Description": "REPLACE",  # UOSU 
-        "Supplier": "Bot_Holder", # UOSU
-        "Cost": "Bot_Holder",   # For internal and UOSU 
-        "Message": "Bot_Holder",  # For internal 
-        "Purchaser": "Bot_Holder", # For internal
-        "Receipt_Number": "Bot_Holder",  # For internal and UOSU 
-        "Reimbursed": 'No',  # For internal
-        "Error_Flag": 'Null' # For internal
-    }
-
 
     while True: 
         try: 
-            response = client.conversations_history(
-                channel=chan_id,
-                oldest= last_ts,
-                cursor = cursor, 
-                limit=200,
-            )
-
-            messages = response.get('messages',[])
-            # Breaks down into individual messages 
-            for m in reversed(messages): 
-                for f in (m.get("files") or []):
-                    all_files.append((m, f))
-               
+            messages, cursor = fetch_page(chan_id, oldest, cursor)
+            all_files.extend(page_files(messages))
                     
         except SlackApiError as e:
-            print("API error:", e.response.get("error"))
+            log.error("conversations.history failed", error=e.response.get("error"))
             break 
 
-        cursor = response.get("response_metadata", {}).get("next_cursor")
         if not cursor:
             break
-    
-    for m,f in all_files: 
-        # ["Download_Date", "Purchase_Name", "Description", "Supplier", "Cost", "Message", "Purchaser","Receipt_Number", "Reimbursed"]
-        user_name = user_map.get(f["user"])
-        file_name = f["name"]
-        newest_ts = m.get("ts")
-        
-        url = f.get("url_private_download")       
-        downloaded_path = DOWNLOAD_DIR / file_name
-        download_files(url, downloaded_path)
-
-        invoice_num, new_path = change_file_name(downloaded_path, DOWNLOAD_DIR, make_invoice)
-
-        info = {
-            "Download_Date": datetime.fromtimestamp(float(m.get("ts"))).strftime("%Y-%m-%d"),
-            "Message": m.get("text"),
-            "Purchaser": user_name ,
-            "Receipt_Number": invoice_num,
-            "Reimbursed": "False"
-        }
-
-        row = {**defaults, **info}
 
-        rows.append(row)
-
-        with open(TS_JSON, "w") as f:
-            json.dump({"last_ts": newest_ts},f)
+    return all_files
+
+# What the next channel_history run would pick up (--dry-run): pages through from the checkpoint
+# without downloading or saving anything (the dedup index is opened read only), files already
+# done or reposted are left out
+def pending_files(chan_id: str) -> list[tuple[dict, dict]]:
+    ckpt = IngestCheckpoint(ts_json())
+    oldest = ckpt.run["oldest"] if ckpt.run is not None else ckpt.last_ts
+    todo = [(m, f) for m, f in fetch_history(chan_id, oldest) if not ckpt.is_done(journal_key(f, m.get("ts")))]
+    with DedupIndex(read_only=True) as dedup:
+        return [(m, f) for m, f in todo
+                if not dedup.ingested(f, m.get("ts")) and not dedup.before_download(f, m.get("ts")).duplicate_of]
+
+ROW_DEFAULTS = {
+    "Download_Date" : "Bot_Holder",  # for personal use
+    "Purchase_Name": "REPLACE",  # For internal and UOSU 
+    "Purchase_Date": "Bot_Holder",  # For internal and UOSU 
+    "Description": "REPLACE",  # UOSU 
+    "Supplier": "Bot_Holder", # UOSU
+    "Cost": "Bot_Holder",   # For internal and UOSU 
+    "Message": "Bot_Holder",  # For internal 
+    "Purchaser": "Bot_Holder", # For internal
+    "Receipt_Number": "Bot_Holder",  # For internal and UOSU 
+    "Reimbursed": 'No',  # For internal
+    "Error_Flag": 'Null' # For internal
+}
+
+# Ledger row for one downloaded file
+def make_row(m: dict, user_name: Optional[str], invoice_num: str) -> dict:
+    info = {
+        "Download_Date": datetime.fromtimestamp(float(m.get("ts"))).strftime("%Y-%m-%d"),
+        "Message": m.get("text"),
+        "Purchaser": user_name ,
+        "Receipt_Number": invoice_num,
+        "Reimbursed": "False"
+    }
+    return {**ROW_DEFAULTS, **info}
 
-        upload_collection_excel_local(row)
-        format_excel_output()
+# Pipeline to sharepoint???
 
+@telemetry.traced("channel_history")
+def channel_history(chan_id : str, workers: int = DOWNLOAD_WORKERS, flush_size: int = LEDGER_FLUSH_SIZE,
+                    on_file: Optional[Callable[[pathlib.Path], None]] = None,
+                    on_buffer: Optional[Callable[[pathlib.Path, bytes], None]] = None):
+    # With on_buffer the files are downloaded into memory and handed over as (final path, bytes)
+    # straight away, the copy in the download folder is written in the background
+    # last_ts plus, for an interrupted run, the cursor / current page / journal of finished files
+    ckpt = IngestCheckpoint(ts_json())
+    ckpt.start_run()
+
+    user_dir = UserDirectory(slack_client())
+    rows = []
+    save_dir = download_dir()
+
+    make_invoice = tracking_generator("R", save_dir)
+    dedup = DedupIndex()
+
+    ledger = LedgerWriter(flush_size=flush_size)
+    archive = ArchiveWriter(2 * workers) if on_buffer is not None else None
+    pending_ids = []
+
+    # a file only counts as done once its row is in the receipt store (and the file is on disk)
+    def rows_written():
+        if archive is not None:
+            archive.wait()
+        ckpt.mark_files(pending_ids)
+        pending_ids.clear()
+
+    try:
+        while True:
+            if ckpt.page is None:
+                try:
+                    messages, next_cursor = fetch_page(chan_id, ckpt.oldest, ckpt.cursor)
+                except SlackApiError as e:
+                    # run stays open, the next start resumes from this cursor
+                    log.error("conversations.history failed, the next run resumes here", error=e.response.get("error"))
+                    return
+                ckpt.save_page(messages, next_cursor)
+
+            todo = [(m, f) for m, f in page_files(ckpt.page)
+                    if not ckpt.is_done(journal_key(f, m.get("ts"))) and not dedup.ingested(f, m.get("ts"))]
+            # reposts of a file we already have are never downloaded, nor a second copy on this page
+            reposts = {i: dedup.before_download(f, m.get("ts")) for i, (m, f) in enumerate(todo)}
+            reposts = {i: check for i, check in reposts.items() if check.duplicate_of}
+            on_page = page_reposts(todo)
+            originals = {}  # index in todo -> receipt number a later copy on the page points at
+            resumed = {i: path for i, (m, f) in enumerate(todo)
+                       if i not in reposts and i not in on_page and (path := renamed_file(make_invoice, ledger.store, f, save_dir))}
+
+            # Download the page in parallel, each file gets its own staging name (slack file id)
+            # so two uploads called image.png can't overwrite each other. A staged file only exists
+            # once it is complete, so one left by a crashed run doesn't need downloading again
+            jobs = [(f.get("url_private_download"), save_dir / f"{f.get('id')}_{f['name']}") for m, f in todo]
+            staged = {path for _, path in jobs if path.exists()}
+            wanted = (job for i, job in enumerate(jobs)
+                      if job[1] not in staged and i not in reposts and i not in on_page and i not in resumed)
+            if archive is None:
+                downloads = iter_fetch(download_files, wanted, workers)
+            else:
+                downloads = iter_fetch(download_buffer, ((url,) for url, _ in wanted), workers)
+
+            try:
+                # Receipt numbers and ledger rows are still handed out in message order,
+                # each file is handled as soon as it (and the ones before it) are down
+                for i, ((m,f), (url, downloaded_path)) in enumerate(zip(todo, jobs)): 
+                    # ["Download_Date", "Purchase_Name", "Description", "Supplier", "Cost", "Message", "Purchaser","Receipt_Number", "Reimbursed"]
+                    check = reposts.get(i)
+                    if check is None and i in on_page:
+                        check = FileCheck(originals[on_page[i]], exact=True, by_file_id=True)
+                    buffer = None
+                    if check is None and i in resumed:
+                        check = dedup.after_download(resumed[i], f, m.get("ts"))
+                    elif check is None:
+                        if downloaded_path not in staged:
+                            _, buffer, error = next(downloads)
+                            if error is not None:
+                                log.error("download failed", file=f['name'], error=str(error))
+                                ledger.flush()
+                                rows_written()
+                                raise error
+                        check = dedup.after_download(downloaded_path, f, m.get("ts"), buffer)
+
+                    user_name = user_dir.get(f["user"])
+
+                    # exact copies get a ledger row pointing at the first one, but no file and no OCR
+                    if i in resumed:
+                        invoice_num, new_path = make_invoice(f.get("id")), resumed[i]
+                    elif check.duplicate_of and check.exact:
+                        invoice_num, new_path = make_invoice(allocation_key(f, m.get("ts"), check)), None
+                        downloaded_path.unlink(missing_ok=True)
+                        log.info("duplicate receipt", file=f['name'], duplicate_of=check.duplicate_of)
+                    elif buffer is not None:
+                        invoice_num = make_invoice(f.get("id"))
+                        new_path = save_dir / f"{invoice_num}{downloaded_path.suffix}"
+                        archive.write(new_path, buffer)
+                    else:
+                        invoice_num, new_path = change_file_name(downloaded_path, save_dir, make_invoice, f.get("id"))
+                    dedup.record(invoice_num, f, m.get("ts"), check)
+                    originals[i] = check.duplicate_of if check.duplicate_of and check.exact else invoice_num
+
+                    row = duplicate_row(make_row(m, user_name, invoice_num), check)
+
+                    rows.append(row)
+                    pending_ids.append(journal_key(f, m.get("ts")))
+
+                    if ledger.add(row):
+                        rows_written()
+
+                    # streaming mode hands the file straight to OCR, this blocks while OCR is behind
+                    if new_path is None:
+                        continue
+                    if on_buffer is not None:
+                        # a file staged on disk by an earlier run is read back once
+                        on_buffer(new_path, buffer if buffer is not None else new_path.read_bytes())
+                    elif on_file is not None:
+                        on_file(new_path)
+            finally:
+                downloads.close()
+
+            ledger.flush()
+            rows_written()
+            next_cursor = ckpt.next_cursor
+            ckpt.page_done()
+
+            if not next_cursor:
+                break
+
+        ckpt.finish()
+
+    finally:
+        ledger.close()
+        if archive is not None:
+            archive.close()
+        make_invoice.close()
+        dedup.close()
+        user_dir.save()
+        log.info("user cache", **user_dir.stats())
+
+# python slack_receipt_downloader.py is `python cli.py ingest export`
 if __name__ == "__main__":
-    channel_history(CHANNEL_ID)
-    format_excel_output()
+    import cli
+    cli.main(["ingest"])
+    cli.main(["export"])
@@ -0,0 +1,145 @@
+import os, json, time, sqlite3, hashlib
+from pathlib import Path
+from typing import Optional
+import telemetry
+
+log = telemetry.get_logger("state_store")
+
+STATE_DB = os.environ.get("STATE_DB", ".app_state.sqlite")
+STATE_COMMIT_EVERY = int(os.environ.get("STATE_COMMIT_EVERY", 25))  # marks per transaction
+
+# For dry runs: the db opened read only, None when it or its table isn't there yet. Callers then
+# use an empty in-memory db instead, so looking never creates a file, a table or a WAL
+def connect_read_only(path, table: str) -> Optional[sqlite3.Connection]:
+    path = Path(path)
+    if not path.exists():
+        return None
+    conn = sqlite3.connect(f"{path.resolve().as_uri()}?mode=ro", uri=True)
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone():
+        return conn
+    conn.close()
+    return None
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+class StateStore:
+    """Which receipts have been through OCR, indexed by path and content hash.
+
+    Replaces the files_read list in STATE_JSON. Writes are batched into transactions of
+    commit_every marks, WAL journaling means a crash loses at most the open batch.
+    read_only (dry runs) opens it with nothing written, see connect_read_only.
+    """
+
+    def __init__(self, path=STATE_DB, legacy_json: Optional[str] = None, commit_every: int = STATE_COMMIT_EVERY,
+                 read_only: bool = False):
+        self.path = Path(path)
+        self.commit_every = commit_every
+        self._pending = 0
+
+        self.conn = connect_read_only(self.path, "processed_files") if read_only else None
+        if self.conn is not None:
+            return
+        self.conn = sqlite3.connect(":memory:" if read_only else self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS processed_files (
+                path TEXT PRIMARY KEY,
+                sha256 TEXT,
+                mtime REAL,
+                size INTEGER,
+                status TEXT NOT NULL,
+                error TEXT,
+                updated_at REAL NOT NULL
+            )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS processed_files_sha256 ON processed_files (sha256)")
+        self.conn.commit()
+
+        if legacy_json and not read_only:
+            self._import_json(legacy_json)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # One time move of the old files_read list, those files count as done
+    def _import_json(self, legacy_json: str) -> None:
+        try:
+            with open(legacy_json) as f:
+                files_read = json.load(f)["files_read"]
+        except (FileNotFoundError, KeyError, ValueError):
+            return
+
+        now = time.time()
+        rows = []
+        for name in files_read:
+            try:
+                st = os.stat(name)
+                rows.append((name, None, st.st_mtime, st.st_size, "done", None, now))
+            except OSError:
+                rows.append((name, None, None, None, "done", None, now))
+
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO processed_files (path, sha256, mtime, size, status, error, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows)
+        self.conn.commit()
+        os.replace(legacy_json, legacy_json + ".migrated")
+        log.info("imported processed files from the old state file", entries=len(rows), path=legacy_json)
+
+    def new_files(self, dir_path: Path) -> list[Path]:
+        """Files in dir_path that haven't been processed, or that changed since they were."""
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS scan (path TEXT PRIMARY KEY, mtime REAL)")
+        self.conn.execute("DELETE FROM scan")
+
+        # dot files are in-flight downloads (.part) or OS clutter
+        with os.scandir(dir_path) as entries:
+            self.conn.executemany(
+                "INSERT INTO scan (path, mtime) VALUES (?, ?)",
+                ((str(Path(dir_path) / e.name), e.stat().st_mtime) for e in entries
+                 if e.is_file() and not e.name.startswith(".")))
+
+        rows = self.conn.execute("""
+            SELECT s.path FROM scan s
+            LEFT JOIN processed_files p ON p.path = s.path
+            WHERE p.path IS NULL OR p.status != 'done' OR (p.mtime IS NOT NULL AND p.mtime != s.mtime)
+            ORDER BY s.path""").fetchall()
+        return [Path(path) for (path,) in rows]
+
+    def mark(self, receipt: Path, status: str = "done", error: Optional[str] = None) -> None:
+        try:
+            st = receipt.stat()
+            sha, mtime, size = file_sha256(receipt), st.st_mtime, st.st_size
+        except OSError:
+            sha, mtime, size = None, None, None
+
+        self.conn.execute(
+            "INSERT OR REPLACE INTO processed_files (path, sha256, mtime, size, status, error, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (str(receipt), sha, mtime, size, status, error, time.time()))
+
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.commit()
+
+    def seen_hash(self, sha256: str) -> Optional[str]:
+        row = self.conn.execute(
+            "SELECT path FROM processed_files WHERE sha256 = ? AND status = 'done' LIMIT 1", (sha256,)).fetchone()
+        return row[0] if row else None
+
+    def status(self, receipt: Path) -> Optional[str]:
+        row = self.conn.execute("SELECT status FROM processed_files WHERE path = ?", (str(receipt),)).fetchone()
+        return row[0] if row else None
+
+    def commit(self) -> None:
+        self.conn.commit()
+        self._pending = 0
+
+    def close(self) -> None:
+        self.commit()
+        self.conn.close()
@@ -0,0 +1,299 @@
+import os, sys, json, math, time, uuid, logging, tempfile, threading, contextvars
+from pathlib import Path
+from bisect import bisect_left
+from typing import Optional
+from functools import wraps
+from contextlib import contextmanager
+
+METRICS_PROM = os.environ.get("METRICS_PROM", "receipt_bot.prom")  # Prometheus text format, empty turns it off
+METRICS_JSON = os.environ.get("METRICS_JSON", "run_summary.json")  # run summary, empty turns it off
+METRICS_PREFIX = "receipt_bot_"
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")  # "json" for one JSON object per line
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CONF_BUCKETS = (10, 20, 30, 40, 50, 60, 70, 80, 85, 90, 95, 100)
+SIZE_BUCKETS = (16e3, 64e3, 256e3, 1e6, 4e6, 16e6, 64e6)
+
+# name -> (type, help, buckets), anything not listed is a counter with no help text
+METRICS = {
+    "stage_seconds": ("histogram", "Wall time of a traced stage", LATENCY_BUCKETS),
+    "stage_errors_total": ("counter", "Traced stages that raised", None),
+    "ocr_stage_seconds": ("histogram", "Time per receipt in each OCR stage (decode, preprocessing, tesseract, extract)", LATENCY_BUCKETS),
+    "ocr_field_confidence": ("histogram", "Confidence of each extracted field, 0-100", CONF_BUCKETS),
+    "ocr_word_confidence": ("histogram", "Mean tesseract word confidence per receipt, 0-100", CONF_BUCKETS),
+    "ocr_receipts_total": ("counter", "Receipts through OCR by format and result (ocr, cached, failed)", None),
+    "download_bytes_total": ("counter", "Bytes downloaded from Slack", None),
+    "download_size_bytes": ("histogram", "Size of each downloaded file", SIZE_BUCKETS),
+    "download_errors_total": ("counter", "File downloads that failed, by HTTP status (http_404) or exception", None),
+    "slack_api_calls_total": ("counter", "Slack Web API calls by method", None),
+    "slack_api_errors_total": ("counter", "Slack Web API calls that failed, by method and error", None),
+    "cache_requests_total": ("counter", "Cache lookups by cache (ocr, user) and result (hit, miss)", None),
+    "ledger_rows_total": ("counter", "Ledger rows written to the receipt store", None),
+}
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _label_text(labels: tuple, extra: tuple = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    # Estimated from the buckets, linear inside the bucket the quantile falls in
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return float("nan")
+        rank, seen, lower = q * self.count, 0, 0.0
+        for upper, n in zip(self.buckets, self.counts):
+            if n and seen + n >= rank:
+                return lower + (upper - lower) * (rank - seen) / n
+            seen, lower = seen + n, upper
+        return self.buckets[-1]
+
+class Registry:
+    """Counters and histograms for one run, thread safe. Label values are kept as strings."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: dict[tuple, float] = {}
+        self.histograms: dict[tuple, Histogram] = {}
+        self.run_id = os.environ.get("RUN_ID") or uuid.uuid4().hex[:12]
+        self.started = time.time()
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, _labels(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            return
+        key = (name, _labels(labels))
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram(METRICS.get(name, (None, None, LATENCY_BUCKETS))[2])
+            hist.observe(value)
+
+    def counter(self, name: str, **labels) -> float:
+        with self.lock:
+            if labels:
+                return self.counters.get((name, _labels(labels)), 0)
+            return sum(v for (n, _), v in self.counters.items() if n == name)
+
+    def prometheus(self) -> str:
+        lines, typed = [], set()
+        with self.lock:
+            series = sorted([(n, l, v) for (n, l), v in self.counters.items()] +
+                            [(n, l, h) for (n, l), h in self.histograms.items()], key=lambda s: (s[0], s[1]))
+            for name, labels, value in series:
+                full = METRICS_PREFIX + name
+                if name not in typed:
+                    kind, help_text, _ = METRICS.get(name, ("counter", "", None))
+                    if help_text:
+                        lines.append(f"# HELP {full} {help_text}")
+                    lines.append(f"# TYPE {full} {'histogram' if isinstance(value, Histogram) else 'counter'}")
+                    typed.add(name)
+
+                if not isinstance(value, Histogram):
+                    lines.append(f"{full}{_label_text(labels)} {value:g}")
+                    continue
+                cumulative = 0
+                for upper, n in zip(value.buckets + (float("inf"),), value.counts):
+                    cumulative += n
+                    le = "+Inf" if upper == float("inf") else f"{upper:g}"
+                    lines.append(f"{full}_bucket{_label_text(labels, (('le', le),))} {cumulative}")
+                lines.append(f"{full}_sum{_label_text(labels)} {value.sum:g}")
+                lines.append(f"{full}_count{_label_text(labels)} {value.count}")
+
+        lines.append(f"# TYPE {METRICS_PREFIX}run_start_timestamp_seconds gauge")
+        lines.append(f'{METRICS_PREFIX}run_start_timestamp_seconds{{run_id="{self.run_id}"}} {self.started:.0f}')
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> dict:
+        def key_text(labels: tuple) -> str:
+            return ",".join(f"{k}={v}" for k, v in labels) or "all"
+
+        out = {"run_id": self.run_id, "started_at": self.started, "seconds": round(time.time() - self.started, 3),
+               "counters": {}, "histograms": {}}
+        lookups: dict[str, dict[str, float]] = {}
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                out["counters"].setdefault(name, {})[key_text(labels)] = value
+                if name == "cache_requests_total":
+                    lookups.setdefault(dict(labels).get("cache"), {})[dict(labels).get("result")] = value
+            for (name, labels), hist in sorted(self.histograms.items(), key=lambda kv: kv[0]):
+                out["histograms"].setdefault(name, {})[key_text(labels)] = {
+                    "count": hist.count, "sum": round(hist.sum, 4), "mean": round(hist.sum / hist.count, 4),
+                    "p50": round(hist.quantile(0.5), 4), "p95": round(hist.quantile(0.95), 4)}
+
+        # the numbers people ask for first
+        out["cache_hit_rate"] = {cache: round(r.get("hit", 0) / (r.get("hit", 0) + r.get("miss", 0)), 3)
+                                 for cache, r in lookups.items()}
+        out["slack_api_calls"] = self.counter("slack_api_calls_total")
+        out["download_bytes"] = self.counter("download_bytes_total")
+        out["download_errors"] = self.counter("download_errors_total")
+        return out
+
+REGISTRY = Registry()
+
+inc = REGISTRY.inc
+observe = REGISTRY.observe
+
+_span: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("span", default=None)
+
+@contextmanager
+def span(name: str, **fields):
+    """Times a stage into stage_seconds{stage=name} and logs it at debug level with its parent span."""
+    parent = _span.get()
+    token = _span.set(name)
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        REGISTRY.inc("stage_errors_total", stage=name)
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        _span.reset(token)
+        REGISTRY.observe("stage_seconds", seconds, stage=name)
+        get_logger("trace").debug("span", span=name, parent=parent, seconds=round(seconds, 4), status=status, **fields)
+
+# fn wrapped to run under the current span on another thread (threads start with an empty context,
+# so their spans and log lines would have no parent). One wrap per submit, a context can't be
+# entered by two threads at once
+def with_context(fn):
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.run(fn, *args, **kwargs)
+
+# Decorator version of span, named after the function unless told otherwise
+def traced(name: Optional[str] = None):
+    def wrap(fn):
+        stage = name or fn.__name__
+        @wraps(fn)
+        def inner(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+# Counts one Slack Web API call, and its error code when it raised SlackApiError
+def slack_call(method: str, error=None) -> None:
+    REGISTRY.inc("slack_api_calls_total", method=method)
+    if error is not None:
+        REGISTRY.inc("slack_api_errors_total", method=method, error=getattr(error, "response", {}).get("error", "unknown"))
+
+def cache_lookup(cache: str, hit: bool) -> None:
+    REGISTRY.inc("cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+def downloaded(size: int) -> None:
+    REGISTRY.inc("download_bytes_total", size)
+    REGISTRY.observe("download_size_bytes", size)
+
+# requests raises HTTPError with .response.status_code, aiohttp ClientResponseError with .status
+def download_failed(error: BaseException) -> None:
+    status = getattr(error, "status", None) or getattr(getattr(error, "response", None), "status_code", None)
+    REGISTRY.inc("download_errors_total", error=f"http_{status}" if status else type(error).__name__)
+
+# One OCR payload (see ocr_engine.receipt_result): stage timings and confidences
+def ocr_result(payload: dict) -> None:
+    fmt = payload.get("format") or "unknown"
+    REGISTRY.inc("ocr_receipts_total", format=fmt, result="ocr")
+    for stage, seconds in payload.get("timings", {}).items():
+        REGISTRY.observe("ocr_stage_seconds", seconds, stage=stage)
+    for name, conf in (payload.get("field_conf") or {}).items():
+        REGISTRY.observe("ocr_field_confidence", conf, field=name)
+    REGISTRY.observe("ocr_word_confidence", payload.get("mean_conf"))
+
+# Both report files, written atomically so a scraper never reads half a file
+def write_reports(prom_path: Optional[str] = METRICS_PROM, json_path: Optional[str] = METRICS_JSON) -> None:
+    for path, text in ((prom_path, REGISTRY.prometheus), (json_path, lambda: json.dumps(REGISTRY.summary(), indent=2))):
+        if not path:
+            continue
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".", suffix=path.suffix)
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(text())
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+    get_logger("telemetry").debug("metrics written", prometheus=prom_path or None, summary=json_path or None)
+
+class _Formatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        fields = getattr(record, "fields", {})
+        if LOG_FORMAT == "json":
+            entry = {"ts": round(record.created, 3), "level": record.levelname.lower(), "logger": record.name.removeprefix("receipt_bot."),
+                     "msg": record.getMessage(), "run_id": REGISTRY.run_id, "span": _span.get(), **fields}
+            if record.exc_info:
+                entry["exc"] = self.formatException(record.exc_info)
+            return json.dumps(entry, default=str)
+
+        text = f"{self.formatTime(record, '%H:%M:%S')} {record.levelname:<7} {record.name.removeprefix('receipt_bot.')}: {record.getMessage()}"
+        if fields:
+            text += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        if record.exc_info:
+            text += "\n" + self.formatException(record.exc_info)
+        return text
+
+_configured = False
+
+# Set up on the first log line instead of at import
+def setup_logging(level: str = LOG_LEVEL) -> None:
+    global _configured
+    if _configured:
+        return
+    _configured = True
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(_Formatter())
+    root = logging.getLogger("receipt_bot")
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+    root.propagate = False
+
+class StructLogger:
+    """logging.Logger with key=value fields: log.info("downloaded", file=name, bytes=n)."""
+
+    def __init__(self, name: str):
+        self.logger = logging.getLogger(f"receipt_bot.{name}")
+
+    def log(self, level: int, msg: str, exc_info=None, **fields) -> None:
+        if not _configured:
+            setup_logging()
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, msg, exc_info=exc_info, extra={"fields": fields})
+
+    def debug(self, msg: str, **fields) -> None:
+        self.log(logging.DEBUG, msg, **fields)
+
+    def info(self, msg: str, **fields) -> None:
+        self.log(logging.INFO, msg, **fields)
+
+    def warning(self, msg: str, **fields) -> None:
+        self.log(logging.WARNING, msg, **fields)
+
+    def error(self, msg: str, exc_info=None, **fields) -> None:
+        self.log(logging.ERROR, msg, exc_info=exc_info, **fields)
+
+def get_logger(name: str) -> StructLogger:
+    return StructLogger(name)
@@ -0,0 +1,34 @@
+import random
+import pytest
+
+N_FILES = 3
+
+# benchmarks.fake_slack serving N_FILES small files, one per message, with the downloader pointed at
+# it and every store with a relative default path in tmp_path
+@pytest.fixture
+def slack(tmp_path, monkeypatch):
+    pytest.importorskip("requests")
+    pytest.importorskip("slack_sdk")
+    from benchmarks.fake_slack import FakeSlack
+
+    source = tmp_path / "source"
+    source.mkdir()
+    rng = random.Random(0)
+    names = [f"receipt_{i}.jpg" for i in range(N_FILES)]
+    for name in names:
+        (source / name).write_bytes(rng.randbytes(2000))
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("EXCEL_PATH", raising=False)
+    monkeypatch.setenv("SLACK_BOT_TOKEN", "xoxb-test")
+    monkeypatch.setenv("CHANNEL_ID", "CTEST")
+    monkeypatch.setenv("DOWNLOAD_LOC", str(tmp_path / "downloads"))
+    monkeypatch.setenv("TS_JSON", str(tmp_path / "last_ts.json"))
+
+    with FakeSlack(source, names, n_users=2) as fake:
+        import slack_receipt_downloader as srd
+        import async_ingest
+        monkeypatch.setattr(srd, "SLACK_API_URL", fake.api_url)
+        monkeypatch.setattr(async_ingest, "SLACK_API_URL", fake.api_url)
+        monkeypatch.setattr(srd, "_client", None)
+        yield fake
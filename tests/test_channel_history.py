@@ -0,0 +1,101 @@
+# Ingest against benchmarks.fake_slack: the sync and async channel history, reposts and resumes
+import asyncio, sqlite3
+import pytest
+from conftest import N_FILES
+
+pytest.importorskip("requests")
+pytest.importorskip("slack_sdk")
+
+# The first file posted again in a later message, on the same history page
+def repost_first(slack):
+    first = slack.messages[0]
+    ts = f"{float(slack.messages[-1]['ts']) + 60:.6f}"
+    slack.messages.append({**first, "ts": ts, "text": "same receipt again", "files": [dict(first["files"][0])]})
+    return ts
+
+def ledger(tmp_path):
+    conn = sqlite3.connect(tmp_path / ".receipts.sqlite")
+    try:
+        rows = conn.execute("SELECT Receipt_Number, Message, Error_Flag FROM receipts ORDER BY Receipt_Number").fetchall()
+        files = conn.execute("SELECT receipt_number, file_id, ts, duplicate_of FROM receipt_files ORDER BY receipt_number").fetchall()
+    finally:
+        conn.close()
+    return rows, files
+
+def run_sync(in_memory: bool):
+    import slack_receipt_downloader as srd
+    if in_memory:
+        handed = []
+        srd.channel_history("CTEST", workers=2, on_buffer=lambda path, data: handed.append(path))
+        return handed
+    srd.channel_history("CTEST", workers=2)
+
+def run_async(tmp_path):
+    from async_ingest import channel_history_async
+    asyncio.run(channel_history_async("CTEST", 2, download_dir=tmp_path / "downloads",
+                                      ts_json=tmp_path / "last_ts.json", db_path=tmp_path / ".receipts.sqlite"))
+
+@pytest.mark.parametrize("mode", ["disk", "memory", "async"])
+def test_repost_on_the_same_page(slack, tmp_path, mode):
+    (tmp_path / "downloads").mkdir()
+    repost_ts = repost_first(slack)
+
+    if mode == "async":
+        run_async(tmp_path)
+    else:
+        run_sync(mode == "memory")
+
+    rows, files = ledger(tmp_path)
+    assert [r[0] for r in rows] == ["R001", "R002", "R003", "R004"]
+    assert rows[3] == ("R004", "same receipt again", "Duplicate of R001")
+    assert files[0] == ("R001", "F0000000", slack.messages[0]["ts"], None)
+    assert files[3] == ("R004", "F0000000", repost_ts, "R001")
+    # the repost isn't downloaded or saved again
+    assert slack.calls["files"] == N_FILES
+    assert sorted(p.name for p in (tmp_path / "downloads").iterdir()) == ["R001.jpg", "R002.jpg", "R003.jpg"]
+
+def test_repost_in_a_later_run(slack, tmp_path):
+    run_sync(False)
+    repost_first(slack)
+    run_sync(False)
+
+    rows, files = ledger(tmp_path)
+    assert rows[3][0] == "R004" and rows[3][2] == "Duplicate of R001"
+    assert slack.calls["files"] == N_FILES
+
+class Crash(BaseException):
+    pass
+
+@pytest.mark.parametrize("mode", ["disk", "memory", "async"])
+def test_resume_downloads_nothing_twice(slack, tmp_path, monkeypatch, mode):
+    import slack_receipt_downloader as srd
+    import async_ingest
+    from ledger import LedgerWriter
+    from ingest_checkpoint import IngestCheckpoint
+    (tmp_path / "downloads").mkdir()
+
+    # The process dies on the last file: every file is renamed, but the rows held in memory and
+    # the journal entries that would follow them never make it to disk
+    made, real_make_row = [], srd.make_row
+    def make_row(m, user_name, invoice_num):
+        if len(made) == N_FILES - 1:
+            raise Crash()
+        made.append(invoice_num)
+        return real_make_row(m, user_name, invoice_num)
+
+    with monkeypatch.context() as crash:
+        crash.setattr(LedgerWriter, "flush", lambda self: 0)
+        crash.setattr(IngestCheckpoint, "mark_files", lambda self, keys: None)
+        crash.setattr(srd, "make_row", make_row)
+        crash.setattr(async_ingest, "make_row", make_row)
+        with pytest.raises(Crash):
+            run_async(tmp_path) if mode == "async" else run_sync(mode == "memory")
+
+    downloaded = slack.calls["files"]
+    assert ledger(tmp_path)[0] == []
+    run_async(tmp_path) if mode == "async" else run_sync(mode == "memory")
+
+    assert slack.calls["files"] == downloaded
+    rows, files = ledger(tmp_path)
+    assert [(r[0], r[1]) for r in rows] == [("R001", "receipt 0"), ("R002", "receipt 1"), ("R003", "receipt 2")]
+    assert sorted(p.name for p in (tmp_path / "downloads").iterdir()) == ["R001.jpg", "R002.jpg", "R003.jpg"]
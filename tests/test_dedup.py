@@ -0,0 +1,139 @@
+# Reposts and re-uploads: dedup.DedupIndex against a throwaway receipt store. perceptual_hash needs
+# cv2, so the tests hand in their own hashes
+import random, sqlite3
+import pytest
+import dedup
+from dedup import DedupIndex, FileCheck, PHASH_BANDS, allocation_key, duplicate_row, phash_bands
+from receipt_store import ReceiptStore
+
+@pytest.fixture
+def db(tmp_path):
+    return tmp_path / "receipts.sqlite"
+
+@pytest.fixture
+def index(db):
+    with DedupIndex(db) as index:
+        yield index
+
+def ingest(index, tmp_path, number, file_id, ts, data=b"receipt", phash=None, monkeypatch=None):
+    path = tmp_path / f"{number}.jpg"
+    path.write_bytes(data)
+    if monkeypatch is not None:
+        monkeypatch.setattr(dedup, "perceptual_hash", lambda *args: phash)
+    f = {"id": file_id, "size": len(data)}
+    check = index.before_download(f, ts)
+    if check.duplicate_of is None:
+        check = index.after_download(path, f, ts)
+    index.record(number, f, ts, check)
+    return check
+
+def test_repost_of_same_file_id(index, tmp_path):
+    ingest(index, tmp_path, "R001", "F1", "100.1")
+
+    check = index.before_download({"id": "F1"}, "200.2")
+    assert check == FileCheck("R001", exact=True, by_file_id=True)
+    assert allocation_key({"id": "F1"}, "200.2", check) == "F1:200.2"
+
+def test_same_message_again_is_not_a_repost(index, tmp_path):
+    ingest(index, tmp_path, "R001", "F1", "100.1")
+    assert index.before_download({"id": "F1"}, "100.1").duplicate_of is None
+    assert index.before_download({"id": "F2"}, "100.1").duplicate_of is None
+
+def test_same_bytes_uploaded_again(index, tmp_path):
+    first = ingest(index, tmp_path, "R001", "F1", "100.1", data=b"same bytes")
+    again = ingest(index, tmp_path, "R002", "F2", "200.2", data=b"same bytes")
+    assert first.duplicate_of is None
+    assert again.duplicate_of == "R001" and again.exact and not again.by_file_id
+    assert again.sha256 == first.sha256
+
+    # a third copy points at the first one, not the second
+    third = ingest(index, tmp_path, "R003", "F3", "300.3", data=b"same bytes")
+    assert third.duplicate_of == "R001"
+
+def test_after_download_from_memory(index, tmp_path):
+    ingest(index, tmp_path, "R001", "F1", "100.1", data=b"in memory")
+    check = index.after_download(tmp_path / "not_written.jpg", {"id": "F2"}, "200.2", data=b"in memory")
+    assert check.duplicate_of == "R001" and check.exact
+
+def test_resaved_photo_is_only_flagged(index, tmp_path, monkeypatch):
+    h = random.Random(1).getrandbits(64)
+    ingest(index, tmp_path, "R001", "F1", "100.1", data=b"original", phash=h, monkeypatch=monkeypatch)
+
+    near = h ^ (1 << 0) ^ (1 << 20) ^ (1 << 40) ^ (1 << 63)  # 4 bits, one per band
+    check = ingest(index, tmp_path, "R002", "F2", "200.2", data=b"resized", phash=near, monkeypatch=monkeypatch)
+    assert check.duplicate_of == "R001" and not check.exact
+
+    far = h ^ 0b11111  # 5 bits
+    check = ingest(index, tmp_path, "R003", "F3", "300.3", data=b"another", phash=far, monkeypatch=monkeypatch)
+    assert check.duplicate_of is None
+
+def test_phash_check_off(db, tmp_path, monkeypatch):
+    with DedupIndex(db, phash_distance=0) as index:
+        ingest(index, tmp_path, "R001", "F1", "100.1", data=b"original", phash=7, monkeypatch=monkeypatch)
+        check = ingest(index, tmp_path, "R002", "F2", "200.2", data=b"resized", phash=7, monkeypatch=monkeypatch)
+    assert check.duplicate_of is None
+
+def test_band_prefilter_finds_what_a_full_scan_finds(index):
+    rng = random.Random(2)
+    stored = {}
+    for n in range(300):
+        h = rng.getrandbits(64)
+        if n % 3 == 0 and stored:
+            # near copies of earlier hashes, up to the distance
+            h = rng.choice(list(stored.values()))
+            for bit in rng.sample(range(64), rng.randint(1, index.phash_distance)):
+                h ^= 1 << bit
+        stored[f"R{n:03d}"] = h
+        index.record(f"R{n:03d}", {"id": f"F{n}"}, "1", FileCheck(phash=h))
+
+    for _ in range(200):
+        probe = rng.choice(list(stored.values())) ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64))
+        expected = {number for number, h in stored.items() if (h ^ probe).bit_count() <= index.phash_distance}
+        found = {number for number, h in index._phash_candidates(probe, ("", ""))
+                 if (int(h, 16) ^ probe).bit_count() <= index.phash_distance}
+        assert found == expected
+
+def test_bands_cover_the_hash():
+    h = random.Random(3).getrandbits(64)
+    bands = phash_bands(h)
+    assert len(bands) == PHASH_BANDS
+    assert sum(b << (i * dedup.PHASH_BAND_BITS) for i, b in enumerate(bands)) == h
+
+def test_old_index_gets_bands(db, tmp_path, monkeypatch):
+    h = random.Random(4).getrandbits(64)
+    conn = sqlite3.connect(db)
+    conn.execute("""
+        CREATE TABLE receipt_files (receipt_number TEXT PRIMARY KEY, file_id TEXT, ts TEXT, size INTEGER,
+                                    sha256 TEXT, phash TEXT, duplicate_of TEXT, created_at REAL NOT NULL)""")
+    conn.execute("INSERT INTO receipt_files VALUES ('R001', 'F1', '100.1', 1, 'abc', ?, NULL, 0)", (f"{h:016x}",))
+    conn.commit()
+    conn.close()
+
+    with DedupIndex(db) as index:
+        check = ingest(index, tmp_path, "R002", "F2", "200.2", data=b"resized", phash=h ^ 0b110,
+                       monkeypatch=monkeypatch)
+    assert check.duplicate_of == "R001" and not check.exact
+
+def test_ingested_needs_the_ledger_row(db, index, tmp_path):
+    ingest(index, tmp_path, "R001", "F1", "100.1")
+    assert index.ingested({"id": "F1"}, "100.1") is None
+
+    with ReceiptStore(db) as store:
+        store.add_rows([{"Receipt_Number": "R001"}])
+    assert index.ingested({"id": "F1"}, "100.1") == "R001"
+    assert index.ingested({"id": "F1"}, "200.2") is None
+
+def test_read_only_creates_nothing(db):
+    with DedupIndex(db, read_only=True) as index:
+        assert index.before_download({"id": "F1"}, "100.1").duplicate_of is None
+    assert not db.exists()
+
+def test_duplicate_rows():
+    row = {"Receipt_Number": "R002", "Cost": "Bot_Holder", "Error_Flag": "Null"}
+    assert duplicate_row(row, FileCheck()) is row
+
+    exact = duplicate_row(row, FileCheck("R001", exact=True))
+    assert exact["Error_Flag"] == "Duplicate of R001" and exact["Cost"] == "Null"
+
+    possible = duplicate_row(row, FileCheck("R001"))
+    assert possible["Error_Flag"] == "Possible duplicate of R001" and possible["Cost"] == "Bot_Holder"
@@ -0,0 +1,69 @@
+# extract_fields on hand written OCR text
+import pytest
+import field_extractor
+from field_extractor import DATE_RE, extract_fields, iso_date
+
+RECEIPT = """CANADIAN TIRE #123
+03/12/2025 14:02
+WIPER BLADES        24.99
+SUBTOTAL            24.99
+HST 13%              3.25
+TOTAL            $ 28.24
+"""
+
+def test_receipt_fields():
+    found = extract_fields(RECEIPT)
+    assert found.supplier == "CANADIAN TIRE #123"
+    assert found.date == "2025-03-12"
+    assert (found.subtotal, found.tax, found.total) == ("24.99", "3.25", "28.24")
+    assert found.confidence["total"] == 100.0
+
+def test_bare_dollar_leaves_currency_empty(monkeypatch):
+    monkeypatch.setitem(field_extractor.CURRENCY_CODES, "$", None)
+    found = extract_fields(RECEIPT)
+    assert found.currency is None and "currency" not in found.confidence
+
+def test_bare_dollar_from_setting(monkeypatch):
+    monkeypatch.setitem(field_extractor.CURRENCY_CODES, "$", "CAD")
+    assert extract_fields(RECEIPT).currency == "CAD"
+
+def test_currency_code_on_a_later_line(monkeypatch):
+    monkeypatch.setitem(field_extractor.CURRENCY_CODES, "$", None)
+    found = extract_fields("SHOP\nSUBTOTAL $ 10.00\nTOTAL CAD 10.00\n")
+    assert found.currency == "CAD"
+
+def test_symbol_currencies():
+    assert extract_fields("SHOP\nTOTAL € 12.00\n").currency == "EUR"
+    assert extract_fields("SHOP\nTOTAL £1,234.50\n").total == "1234.50"
+
+@pytest.mark.parametrize("text, order, expected", [
+    ("12-MAR-2025", "MDY", "2025-03-12"),
+    ("03/04/2025", "MDY", "2025-03-04"),
+    ("03/04/2025", "DMY", "2025-04-03"),
+    ("25/12/25", "MDY", "2025-12-25"),  # day first when it can only be a day
+])
+def test_dates(text, order, expected):
+    assert (iso_date(DATE_RE.search(text), order) or text) == expected
+
+def test_date_as_read_when_not_a_date():
+    found = extract_fields("SHOP\n31-FOO-2025\nTOTAL 1.00")
+    assert found.date == "31-FOO-2025" and found.confidence["date"] < 100
+
+def test_most_specific_keyword_wins():
+    found = extract_fields("SHOP\nTOTAL TAX 1.30\nTOTAL 11.30\n")
+    assert found.tax == "1.30" and found.total == "11.30"
+
+def test_total_that_doesnt_add_up_scores_lower():
+    good = extract_fields("SHOP\nSUBTOTAL 10.00\nTAX 1.30\nTOTAL 11.30\n")
+    bad = extract_fields("SHOP\nSUBTOTAL 10.00\nTAX 1.30\nTOTAL 19.30\n")
+    assert good.confidence["total"] == 100.0
+    assert bad.confidence["total"] < good.confidence["total"]
+
+def test_line_confidence_is_used():
+    found = extract_fields("SHOP\nTOTAL 11.30", [90.0, 40.0])
+    assert found.confidence["supplier"] == 90.0
+    assert found.confidence["total"] == 40.0
+
+def test_nothing_found():
+    found = extract_fields("")
+    assert found.supplier is None and found.total is None and found.confidence == {}
@@ -0,0 +1,83 @@
+# Resuming an interrupted channel_history run from TS_JSON and its journal
+import json
+from ingest_checkpoint import IngestCheckpoint, journal_key
+
+def test_fresh_run(tmp_path):
+    ckpt = IngestCheckpoint(tmp_path / "last_ts.json")
+    assert ckpt.last_ts == 0 and ckpt.run is None
+    assert ckpt.start_run() is False
+    assert ckpt.oldest == 0 and ckpt.cursor is None
+    assert json.loads((tmp_path / "last_ts.json").read_text())["run"]["oldest"] == 0
+    assert not (tmp_path / "last_ts.json.tmp").exists()
+
+def test_resume_after_crash(tmp_path):
+    path = tmp_path / "last_ts.json"
+    ckpt = IngestCheckpoint(path)
+    ckpt.start_run()
+    ckpt.save_page([{"ts": "100.1"}, {"ts": "105.5"}], "cursor-2")
+    ckpt.mark_files(["F1", "F2"])
+    # crash here, before page_done
+
+    again = IngestCheckpoint(path)
+    assert again.start_run() is True
+    assert again.page == [{"ts": "100.1"}, {"ts": "105.5"}]
+    assert again.next_cursor == "cursor-2"
+    assert again.is_done("F1") and again.is_done("F2") and not again.is_done("F3")
+
+def test_torn_journal_line_is_redone(tmp_path):
+    path = tmp_path / "last_ts.json"
+    ckpt = IngestCheckpoint(path)
+    ckpt.start_run()
+    ckpt.mark_files(["F1"])
+    with open(ckpt.journal_path, "a") as f:
+        f.write("F2")  # the crash came mid write
+
+    again = IngestCheckpoint(path)
+    assert again.is_done("F1")
+    assert not again.is_done("F2")
+
+def test_page_done_moves_the_cursor(tmp_path):
+    ckpt = IngestCheckpoint(tmp_path / "last_ts.json")
+    ckpt.start_run()
+    ckpt.save_page([{"ts": "100.1"}, {"ts": "105.5"}], "cursor-2")
+    ckpt.page_done()
+    assert ckpt.cursor == "cursor-2" and ckpt.page is None
+    assert ckpt.run["high_ts"] == "105.5"
+
+    again = IngestCheckpoint(tmp_path / "last_ts.json")
+    assert again.cursor == "cursor-2"
+
+def test_finish_moves_last_ts_and_drops_the_journal(tmp_path):
+    path = tmp_path / "last_ts.json"
+    ckpt = IngestCheckpoint(path)
+    ckpt.start_run()
+    ckpt.save_page([{"ts": "105.5"}], None)
+    ckpt.mark_files(["F1"])
+    ckpt.page_done()
+    ckpt.finish()
+
+    assert not ckpt.journal_path.exists()
+    again = IngestCheckpoint(path)
+    assert again.last_ts == "105.5" and again.run is None
+    assert not again.is_done("F1")
+    assert again.start_run() is False
+    assert again.oldest == "105.5"
+
+def test_journal_without_a_run_is_ignored(tmp_path):
+    path = tmp_path / "last_ts.json"
+    path.write_text(json.dumps({"last_ts": "50.0", "run": None}))
+    (tmp_path / "last_ts.json.journal").write_text("F1\n")
+
+    ckpt = IngestCheckpoint(path)
+    assert not ckpt.is_done("F1")
+    ckpt.start_run()  # a new run starts with an empty journal
+    assert not ckpt.journal_path.exists()
+
+def test_repost_has_its_own_journal_entry(tmp_path):
+    ckpt = IngestCheckpoint(tmp_path / "last_ts.json")
+    ckpt.start_run()
+    ckpt.mark_files([journal_key({"id": "F1"}, "100.1")])
+
+    again = IngestCheckpoint(tmp_path / "last_ts.json")
+    assert again.is_done(journal_key({"id": "F1"}, "100.1"))
+    assert not again.is_done(journal_key({"id": "F1"}, "200.2"))
@@ -0,0 +1,34 @@
+# Placeholder highlighting as conditional formatting and the rows it applies to
+import pytest
+from receipt_store import COLUMNS
+
+openpyxl = pytest.importorskip("openpyxl")
+from ledger import EXCEL_MAX_ROW, install_highlights, sheet_values
+from openpyxl.utils import get_column_letter
+
+def rules(ws):
+    return [(str(cf.sqref), rule.formula, rule.dxf) for cf in ws.conditional_formatting for rule in cf.rules]
+
+def test_rules_cover_every_row_once():
+    ws = openpyxl.Workbook().active
+    assert install_highlights(ws)
+    assert not install_highlights(ws)
+
+    found = rules(ws)
+    assert [formula for _, formula, _ in found] == [['"Bot_Holder"'], ['"REPLACE"']]
+    assert {cells for cells, _, _ in found} == {f"A2:{get_column_letter(len(COLUMNS))}{EXCEL_MAX_ROW}"}
+    assert found[0][2].fill.fgColor.rgb.endswith("FFC7CE")
+    assert found[1][2].font.color.rgb.endswith("9C0006")
+
+def test_rules_survive_a_save(tmp_path):
+    wb = openpyxl.Workbook()
+    install_highlights(wb.active)
+    wb.save(tmp_path / "ledger.xlsx")
+    assert not install_highlights(openpyxl.load_workbook(tmp_path / "ledger.xlsx").active)
+
+def test_null_is_a_blank_cell():
+    values = sheet_values({"Receipt_Number": "R001", "Message": "Null", "Cost": "Bot_Holder"})
+    assert len(values) == len(COLUMNS)
+    assert values[COLUMNS.index("Message")] is None
+    assert values[COLUMNS.index("Cost")] == "Bot_Holder"
+    assert values[COLUMNS.index("Receipt_Number")] == "R001"
@@ -0,0 +1,46 @@
+# Receipts that can't be read stay failed in the state store, so the next ocr run picks them up again
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("pandas")
+pytest.importorskip("pytesseract")
+
+from receipt_ocr import ocr_files
+from state_store import StateStore
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # OCR cache and receipt store with their default paths
+    monkeypatch.delenv("EXCEL_PATH", raising=False)
+    with StateStore(tmp_path / "state.sqlite") as store:
+        yield store
+
+def test_undecodable_image_is_failed(tmp_path, store):
+    (tmp_path / "dl").mkdir()
+    bad = tmp_path / "dl" / "R001.jpg"
+    bad.write_bytes(b"\xff\xd8\xff" + b"not really a jpeg")
+
+    assert ocr_files([bad], store, workers=1) == {}
+    assert store.status(bad) == "failed"
+    assert store.new_files(tmp_path / "dl") == [bad]
+
+# A PDF or HEIC that turned up before PyMuPDF / pillow-heif was installed, tried again once it is
+@pytest.mark.parametrize("name, data, module", [
+    ("R002.heic", b"\x00\x00\x00\x18ftypheic\x00\x00\x00\x00mif1heic", "pillow_heif"),
+    ("R003.pdf", b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n", "fitz"),
+])
+def test_missing_decoder_is_failed(tmp_path, store, name, data, module):
+    try:
+        __import__(module)
+        pytest.skip(f"{module} is installed")
+    except ImportError:
+        pass
+    (tmp_path / "dl").mkdir()
+    receipt = tmp_path / "dl" / name
+    receipt.write_bytes(data)
+
+    assert ocr_files([receipt], store, workers=1) == {}
+    assert store.status(receipt) == "failed"
+    error = store.conn.execute("SELECT error FROM processed_files WHERE path = ?", (str(receipt),)).fetchone()[0]
+    assert "pip install" in error
+    assert store.new_files(tmp_path / "dl") == [receipt]
@@ -0,0 +1,30 @@
+# streaming_pipeline against benchmarks.fake_slack, with a stand-in for tesseract
+import sqlite3
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("pandas")
+
+def fake_ocr(receipt, **kwargs):
+    return SimpleNamespace(purchase_date="2025-09-03", supplier="Shop", cost_text="12.50", text="Shop\nTOTAL 12.50")
+
+def test_failed_download_keeps_the_ocr_done_so_far(slack, tmp_path, monkeypatch):
+    import requests
+    import pipeline
+    monkeypatch.setattr(pipeline, "ocr_process", lambda: (fake_ocr, "test"))
+    # the newest message's file is gone, the two before it are downloaded and OCR'd first
+    (tmp_path / "source" / "receipt_2.jpg").unlink()
+
+    with pytest.raises(requests.HTTPError):
+        pipeline.streaming_pipeline("CTEST", download_workers=1, ocr_workers=1)
+
+    conn = sqlite3.connect(tmp_path / ".receipts.sqlite")
+    costs = conn.execute("SELECT Receipt_Number, Cost FROM receipts ORDER BY Receipt_Number").fetchall()
+    conn.close()
+    assert costs == [("R001", "12.50"), ("R002", "12.50")]
+
+    conn = sqlite3.connect(tmp_path / ".app_state.sqlite")
+    states = conn.execute("SELECT path, status FROM processed_files ORDER BY path").fetchall()
+    conn.close()
+    assert [(p.rsplit("/", 1)[-1], s) for p, s in states] == [("R001.jpg", "done"), ("R002.jpg", "done")]
@@ -0,0 +1,69 @@
+# Receipt numbers handed out from several connections at once, each allocate() its own BEGIN IMMEDIATE
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from receipt_ids import ReceiptIds
+from receipt_store import ReceiptStore
+
+def test_numbers_count_up(tmp_path):
+    with ReceiptIds(tmp_path / "receipts.sqlite") as ids:
+        assert [ids.allocate() for _ in range(3)] == ["R001", "R002", "R003"]
+
+def test_same_file_same_number(tmp_path):
+    with ReceiptIds(tmp_path / "receipts.sqlite") as ids:
+        first = ids.allocate("F1")
+        assert ids.allocate("F2") != first
+        assert ids.allocate("F1") == first
+        assert ids.lookup("F1") == first
+        assert ids.lookup("F3") is None
+
+def test_carries_on_after_the_ledger_and_folder(tmp_path):
+    db = tmp_path / "receipts.sqlite"
+    with ReceiptStore(db) as store:
+        store.add_rows([{"Receipt_Number": "R007"}, {"Receipt_Number": "R003"}])
+    (tmp_path / "downloads").mkdir()
+    (tmp_path / "downloads" / "R009.jpg").write_bytes(b"")
+
+    with ReceiptIds(db, seed_dir=tmp_path / "downloads") as ids:
+        assert ids.allocate() == "R010"
+    # the counter is only seeded once
+    (tmp_path / "downloads" / "R050.jpg").write_bytes(b"")
+    with ReceiptIds(db, seed_dir=tmp_path / "downloads") as ids:
+        assert ids.allocate() == "R011"
+
+def test_concurrent_connections_never_share_a_number(tmp_path):
+    db = tmp_path / "receipts.sqlite"
+    ReceiptIds(db).close()
+    workers, per_worker = 8, 25
+    start = threading.Barrier(workers)
+
+    # one connection per thread, like separate processes on the same database
+    def allocate_many(w):
+        with ReceiptIds(db) as ids:
+            start.wait()
+            return [ids.allocate(f"F{w}-{n}") for n in range(per_worker)]
+
+    with ThreadPoolExecutor(workers) as pool:
+        numbers = [n for batch in pool.map(allocate_many, range(workers)) for n in batch]
+
+    assert len(set(numbers)) == workers * per_worker
+    assert sorted(numbers) == [f"R{n:03d}" for n in range(1, workers * per_worker + 1)]
+
+def test_concurrent_asks_for_one_file_get_one_number(tmp_path):
+    db = tmp_path / "receipts.sqlite"
+    ReceiptIds(db).close()
+    workers = 8
+    start = threading.Barrier(workers)
+
+    def allocate_same(_):
+        with ReceiptIds(db) as ids:
+            start.wait()
+            return ids.allocate("F1")
+
+    with ThreadPoolExecutor(workers) as pool:
+        numbers = set(pool.map(allocate_same, range(workers)))
+    assert numbers == {"R001"}
+
+def test_shared_instance_across_threads(tmp_path):
+    with ReceiptIds(tmp_path / "receipts.sqlite") as ids, ThreadPoolExecutor(8) as pool:
+        numbers = list(pool.map(lambda n: ids.allocate(f"F{n}"), range(100)))
+    assert len(set(numbers)) == 100
@@ -0,0 +1,107 @@
+# ReceiptStore as the ledger and export_excel keeping hand edits from the last workbook
+import sqlite3
+import pytest
+from receipt_store import COLUMNS, ReceiptStore
+
+openpyxl = pytest.importorskip("openpyxl")
+
+def row(num, **fields):
+    return {"Receipt_Number": num, "Description": "REPLACE", "Supplier": "REPLACE", "Cost": "Bot_Holder",
+            "Reimbursed": "No", "Subtotal": None, **fields}
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.delenv("EXCEL_PATH", raising=False)
+    return tmp_path / ".receipts.sqlite"
+
+def sheet(path):
+    wb = openpyxl.load_workbook(path, read_only=True)
+    try:
+        rows = wb["Sheet1"].iter_rows(values_only=True)
+        header = next(rows)
+        return [dict(zip(header, values)) for values in rows]
+    finally:
+        wb.close()
+
+def test_add_rows_keeps_the_first(db):
+    with ReceiptStore(db) as store:
+        assert store.add_rows([row("R001"), row("R002")]) == 2
+        assert store.add_rows([row("R001", Supplier="Other")]) == 0
+        assert [r["Receipt_Number"] for r in store.rows()] == ["R001", "R002"]
+        assert store.get("R001")["Supplier"] == "REPLACE"
+
+def test_fill_fields_only_replaces_placeholders(db):
+    with ReceiptStore(db) as store:
+        store.add_rows([row("R001", Description="Wipers")])
+        changed = store.fill_fields({"R001": {"Description": "OCR text", "Supplier": "CANADIAN TIRE",
+                                              "Cost": "28.24", "Subtotal": "24.99", "Reimbursed": None,
+                                              "Tax": "REPLACE", "Receipt_Number": "R009", "Unknown": "x"}})
+        assert changed == 3
+        got = store.get("R001")
+        assert (got["Description"], got["Supplier"], got["Cost"], got["Subtotal"]) == ("Wipers", "CANADIAN TIRE", "28.24", "24.99")
+        assert (got["Reimbursed"], got["Tax"]) == ("No", None)
+        # a second pass finds nothing left to fill
+        assert store.fill_fields({"R001": {"Supplier": "Someone else"}}) == 0
+
+def test_old_store_gets_new_columns(db):
+    conn = sqlite3.connect(db)
+    old = [col for col in COLUMNS if col not in ("Subtotal", "Tax", "Currency")]
+    conn.execute(f"CREATE TABLE receipts ({', '.join(old)}, updated_at REAL NOT NULL)")
+    conn.execute("INSERT INTO receipts (Receipt_Number, Supplier, updated_at) VALUES ('R001', 'REPLACE', 0)")
+    conn.commit()
+    conn.close()
+
+    with ReceiptStore(db) as store:
+        assert store.get("R001")["Tax"] is None
+        assert store.fill_fields({"R001": {"Tax": "3.25"}}) == 1
+
+def test_imports_the_workbook_once(db, tmp_path):
+    excel = tmp_path / "ledger.xlsx"
+    wb = openpyxl.Workbook()
+    wb.active.title = "Sheet1"
+    wb.active.append(["Receipt_Number", "Supplier", "Reimbursed"])
+    wb.active.append(["R001", "Costco", "Yes"])
+    wb.active.append([None, None, None])
+    wb.save(excel)
+
+    with ReceiptStore(db, legacy_excel=str(excel)) as store:
+        assert [(r["Receipt_Number"], r["Supplier"]) for r in store.rows()] == [("R001", "Costco")]
+    with ReceiptStore(db, legacy_excel=str(excel)) as store:
+        store.update_fields({"R001": {"Supplier": "Costco Wholesale"}})
+    with ReceiptStore(db, legacy_excel=str(excel)) as store:
+        assert store.count() == 1 and store.get("R001")["Supplier"] == "Costco Wholesale"
+
+def test_read_only_writes_nothing(db):
+    with ReceiptStore(db, read_only=True) as store:
+        assert store.rows() == []
+    with ReceiptStore(db) as store:
+        store.add_rows([row("R001")])
+    with ReceiptStore(db, read_only=True) as store:
+        assert store.count() == 1
+
+def test_export_keeps_hand_edits(db, tmp_path):
+    from ledger import export_excel
+    excel = tmp_path / "ledger.xlsx"
+    with ReceiptStore(db) as store:
+        store.add_rows([row("R001", Message="Null"), row("R002")])
+    assert export_excel(excel, db) == 2
+    assert [r["Message"] for r in sheet(excel)] == [None, None]
+
+    # someone marks R001 reimbursed and fixes R002's supplier, while OCR fills R002's cost
+    wb = openpyxl.load_workbook(excel)
+    ws = wb["Sheet1"]
+    ws.cell(2, COLUMNS.index("Reimbursed") + 1, "Yes")
+    ws.cell(3, COLUMNS.index("Supplier") + 1, "Home Depot")
+    wb.save(excel)
+    with ReceiptStore(db) as store:
+        store.fill_fields({"R002": {"Cost": "12.00", "Supplier": "HOME DEPOT #7"}})
+
+    export_excel(excel, db)
+    rows = {r["Receipt_Number"]: r for r in sheet(excel)}
+    assert rows["R001"]["Reimbursed"] == "Yes"
+    assert (rows["R002"]["Supplier"], rows["R002"]["Cost"]) == ("Home Depot", "12.00")
+    with ReceiptStore(db) as store:
+        # the Null exported as a blank cell isn't taken for an edit
+        assert store.get("R001")["Message"] == "Null"
+        assert store.get("R002")["Supplier"] == "Home Depot"
+    assert sorted(p.name for p in tmp_path.iterdir() if p.suffix == ".xlsx") == ["ledger.xlsx"]
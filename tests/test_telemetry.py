@@ -0,0 +1,119 @@
+# Counters, histograms and spans, each test on a registry of its own
+import json, threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import telemetry
+from telemetry import Registry
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = Registry()
+    monkeypatch.setattr(telemetry, "REGISTRY", registry)
+    return registry
+
+def test_counters_by_label(registry):
+    registry.inc("slack_api_calls_total", method="users.list")
+    registry.inc("slack_api_calls_total", 2, method="conversations.history")
+    assert registry.counter("slack_api_calls_total", method="users.list") == 1
+    assert registry.counter("slack_api_calls_total") == 3
+    assert registry.counter("nothing_total") == 0
+
+def test_counters_are_thread_safe(registry):
+    def bump(_):
+        for _ in range(1000):
+            registry.inc("ledger_rows_total")
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(bump, range(8)))
+    assert registry.counter("ledger_rows_total") == 8000
+
+def test_histogram_buckets_and_quantiles(registry):
+    for value in (0.001, 0.02, 0.02, 3.0):
+        registry.observe("stage_seconds", value, stage="x")
+    registry.observe("stage_seconds", float("nan"), stage="x")  # dropped
+    registry.observe("stage_seconds", None, stage="x")
+
+    hist = registry.histograms[("stage_seconds", (("stage", "x"),))]
+    assert hist.count == 4 and hist.sum == pytest.approx(3.041)
+    assert 0.01 <= hist.quantile(0.5) <= 0.025
+    assert hist.quantile(0.99) <= 5.0
+
+def test_prometheus_text(registry):
+    registry.inc("download_bytes_total", 2048)
+    registry.observe("download_size_bytes", 2048)
+    registry.inc("slack_api_errors_total", method="users.list", error='bad "quote"')
+    text = registry.prometheus()
+
+    assert "# TYPE receipt_bot_download_bytes_total counter" in text
+    assert "receipt_bot_download_bytes_total 2048" in text
+    assert 'receipt_bot_download_size_bytes_bucket{le="16000"} 1' in text
+    assert 'receipt_bot_download_size_bytes_bucket{le="+Inf"} 1' in text
+    assert 'error="bad \\"quote\\""' in text
+    assert f'run_id="{registry.run_id}"' in text
+
+def test_helpers(registry):
+    class Error(Exception):
+        response = {"error": "ratelimited"}
+
+    telemetry.slack_call("users.list")
+    telemetry.slack_call("users.list", Error())
+    telemetry.cache_lookup("user", True)
+    telemetry.cache_lookup("user", False)
+    telemetry.cache_lookup("user", True)
+    telemetry.downloaded(100)
+
+    summary = registry.summary()
+    assert summary["slack_api_calls"] == 2
+    assert registry.counter("slack_api_errors_total", method="users.list", error="ratelimited") == 1
+    assert summary["cache_hit_rate"] == {"user": round(2 / 3, 3)}
+    assert summary["download_bytes"] == 100
+
+def test_download_errors(registry):
+    class Response:
+        status_code = 404
+    class HTTPError(Exception):
+        response = Response()
+    class ClientResponseError(Exception):
+        status = 503
+
+    telemetry.download_failed(HTTPError())
+    telemetry.download_failed(ClientResponseError())
+    telemetry.download_failed(ConnectionError())
+    assert registry.counter("download_errors_total", error="http_404") == 1
+    assert registry.counter("download_errors_total", error="http_503") == 1
+    assert registry.counter("download_errors_total", error="ConnectionError") == 1
+    assert registry.summary()["download_errors"] == 3
+
+def test_span_times_and_counts_errors(registry):
+    with telemetry.span("outer"):
+        assert telemetry._span.get() == "outer"
+        with pytest.raises(ValueError):
+            with telemetry.span("inner"):
+                raise ValueError
+    assert telemetry._span.get() is None
+    assert registry.histograms[("stage_seconds", (("stage", "outer"),))].count == 1
+    assert registry.counter("stage_errors_total", stage="inner") == 1
+    assert registry.counter("stage_errors_total", stage="outer") == 0
+
+def test_traced(registry):
+    @telemetry.traced()
+    def work(x):
+        return telemetry._span.get(), x
+    assert work(1) == ("work", 1)
+
+def test_context_carried_into_threads():
+    seen = []
+    with telemetry.span("ingest"):
+        with ThreadPoolExecutor(2) as pool:
+            spans = [pool.submit(telemetry.with_context(telemetry._span.get)).result() for _ in range(4)]
+        thread = threading.Thread(target=telemetry.with_context(lambda: seen.append(telemetry._span.get())))
+        thread.start()
+        thread.join()
+    assert spans == ["ingest"] * 4 and seen == ["ingest"]
+
+def test_write_reports(registry, tmp_path):
+    registry.inc("ledger_rows_total", 3)
+    telemetry.write_reports(tmp_path / "out" / "bot.prom", tmp_path / "out" / "summary.json")
+
+    assert "receipt_bot_ledger_rows_total 3" in (tmp_path / "out" / "bot.prom").read_text()
+    assert json.loads((tmp_path / "out" / "summary.json").read_text())["counters"]["ledger_rows_total"] == {"all": 3}
+    assert sorted(p.name for p in (tmp_path / "out").iterdir()) == ["bot.prom", "summary.json"]
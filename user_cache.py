@@ -0,0 +1,140 @@
+import os, json, time
+from pathlib import Path
+from typing import Optional
+from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+import telemetry
+
+log = telemetry.get_logger("user_cache")
+
+USER_CACHE_JSON = os.environ.get("USER_CACHE_JSON", ".user_cache.json")
+USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", 7 * 24 * 3600))  # seconds before a full refresh
+
+def _member_name(member: dict) -> Optional[str]:
+    profile = member.get("profile",{}) or {}
+    return profile.get("real_name") or profile.get("display_name")
+
+# One users.list page per iteration as {id: name}, a failed page raises SlackApiError
+def user_pages(client: WebClient):
+    cursor = None
+    while True:
+        try:
+            response = client.users_list(limit=200, cursor=cursor)
+        except SlackApiError as e:
+            telemetry.slack_call("users.list", e)
+            raise
+        telemetry.slack_call("users.list")
+        yield {m.get("id"): _member_name(m) for m in response.get("members", [])}
+
+        cursor = response.get("response_metadata", {}).get("next_cursor")
+        if not cursor:
+            break
+
+# Pages through users.list, this is the full (slow) refresh. None when a page failed, a partial
+# directory would pass for the whole workspace
+def fetch_user_map(client: WebClient) -> Optional[dict[str, str]]:
+    user_map = {}
+    try:
+        for page in user_pages(client):
+            user_map.update(page)
+    except SlackApiError as e:
+        log.error("users.list failed", error=e.response.get("error"))
+        return None
+    return user_map
+
+class UserDirectory:
+    """On disk user id -> name cache. Misses are looked up one id at a time with users.info,
+    the whole directory is only re-paged once the cache is older than the TTL."""
+
+    def __init__(self, client: WebClient, path=USER_CACHE_JSON, ttl: int = USER_CACHE_TTL):
+        self.client = client
+        self.path = Path(path)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.api_calls = 0
+        self._dirty = False
+        self._refresh_failed = False
+        self.users, self.refreshed_at = self._load()
+
+    def _load(self) -> tuple[dict, float]:
+        try:
+            with open(self.path) as f:
+                cache = json.load(f)
+            return cache["users"], float(cache["refreshed_at"])
+        except FileNotFoundError:
+            # nothing cached yet, fill it lazily instead of paging the whole workspace
+            return {}, time.time()
+        except (KeyError, ValueError) as e:
+            log.error("ignoring broken user cache", path=str(self.path), error=str(e))
+            return {}, time.time()
+
+    # after a failed refresh the old directory is used for the rest of the run, next run tries again
+    def expired(self) -> bool:
+        return not self._refresh_failed and time.time() - self.refreshed_at > self.ttl
+
+    # Replaces the directory only once every page is in, a failure keeps the old map and its age
+    def refresh(self) -> bool:
+        users = {}
+        try:
+            for page in user_pages(self.client):
+                self.api_calls += 1
+                users.update(page)
+        except SlackApiError as e:
+            self.api_calls += 1
+            self._refresh_failed = True
+            log.error("users.list failed, keeping the cached directory", error=e.response.get("error"),
+                      cached_users=len(self.users))
+            return False
+
+        self.users = users
+        self.refreshed_at = time.time()
+        self._dirty = True
+        return True
+
+    def _lookup(self, user_id: str) -> Optional[str]:
+        self.api_calls += 1
+        try:
+            response = self.client.users_info(user=user_id)
+            telemetry.slack_call("users.info")
+        except SlackApiError as e:
+            telemetry.slack_call("users.info", e)
+            log.error("users.info failed", user=user_id, error=e.response.get("error"))
+            return None
+        return _member_name(response.get("user", {}) or {})
+
+    def get(self, user_id: str) -> Optional[str]:
+        if self.expired():
+            self.refresh()
+
+        if user_id in self.users:
+            self.hits += 1
+            telemetry.cache_lookup("user", True)
+            return self.users[user_id]
+
+        self.misses += 1
+        telemetry.cache_lookup("user", False)
+        name = self._lookup(user_id)
+        if name is not None:
+            self.users[user_id] = name
+            self._dirty = True
+        return name
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump({"refreshed_at": self.refreshed_at, "users": self.users}, f)
+        os.replace(tmp, self.path)
+        self._dirty = False
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "api_calls": self.api_calls,
+            "cached_users": len(self.users),
+        }